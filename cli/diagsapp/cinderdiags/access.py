@@ -16,6 +16,8 @@ import argparse
 import logging
 
 from cinderdiags import conf_reader
+from cinderdiags import formatters
+from cinderdiags import profiler
 from cliff.lister import Lister
 
 
@@ -43,20 +45,46 @@ class CheckCredentials(Lister):
                             dest='data',
                             help='json structure contain cli.conf data')
 
+        parser.add_argument('-parallel',
+                            dest='parallel',
+                            type=int,
+                            metavar='N',
+                            help='number of nodes to check at the same time '
+                                 '(defaults to max_workers in cli.conf)')
+        parser.add_argument('-processes',
+                            dest='processes',
+                            type=int,
+                            metavar='N',
+                            help='number of worker processes to spread the '
+                                 'nodes across (defaults to processes in '
+                                 'cli.conf)')
+        parser.add_argument('-profile',
+                            dest='profile',
+                            action='store_true',
+                            help='time each phase of the check per node, '
+                                 'add a Profile column and write a timing '
+                                 'table to stderr')
+
         return parser
 
     def take_action(self, parsed_args):
+        if parsed_args.profile:
+            profiler.start()
         reader = conf_reader.Reader(False,
                                     parsed_args.conf,
-                                    parsed_args.data)
-        result = reader.credentials_check()
+                                    parsed_args.data,
+                                    max_workers=parsed_args.parallel,
+                                    processes=parsed_args.processes)
+        if formatters.is_streaming(parsed_args):
+            result = reader.iter_credentials_check()
+        else:
+            result = reader.credentials_check()
 
         columns = ('Node', 'Connect')
-        data = []
-        for pkg in result:
-            data.append((
-                pkg['node'],
-                pkg['connect']),
-            )
+        data = ((pkg['node'],
+                 pkg['connect'])
+                for pkg in result)
 
+        if parsed_args.profile:
+            return profiler.report(columns, data)
         return (columns, data)
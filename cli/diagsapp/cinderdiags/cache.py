@@ -0,0 +1,245 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Small JSON file caches that let repeated cinderdiags runs skip work whose
+result rarely changes.  Cache files are only readable by their owner since
+they can hold data copied from the nodes, and they are only used in a cache
+directory that belongs to the user running cinderdiags and that nobody else
+can write to, so no one else can plant cache entries.
+
+Writes take an exclusive lock on a .lock file next to the cache file, so
+fleet worker processes sharing a cache directory do not lose each other's
+entries.
+"""
+
+import contextlib
+import errno
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from cinderdiags import constant
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# cache directories already reported as unsafe
+unsafe_directories = set()
+
+
+class FileCache(object):
+
+    def __init__(self, name, directory=None, ttl=None):
+        """JSON file of cached values keyed by string
+
+        :param name: name of the cache file
+        :param directory: cache directory, defaults to constant.CACHE_DIRECTORY
+        :param ttl: seconds a cached value stays valid, None for no expiry
+        """
+        self.directory = directory or constant.CACHE_DIRECTORY
+        self.path = os.path.join(self.directory, name + '.json')
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # entries read by defer() and entries stored since, None when
+        # not deferred
+        self.snapshot = None
+        self.pending = None
+
+    def defer(self):
+        """Read the cache file once and keep the values stored from now on
+        in memory until flush() writes them with a single write
+        """
+        with self.lock:
+            self.snapshot = self.load()
+            self.pending = {}
+
+    def flush(self):
+        """Write the values stored since defer() and stop deferring
+        """
+        with self.lock:
+            pending = self.pending
+            self.snapshot = None
+            self.pending = None
+        if pending:
+            self.store(pending)
+
+    def get(self, key):
+        """Get a cached value
+
+        :return: the value, None if it is missing or expired
+        """
+        with self.lock:
+            entry = self.entries().get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        """Store a value, it must be serializable as JSON
+        """
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        """Store several values with a single write of the cache file
+
+        :param values: dictionary of key to value
+        """
+        now = time.time()
+        self.store(dict((key, {'time': now, 'value': value})
+                        for key, value in values.items()))
+
+    def store(self, new_entries):
+        """Add entries to the cache file, or keep them until flush() while
+        deferred
+
+        :param new_entries: dictionary of key to {'time': ..., 'value': ...}
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.pending.update(new_entries)
+                return
+            # other processes may have written the file since it was read
+            with self.file_lock():
+                entries = self.load()
+                if self.ttl is not None:
+                    # drop expired entries so keys that are never asked for
+                    # again do not pile up
+                    now = time.time()
+                    entries = dict((k, entry)
+                                   for k, entry in entries.items()
+                                   if now - entry['time'] <= self.ttl)
+                entries.update(new_entries)
+                self.save(entries)
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        """Exclusive lock of the cache file across processes, held while it
+        is read and written again
+
+        Without fcntl, or when the lock file can not be opened, writes are
+        only serialized within this process.
+        """
+        fd = None
+        if fcntl is not None:
+            try:
+                if not os.path.lexists(os.path.normpath(self.directory)):
+                    os.makedirs(self.directory, 0o700)
+                if self.directory_is_safe():
+                    fd = os.open(self.path + '.lock',
+                                 os.O_RDWR | os.O_CREAT, 0o600)
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+            except (IOError, OSError) as e:
+                logger.warning("%s -- Unable to lock cache %s" %
+                               (e, self.path))
+                if fd is not None:
+                    os.close(fd)
+                    fd = None
+        try:
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def items(self):
+        """All cached values that have not expired
+
+        :return: list of (key, value, time stored)
+        """
+        with self.lock:
+            entries = self.entries()
+        now = time.time()
+        return [(key, entry['value'], entry['time'])
+                for key, entry in entries.items()
+                if self.ttl is None or now - entry['time'] <= self.ttl]
+
+    def entries(self):
+        """Entries of the cache file, including the ones not written yet
+        while deferred, call with self.lock held
+
+        :return: dictionary of key to {'time': ..., 'value': ...}
+        """
+        if self.pending is None:
+            return self.load()
+        entries = dict(self.snapshot)
+        entries.update(self.pending)
+        return entries
+
+    def load(self):
+        if not self.directory_is_safe():
+            return {}
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self, entries):
+        try:
+            if not os.path.lexists(os.path.normpath(self.directory)):
+                os.makedirs(self.directory, 0o700)
+            if not self.directory_is_safe():
+                return
+            # write a temporary file, created with mode 0600, and rename it
+            # so that readers in other processes never see a partly written
+            # cache
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, 'w') as cache_file:
+                    json.dump(entries, cache_file)
+                os.rename(tmp_path, self.path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except (IOError, OSError, TypeError, ValueError) as e:
+            logger.warning("%s -- Unable to write cache %s" % (e, self.path))
+
+    def directory_is_safe(self):
+        """Checks the cache directory is a directory of the current user
+        that other users can not write to
+
+        :return: True if cache files may be read from and written to it,
+        False if it is unsafe or does not exist
+        """
+        directory = os.path.normpath(self.directory)
+        try:
+            info = os.lstat(directory)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("%s -- Unable to check cache directory %s" %
+                               (e, directory))
+            return False
+        if not stat.S_ISDIR(info.st_mode):
+            problem = 'is not a directory'
+        elif info.st_uid != os.getuid():
+            problem = 'is owned by another user'
+        elif info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            problem = 'is writable by other users'
+        else:
+            return True
+        if directory not in unsafe_directories:
+            unsafe_directories.add(directory)
+            logger.warning("Cache directory %s %s, running without cache" %
+                           (directory, problem))
+        return False
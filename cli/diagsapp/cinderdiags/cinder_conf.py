@@ -0,0 +1,217 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+This parses the text of a cinder.conf file once into sections and options,
+keeping every replication_device entry of a section instead of only the last.
+"""
+
+import collections
+import logging
+import re
+
+from six.moves import configparser
+
+logger = logging.getLogger(__name__)
+
+SECTION_LINE = re.compile(r'^\[(?P<name>[^\]]+)\]')
+OPTION_LINE = re.compile(
+    r'^(?P<option>[^=:\s][^=:]*?)\s*[=:]\s*(?P<value>.*)$')
+MULTI_VALUED = ('replication_device',)
+
+
+def parse_replication_device(value):
+    """Split a replication_device value into its options
+
+    :param value: e.g. 'backend_id:a,replication_mode:periodic,...'
+    :return: dictionary of option to value
+    """
+    device = collections.OrderedDict()
+    for entry in value.split(','):
+        if ':' in entry:
+            option, option_value = entry.split(':', 1)
+            device[option.strip()] = option_value.strip()
+    return device
+
+
+class CinderConf(object):
+
+    def __init__(self, text):
+        """Parsed cinder.conf, read with the ConfigParser methods the checks
+        already use
+
+        :param text: contents of the cinder.conf file
+        """
+        self.defaults = collections.OrderedDict()
+        self.options = collections.OrderedDict()
+        self.multi = {}
+        self.devices = {}
+        self.parse(text)
+
+    @classmethod
+    def from_file(cls, path):
+        """Parse a local cinder.conf file
+
+        :param path: location of the file
+        :return: CinderConf
+        """
+        with open(path) as f:
+            return cls(f.read())
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a parsed cinder.conf stored with to_dict()
+
+        :param data: dictionary from to_dict()
+        :return: CinderConf
+        """
+        conf = cls('')
+        conf.defaults.update(data['defaults'])
+        for section, options in data['sections']:
+            conf.options[section] = collections.OrderedDict(options)
+        for section, option, values in data['multi']:
+            conf.multi[(section, option)] = list(values)
+        conf.parse_devices()
+        return conf
+
+    def to_dict(self):
+        """Compact form of the parsed file that can be stored as JSON
+
+        :return: dictionary
+        """
+        return {
+            'defaults': list(self.defaults.items()),
+            'sections': [[section, list(options.items())]
+                         for section, options in self.options.items()],
+            'multi': [[section, option, values]
+                      for (section, option), values in self.multi.items()],
+        }
+
+    def parse(self, text):
+        section = None
+        option = None
+        continued = False
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped or stripped[0] in '#;':
+                continue
+
+            if option and (continued or line[0].isspace()):
+                # continuation of the previous value, either indented or
+                # after a trailing comma (replication_device entries)
+                self.append(section, option, stripped)
+                continued = self.continues(option, stripped)
+                continue
+
+            header = SECTION_LINE.match(stripped)
+            if header:
+                section = header.group('name').strip()
+                option = None
+                if section != 'DEFAULT' and section not in self.options:
+                    self.options[section] = collections.OrderedDict()
+                continue
+
+            match = OPTION_LINE.match(stripped)
+            if not match or section is None:
+                logger.info("Skipping cinder.conf line: '%s'" % (stripped))
+                option = None
+                continue
+
+            option = match.group('option').strip().lower()
+            value = match.group('value').strip()
+            self.set(section, option, value)
+            continued = self.continues(option, value)
+        self.parse_devices()
+
+    def parse_devices(self):
+        for (section, option), values in self.multi.items():
+            if option == 'replication_device':
+                self.devices[section] = [parse_replication_device(value)
+                                         for value in values]
+
+    @staticmethod
+    def continues(option, value):
+        return option in MULTI_VALUED and value.endswith(',')
+
+    def section_options(self, section):
+        if section == 'DEFAULT':
+            return self.defaults
+        return self.options[section]
+
+    def set(self, section, option, value):
+        self.section_options(section)[option] = value
+        if option in MULTI_VALUED:
+            self.multi.setdefault((section, option), []).append(value)
+
+    def append(self, section, option, text):
+        options = self.section_options(section)
+        if options[option] and not options[option].endswith(','):
+            options[option] += '\n'
+        options[option] += text
+        if option in MULTI_VALUED:
+            self.multi[(section, option)][-1] = options[option]
+
+    def sections(self):
+        return list(self.options.keys())
+
+    def has_section(self, section):
+        return section in self.options
+
+    def has_option(self, section, option):
+        option = option.lower()
+        if section not in self.options:
+            return False
+        return option in self.options[section] or option in self.defaults
+
+    def get(self, section, option):
+        """Value of an option, falling back to the DEFAULT section
+
+        :raises configparser.NoSectionError: if the section is missing
+        :raises configparser.NoOptionError: if the option is missing
+        """
+        option = option.lower()
+        if section not in self.options:
+            raise configparser.NoSectionError(section)
+        if option in self.options[section]:
+            return self.options[section][option]
+        if option in self.defaults:
+            return self.defaults[option]
+        raise configparser.NoOptionError(option, section)
+
+    def items(self, section):
+        """Options of a section, including those from the DEFAULT section
+
+        :return: list of (option, value)
+        """
+        if section not in self.options:
+            raise configparser.NoSectionError(section)
+        options = collections.OrderedDict(self.defaults)
+        options.update(self.options[section])
+        return list(options.items())
+
+    def replication_devices(self, section):
+        """Every replication_device entry of a section
+
+        :return: list of dictionaries of option to value
+        """
+        return [collections.OrderedDict(device)
+                for device in self.devices.get(section, [])]
+
+    def get_all(self, section, option):
+        """Every value of an option that may be repeated in a section, such
+        as replication_device
+
+        :return: list of strings
+        """
+        return list(self.multi.get((section, option.lower()), []))
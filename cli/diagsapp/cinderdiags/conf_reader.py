@@ -11,21 +11,36 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import collections
 import json
 import logging
+import multiprocessing
 import os
+import re
+import threading
+import time
 
+from multiprocessing.pool import ThreadPool
+
+from cinderdiags import cache
+from cinderdiags import cinder_conf
 from cinderdiags import constant
+from cinderdiags import keystone
 from cinderdiags import pkg_checks
+from cinderdiags import profiler
 from cinderdiags import lun_stats
-from cinderdiags import ssh_client
+from cinderdiags import ssh_pool
+from cinderdiags import volume_index
 from cinderdiags import hpe3par_wsapi_checks as wsapi_checks
 
+import six
 from six.moves import configparser
+from six.moves import shlex_quote
 
 
 logger = logging.getLogger(__name__)
-parser = configparser.ConfigParser()
+
+CHECKSUM_LINE = re.compile(r'^([0-9a-f]{64})\s')
 
 
 class Reader(object):
@@ -33,12 +48,14 @@ class Reader(object):
     arg_data = None
 
     def __init__(self, is_test=False, path=None, json_data=None,
-                 get_info=False, check_replication=False):
+                 get_info=False, check_replication=False, max_workers=None,
+                 processes=None):
         self.is_test = is_test
         self.include_system_info = get_info
         self.include_replication_checks = check_replication
         self.cinder_nodes = []
         self.nova_nodes = []
+        self.parser = configparser.ConfigParser()
 
         if json_data:
             self.arg_data = json.loads(json_data)
@@ -55,7 +72,7 @@ class Reader(object):
             elif path is None:
                 path = constant.CLI_CONFIG
             if os.path.isfile(path):
-                parser.read(path)
+                self.parser.read(path)
                 self.get_nodes()
                 if len(self.cinder_nodes) < 1:
                     logger.warning(
@@ -66,69 +83,353 @@ class Reader(object):
             else:
                 raise IOError("%s path not found" % path)
 
+        if max_workers is None:
+            max_workers = self.get_setting('max_workers',
+                                           constant.MAX_WORKERS)
+        self.max_workers = max(1, int(max_workers))
+        if processes is None:
+            processes = self.get_setting('processes', constant.PROCESSES)
+        self.processes = max(1, int(processes))
+        # arguments that rebuild this reader in a fleet worker process
+        self.settings = {'is_test': is_test,
+                         'path': path,
+                         'json_data': json_data,
+                         'get_info': get_info,
+                         'check_replication': check_replication,
+                         'max_workers': self.max_workers,
+                         'processes': 1}
+        self.connect_timeout = float(self.get_setting(
+            'connect_timeout', constant.SSH_CONNECT_TIMEOUT))
+        self.connect_deadline = float(self.get_setting(
+            'connect_deadline', constant.SSH_CONNECT_DEADLINE))
+        self.connect_times = {}
+        self.pool = ssh_pool.POOL
+        self.pool.idle_timeout = float(self.get_setting(
+            'ssh_pool_idle_timeout', self.pool.idle_timeout))
+        self.pool.transport = self.get_setting('ssh_transport',
+                                               constant.SSH_TRANSPORT)
+        self.wsapi_max_per_array = int(self.get_setting(
+            'wsapi_max_per_array', constant.WSAPI_MAX_PER_ARRAY))
+        self.cache_dir = self.get_setting('cache_dir',
+                                          constant.CACHE_DIRECTORY)
+        self.os_cache = None
+        os_cache_ttl = float(self.get_setting('os_cache_ttl',
+                                              constant.OS_CACHE_TTL))
+        if os_cache_ttl > 0:
+            self.os_cache = cache.FileCache('os_flavor', self.cache_dir,
+                                            os_cache_ttl)
+        self.result_cache_ttl = float(self.get_setting(
+            'result_cache_ttl', constant.RESULT_CACHE_TTL))
+        self.volume_index = volume_index.VolumeIndex(self.cache_dir)
+        # parsed cinder.conf files hold array passwords, so they are only
+        # cached when asked for
+        self.conf_cache = None
+        conf_cache_ttl = float(self.get_setting('conf_cache_ttl',
+                                                constant.CONF_CACHE_TTL))
+        if conf_cache_ttl > 0:
+            self.conf_cache = cache.FileCache('cinder_conf', self.cache_dir,
+                                              conf_cache_ttl)
+        # Keystone tokens are only requested from this host when asked for
+        self.keystone_token = str(self.get_setting(
+            'keystone_token', constant.KEYSTONE_TOKEN)).lower() in \
+            ('true', 'yes', 'on', '1')
+        self.keystone_timeout = float(self.get_setting(
+            'keystone_timeout', constant.KEYSTONE_TIMEOUT))
+        # Keystone tokens are only kept on disk when asked for
+        self.token_cache = None
+        token_cache_ttl = float(self.get_setting('token_cache_ttl',
+                                                 constant.TOKEN_CACHE_TTL))
+        if token_cache_ttl > 0:
+            self.token_cache = cache.FileCache('keystone_token',
+                                               self.cache_dir,
+                                               token_cache_ttl)
+
+    def get_setting(self, option, default=None):
+        """Get a global setting from the [DEFAULT] section of cli.conf
+
+        :param option: name of the setting
+        :param default: value used when the setting is not configured
+        """
+        if self.arg_data:
+            return default
+        return self.parser.defaults().get(option, default)
+
     def get_nodes(self):
         """Create lists of cinder and nova nodes
         """
-        for section_name in list(parser.sections()):
-            if parser.get(section_name, 'service').lower() == 'cinder':
+        for section_name in list(self.parser.sections()):
+            if self.parser.get(section_name, 'service').lower() == 'cinder':
                 self.cinder_nodes.append(section_name)
-            elif parser.get(section_name, 'service').lower() == 'nova':
+            elif self.parser.get(section_name, 'service').lower() == 'nova':
                 self.nova_nodes.append(section_name)
 
+    def get_host_ip(self, node):
+        """Host IP of a node as set in cli.conf
+
+        :return: string, None if not set
+        """
+        if self.arg_data:
+            for section in self.arg_data:
+                if section['section'].lower() == node:
+                    return section.get('host_ip')
+            return None
+        try:
+            return self.parser.get(node, 'host_ip')
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            return None
+
+    def all_nodes(self):
+        """List every nova and cinder node once, in cli.conf order
+        """
+        nodes = []
+        for node in self.nova_nodes + self.cinder_nodes:
+            if node not in nodes:
+                nodes.append(node)
+        return nodes
+
+    def iter_shards(self, method, args, ordered=True):
+        """Run a check in worker processes, each checking a contiguous shard
+        of the nova and cinder nodes with its own SSH connections
+
+        Each worker process logs in to a 3PAR array once for itself, and
+        wsapi_max_per_array is divided between the worker processes, so the
+        fleet as a whole uses an array for at most that many backend sections
+        at a time (at least one per process).
+
+        :param method: name of the Reader method returning the check's list
+        :param args: arguments of the method
+        :param ordered: yield rows in cli.conf node order, otherwise shard
+        by shard as the shards complete
+        :return: iterator of dictionaries
+        """
+        nova_shards = shard(self.nova_nodes, self.processes)
+        cinder_shards = shard(self.cinder_nodes, self.processes)
+        shards = [i for i in range(self.processes)
+                  if nova_shards[i] or cinder_shards[i]]
+        if not shards:
+            return
+        limits = {'wsapi_max_per_array':
+                  max(1, self.wsapi_max_per_array // len(shards))}
+        jobs = [(self.settings, limits, nova_shards[i], cinder_shards[i],
+                 method, args)
+                for i in shards]
+
+        pool = multiprocessing.Pool(len(jobs))
+        try:
+            if not ordered:
+                for rows, stats in pool.imap_unordered(run_shard, jobs):
+                    self.merge_profile(stats)
+                    for row in rows:
+                        yield row
+                return
+
+            merged = []
+            for rows, stats in pool.map(run_shard, jobs):
+                self.merge_profile(stats)
+                merged += rows
+        finally:
+            pool.close()
+            pool.join()
+
+        # shards hold both nova and cinder nodes, put rows back in the order
+        # the nodes are listed in
+        order = dict((node, i) for i, node in enumerate(self.all_nodes()))
+        if all('node' in row for row in merged):
+            merged.sort(key=lambda row: order.get(row['node'], len(order)))
+        for row in merged:
+            yield row
+
+    def merge_profile(self, stats):
+        if stats and profiler.ACTIVE:
+            profiler.ACTIVE.merge(stats)
+
+    def map_nodes(self, func, nodes, *args):
+        """Run func(node, *args) for each node, up to max_workers at a time
+
+        func is expected to handle its own per-node errors.
+
+        :return: list of results, in the same order as nodes
+        """
+        return list(self.iter_nodes(func, nodes, args))
+
+    def iter_nodes(self, func, nodes, args=(), ordered=True):
+        """Run func(node, *args) for each node, up to max_workers at a time,
+        yielding each result as soon as it is available
+
+        :param ordered: yield results in the order of nodes, otherwise in the
+        order the nodes complete
+        """
+        nodes = list(nodes)
+        workers = min(self.max_workers, len(nodes))
+        if workers <= 1:
+            for node in nodes:
+                yield self.run_node(func, node, args)
+            return
+
+        pool = ThreadPool(workers)
+        try:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for result in imap(
+                    lambda node: self.run_node(func, node, args), nodes):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def run_node(self, func, node, args=()):
+        """Run func(node, *args), attributing its work to node when
+        profiling
+        """
+        with profiler.on_node(node):
+            return func(node, *args)
+
     def get_clients(self, nodes):
         """Create SSH client connections for nodes.
+
+        Connections are opened concurrently.  Each attempt is limited by
+        connect_timeout and all of them together by connect_deadline; nodes
+        that could not be reached in time are left out of the result.  Once
+        the deadline has expired no further connection is started, and
+        connections still being opened are closed as soon as they complete.
         """
+        nodes = list(nodes)
         clients = {}
+        if not nodes:
+            return clients
 
-        for node in nodes:
-            logger.warning("PROCESS NODE: %s" % (node))
-            try:
-                if self.arg_data:
-                    for section in self.arg_data:
-                        if section['section'].lower() == node:
-                            logger.warning("Found section: %s" % (node))
-                            logger.warning(
-                                "Attempt to open SSH connection to: %s"
-                                % (section['host_ip']))
-                            client = ssh_client.Client(
-                                section['host_ip'],
-                                section['ssh_user'],
-                                section['ssh_password'])
-                            logger.warning("Opened SSH connection")
-                else:
-                    client = ssh_client.Client(
-                        parser.get(node, 'host_ip'),
-                        parser.get(node, 'ssh_user'),
-                        parser.get(node, 'ssh_password'))
-                clients[node] = client
-            except Exception as e:
-                logger.warning("%s: %s" % (e, node))
-                pass
-        return clients
-
-    def copy_files(self, clients):
-        """Copy the cinder.conf file of each cinder node to a local directory.
+        state = {'clients': clients, 'expired': False}
+        lock = threading.Lock()
+        pool = ThreadPool(min(self.max_workers, len(nodes)))
+        connecting = pool.map_async(
+            lambda node: self.connect_node(node, state, lock), nodes)
+        pool.close()
+        connecting.wait(self.connect_deadline)
+        if connecting.ready():
+            pool.join()
+        else:
+            # drops the queued connects, the ones in progress are closed by
+            # connect_node when they complete
+            pool.terminate()
+
+        with lock:
+            state['expired'] = True
+            for node in nodes:
+                if node not in clients and node not in self.connect_times:
+                    logger.warning("SSH connection deadline of %ss expired: "
+                                   "%s" % (self.connect_deadline, node))
+            return dict(clients)
+
+    def connect_node(self, node, state, lock):
+        """Open an SSH connection to a node for get_clients
+
+        Connections that complete after the get_clients deadline has expired
+        are closed again.
+        """
+        start = time.time()
+        with profiler.on_node(node), profiler.timed('connect'):
+            client = self.get_client(node)
+        elapsed = time.time() - start
+        logger.info("SSH connect to node %s took %.2fs" % (node, elapsed))
+        with lock:
+            self.connect_times[node] = elapsed
+            if not state['expired']:
+                if client:
+                    state['clients'][node] = client
+                return
+        if client:
+            client.disconnect()
+
+    def get_client(self, node):
+        """Create an SSH client connection for a single node
+
+        :return: ssh client, None if the connection failed
+        """
+        logger.warning("PROCESS NODE: %s" % (node))
+        client = None
+        try:
+            if self.arg_data:
+                for section in self.arg_data:
+                    if section['section'].lower() == node:
+                        logger.warning("Found section: %s" % (node))
+                        logger.warning(
+                            "Attempt to open SSH connection to: %s"
+                            % (section['host_ip']))
+                        client = self.pool.acquire(
+                            section['host_ip'],
+                            section['ssh_user'],
+                            section['ssh_password'],
+                            self.connect_timeout)
+                        logger.warning("Opened SSH connection")
+            else:
+                client = self.pool.acquire(
+                    self.parser.get(node, 'host_ip'),
+                    self.parser.get(node, 'ssh_user'),
+                    self.parser.get(node, 'ssh_password'),
+                    self.connect_timeout)
+        except Exception as e:
+            logger.warning("%s: %s" % (e, node))
+        return client
+
+    def read_confs(self, clients):
+        """Read and parse the cinder.conf file of each cinder node in memory.
 
         Location of cinder.conf file is set per node in cli.conf
+        :return: dictionary of node to CinderConf
         """
-        files = {}
-        for node in self.cinder_nodes:
-            try:
-                conf_file_name = None
-                if self.arg_data:
-                    for section in self.arg_data:
-                        if section['section'].lower() == node:
-                            conf_file_name = section['conf_source']
-                else:
-                    conf_file_name = parser.get(node, 'conf_source')
+        parsed = self.map_nodes(self.read_conf, self.cinder_nodes, clients)
+        confs = {}
+        for node, conf in zip(self.cinder_nodes, parsed):
+            if conf:
+                confs[node] = conf
+        return confs
+
+    @profiler.phase('read_conf')
+    def read_conf(self, node, clients):
+        """Read and parse the cinder.conf file of a single cinder node
 
-                logger.warning("Conf file name: %s" % (conf_file_name))
-                conf_file = clients[node].get_file(conf_file_name,
-                                                   constant.DIRECTORY + node)
-                files[node] = conf_file
-            except Exception as e:
-                logger.warning("%s: %s" % (e, node))
-        return files
+        :return: CinderConf, None if it could not be read
+        """
+        try:
+            conf_file_name = None
+            if self.arg_data:
+                for section in self.arg_data:
+                    if section['section'].lower() == node:
+                        conf_file_name = section['conf_source']
+            else:
+                conf_file_name = self.parser.get(node, 'conf_source')
+
+            logger.warning("Conf file name: %s" % (conf_file_name))
+            checksum = None
+            if self.conf_cache:
+                key = "%s:%s" % (node, conf_file_name)
+                checksum = self.conf_checksum(clients[node], conf_file_name)
+                cached = self.conf_cache.get(key) if checksum else None
+                if cached and cached['checksum'] == checksum:
+                    logger.info("Using cached %s of node %s" %
+                                (conf_file_name, node))
+                    return cinder_conf.CinderConf.from_dict(cached['conf'])
+
+            conf = cinder_conf.CinderConf(
+                clients[node].read_file(conf_file_name))
+            if checksum:
+                self.conf_cache.set(key, {'checksum': checksum,
+                                          'conf': conf.to_dict()})
+            return conf
+        except Exception as e:
+            logger.warning("%s: %s" % (e, node))
+        return None
+
+    def conf_checksum(self, client, conf_file_name):
+        """Checksum of a remote cinder.conf, read without copying the file
+
+        :return: sha256 hex digest, None if it could not be computed
+        """
+        response = client.execute('sha256sum %s' % shlex_quote(conf_file_name))
+        match = CHECKSUM_LINE.match(response or '')
+        if match:
+            return match.group(1)
+        logger.info("Unable to checksum %s: %s" % (conf_file_name, response))
+        return None
 
     def software_check(self, name='default', service='default',
                        version=None, packages=None):
@@ -140,131 +441,389 @@ class Reader(object):
         :param packages: alternate JSON structure to pass in multiple packages
         :return: list of dictionaries
         """
+        return list(self.iter_software_check(name, service, version,
+                                             packages))
+
+    def iter_software_check(self, name='default', service='default',
+                            version=None, packages=None, ordered=True):
+        """Check nodes for installed software packages, yielding the checks
+        of each node as soon as it is done
+
+        :param ordered: yield nodes in cli.conf order, otherwise in the order
+        they complete
+        :return: iterator of dictionaries
+        """
+        if self.processes > 1:
+            for check in self.iter_shards(
+                    'software_check', (name, service, version, packages),
+                    ordered):
+                yield check
+            return
+
         if service == 'nova':
             checklist = self.nova_nodes
         elif service == 'cinder':
             checklist = self.cinder_nodes
         else:
-            checklist = set(self.nova_nodes + self.cinder_nodes)
+            checklist = self.all_nodes()
         clients = self.get_clients(checklist)
+        try:
+            for node_checks in self.iter_nodes(
+                    self.software_check_node, checklist,
+                    (clients, name, version, packages), ordered):
+                for check in node_checks:
+                    yield check
+        finally:
+            self.cleanup(clients)
 
+    def software_check_node(self, node, clients, name='default',
+                            version=None, packages=None):
+        """Check a single node for installed software packages
+
+        :return: list of dictionaries
+        """
         checks = []
-        for node in checklist:
-            try:
-                if packages:
-                    pkg_data_list = json.loads(packages)
-                    logger.warning("Software Packages: %s" % (pkg_data_list))
-                    for pkg_data in pkg_data_list:
-                        for pkg_name, pkg_version in pkg_data.iteritems():
-                            checks.append(pkg_checks.check_one(clients[node],
-                                                               node,
-                                                               (pkg_name,
-                                                                pkg_version)))
-                elif name == 'default':
-                    service = None
-                    if self.arg_data:
-                        for section in self.arg_data:
-                            if section['section'].lower() == node:
-                                service = section['service']
-                    else:
-                        service = parser.get(node, 'service')
-
-                    checks += pkg_checks.check_all(clients[node],
-                                                   node,
-                                                   service)
+        try:
+            if packages:
+                pkg_data_list = json.loads(packages)
+                logger.warning("Software Packages: %s" % (pkg_data_list))
+                pkg_list = []
+                for pkg_data in pkg_data_list:
+                    for pkg_name, pkg_version in pkg_data.items():
+                        pkg_list.append((pkg_name, pkg_version))
+                checks += pkg_checks.check_list(clients[node],
+                                                node,
+                                                pkg_list,
+                                                self.os_cache)
+            elif name == 'default':
+                service = None
+                if self.arg_data:
+                    for section in self.arg_data:
+                        if section['section'].lower() == node:
+                            service = section['service']
                 else:
-                    checks.append(pkg_checks.check_one(clients[node],
-                                                       node,
-                                                       (name, version)))
-            except Exception as e:
-                logger.warning("%s: %s" % (e, node))
-        self.cleanup(clients)
+                    service = self.parser.get(node, 'service')
+
+                checks += pkg_checks.check_all(clients[node],
+                                               node,
+                                               service,
+                                               self.os_cache)
+            else:
+                checks.append(pkg_checks.check_one(clients[node],
+                                                   node,
+                                                   (name, version),
+                                                   self.os_cache))
+        except Exception as e:
+            logger.warning("%s: %s" % (e, node))
         return checks
 
-    def options_check(self, section_name='arrays'):
+    def options_check(self, section_name='arrays', incremental=False):
         """Check WS API options in each cinder.conf file
 
         :param section_name: section name in the cinder.conf file.  Checks
         all by default
+        :param incremental: reuse stored results of sections whose options
+        and array have not changed since an earlier run
         :return: list of dictionaries
         """
+        return list(self.iter_options_check(section_name, incremental))
+
+    def iter_options_check(self, section_name='arrays', incremental=False,
+                           ordered=True):
+        """Check WS API options in each cinder.conf file, yielding the checks
+        of each node as soon as it is done
+
+        :param ordered: yield nodes in cli.conf order, otherwise in the order
+        they complete
+        :return: iterator of dictionaries
+        """
+        if self.processes > 1:
+            for check in self.iter_shards(
+                    'options_check', (section_name, incremental), ordered):
+                yield check
+            return
+
         clients = self.get_clients(self.cinder_nodes)
-        files = self.copy_files(clients)
+        confs = self.read_confs(clients)
+        nodes = [node for node in self.cinder_nodes if node in confs]
+        # one WS API login per array for the whole run, shared by every node,
+        # and the wsapi_max_per_array limit of each array for this run
+        sessions = wsapi_checks.SessionCache()
+        # nodes are checked by up to max_workers threads, their sections and
+        # replication targets share max_workers - 1 more
+        workers = wsapi_checks.Workers(self.max_workers - 1)
+        stored = None
+        if incremental:
+            stored = cache.FileCache('options_check', self.cache_dir,
+                                     self.result_cache_ttl)
+            # the results of every section are written once, at the end
+            stored.defer()
+        try:
+            for node_checks in self.iter_nodes(
+                    self.options_check_node, nodes,
+                    (clients, confs, section_name, sessions, stored,
+                     workers),
+                    ordered):
+                for check in node_checks:
+                    yield check
+        finally:
+            if stored is not None:
+                stored.flush()
+            sessions.logout_all()
+            self.cleanup(clients)
+
+    def options_check_node(self, node, clients, confs, section_name='arrays',
+                           sessions=None, stored=None, workers=None):
+        """Check WS API options in the cinder.conf file of a single node
+
+        :return: list of dictionaries
+        """
         checks = []
-        for node in files:
+        try:
             checker = wsapi_checks.WSChecker(clients[node],
-                                             files[node],
+                                             confs[node],
                                              node,
                                              self.is_test,
                                              self.include_system_info,
-                                             self.include_replication_checks)
+                                             self.include_replication_checks,
+                                             self.max_workers,
+                                             self.wsapi_max_per_array,
+                                             sessions,
+                                             stored,
+                                             workers)
             if section_name == 'arrays':
                 checks += checker.check_all()
             else:
-                found = checker.check_section(section_name)
+                found = checker.try_check_section(section_name)
                 if found:
                     checks.append(found)
-        self.cleanup(clients, files)
+        except Exception as e:
+            logger.warning("%s: %s" % (e, node))
         return checks
 
     def credentials_check(self):
         """Validate SSH credentials
         """
-        logger.warning("Check SSH credentials")
-        checklist = set(self.nova_nodes + self.cinder_nodes)
-        clients = self.get_clients(checklist)
+        return list(self.iter_credentials_check())
 
-        checks = []
-        for node in checklist:
-            # clients only exist for nodes that SSH connect was successful
-            logger.warning("Check credentials for node: %s" % (node))
-            if node in clients:
-                result = 'pass'
-            else:
-                result = 'fail'
-            logger.warning("Credentials result: %s" % (result))
-            checks.append({'node': node,
-                           'connect': result})
+    def iter_credentials_check(self):
+        """Validate SSH credentials, yielding each node's result once all
+        connection attempts are done
 
-        self.cleanup(clients)
-        return checks
+        :return: iterator of dictionaries
+        """
+        if self.processes > 1:
+            for check in self.iter_shards('credentials_check', ()):
+                yield check
+            return
 
-    def volume_paths_check(self, os_vars, attached_volumes=None):
+        logger.warning("Check SSH credentials")
+        checklist = self.all_nodes()
+        clients = self.get_clients(checklist)
+        try:
+            for node in checklist:
+                # clients only exist for nodes that SSH connect was
+                # successful
+                logger.warning("Check credentials for node: %s" % (node))
+                if node in clients:
+                    result = 'pass'
+                else:
+                    result = 'fail'
+                logger.warning("Credentials result: %s" % (result))
+                yield {'node': node,
+                       'connect': result}
+        finally:
+            self.cleanup(clients)
+
+    def volume_paths_check(self, os_vars, attached_volumes=None,
+                           discovery=constant.PATH_DISCOVERY, os_env=None):
         """Check nodes for installed software packages
 
         :param attached_volumes: a JSON structure
+        :param discovery: 'cinder' to list paths with the cinder CLI, or
+        'sysfs' to read them from /dev/disk/by-path
+        :param os_env: cinder CLI exports from openstack_env, made from
+        os_vars if not given
         :return: list of dictionaries
         """
+        return list(self.iter_volume_paths_check(os_vars, attached_volumes,
+                                                 discovery=discovery,
+                                                 os_env=os_env))
+
+    def iter_volume_paths_check(self, os_vars, attached_volumes=None,
+                                ordered=True,
+                                discovery=constant.PATH_DISCOVERY,
+                                os_env=None):
+        """Get the volume paths of each nova node, yielding the paths of each
+        node as soon as it is done
+
+        :param ordered: yield nodes in cli.conf order, otherwise in the order
+        they complete
+        :param discovery: 'cinder' or 'sysfs'
+        :param os_env: cinder CLI exports from openstack_env
+        :return: iterator of dictionaries
+        """
+        found = collections.OrderedDict()
+        for result in self.iter_node_paths(os_vars, attached_volumes,
+                                           ordered, discovery, os_env):
+            if result['paths'] is None:
+                continue
+            found[result['node']] = result['paths']
+            for path in result['paths']:
+                yield path
+        # only a finished check replaces what the index knows of the nodes,
+        # and only of the nodes that could be checked
+        if self.volume_index is not None:
+            self.volume_index.update(dict(
+                (node, {'host_ip': self.get_host_ip(node), 'paths': paths})
+                for node, paths in found.items()))
+
+    def iter_node_paths(self, os_vars, attached_volumes, ordered, discovery,
+                        os_env):
+        """Body of iter_volume_paths_check
+
+        :return: iterator of volume_paths_check_node results
+        """
+        if os_env is None and (discovery != 'sysfs' or attached_volumes):
+            # one token for every cinder call on every node, fleet workers
+            # included
+            os_env = self.openstack_env(os_vars)
+
+        if self.processes > 1:
+            for result in self.iter_shards(
+                    'volume_paths_by_node',
+                    (os_vars, attached_volumes, discovery, os_env), ordered):
+                yield result
+            return
+
         checklist = self.nova_nodes
         clients = self.get_clients(checklist)
+        try:
+            for result in self.iter_nodes(
+                    self.volume_paths_check_node, checklist,
+                    (clients, os_vars, attached_volumes, discovery, os_env),
+                    ordered):
+                yield result
+        finally:
+            self.cleanup(clients)
+
+    def volume_paths_by_node(self, os_vars, attached_volumes, discovery,
+                             os_env):
+        """Volume paths of each nova node, run by fleet worker processes
+
+        :return: list of volume_paths_check_node results
+        """
+        return list(self.iter_node_paths(os_vars, attached_volumes, True,
+                                         discovery, os_env))
 
-        paths = []
-        for node in checklist:
-            try:
-                paths = lun_stats.get_all_paths(clients[node], node, os_vars)
-                if attached_volumes:
-                    volume_list = json.loads(attached_volumes)
-                    logger.info("Volumes List: %s" % (volume_list))
-                    for volume in volume_list:
-                        vol_paths = lun_stats.get_paths_for_volume(
-                            clients[node],
-                            node,
-                            volume)
-                        for vol_path in vol_paths:
-                            for cur_path in paths:
-                                if cur_path['path'] == vol_path:
-                                    cur_path['vol_name'] = volume
-                                    break
-
-            except Exception as e:
-                logger.warning("%s: %s" % (e, node))
-        self.cleanup(clients)
-        return paths
-
-    def cleanup(self, clients, files={}):
-        """Delete all copied cinder.conf files and close all SSH connections.
+    def openstack_env(self, os_vars):
+        """Exports that let the cinder CLI on the nodes use one Keystone
+        token for the whole run when keystone_token is enabled, or the
+        -os-vars credentials otherwise
+
+        :param os_vars: JSON structure from -os-vars, None to use the
+        environment of the nodes
+        :return: string of export commands, empty to use the environment of
+        the nodes
+        """
+        try:
+            os_vars = json.loads(os_vars) if os_vars else None
+            if os_vars is not None:
+                if not isinstance(os_vars, dict):
+                    raise ValueError("not a JSON object")
+                missing = [key for key in keystone.REQUIRED_VARS
+                           if not isinstance(os_vars.get(key),
+                                             six.string_types)]
+                if missing:
+                    raise ValueError("%s not set" % ', '.join(missing))
+        except ValueError as e:
+            logger.warning("%s -- Unable to read OpenStack vars, using the "
+                           "environment of the nodes" % e)
+            os_vars = None
+        return keystone.os_env(os_vars, self.token_cache,
+                               self.keystone_token, self.keystone_timeout)
+
+    def volume_paths_check_node(self, node, clients, os_vars,
+                                attached_volumes=None,
+                                discovery=constant.PATH_DISCOVERY,
+                                os_env=''):
+        """Get the volume paths of a single nova node
+
+        :return: dictionary with the 'node' and its list of 'paths', paths
+        is None if the node could not be checked
+        """
+        if node not in clients:
+            return {'node': node, 'paths': None}
+        paths = None
+        try:
+            if discovery == 'sysfs':
+                paths = lun_stats.discover_paths(clients[node], node)
+            else:
+                paths = lun_stats.get_all_paths(clients[node], node, os_vars,
+                                                os_env)
+            if attached_volumes:
+                volume_list = json.loads(attached_volumes)
+                logger.info("Volumes List: %s" % (volume_list))
+                vol_paths = lun_stats.get_paths_for_volumes(clients[node],
+                                                            node,
+                                                            volume_list,
+                                                            os_env)
+                index = lun_stats.index_paths(paths)
+                for volume in volume_list:
+                    for vol_path in vol_paths.get(volume, []):
+                        if vol_path in index:
+                            index[vol_path]['vol_name'] = volume
+
+        except Exception as e:
+            logger.warning("%s: %s" % (e, node))
+        for path in paths or []:
+            path['node'] = node
+        return {'node': node, 'paths': paths}
+
+    def cleanup(self, clients):
+        """Release all SSH connections back to the connection pool.
         """
         for node in clients:
-            clients[node].disconnect()
-        for node in files:
-            os.remove(files[node])
+            self.pool.release(clients[node])
+
+
+def shard(nodes, count):
+    """Split nodes into count contiguous shards of nearly equal size
+
+    :return: list of count lists
+    """
+    size, extra = divmod(len(nodes), count)
+    shards = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(list(nodes[start:end]))
+        start = end
+    return shards
+
+
+def run_shard(job):
+    """Run a Reader check for a shard of nodes in a fleet worker process
+
+    :param job: (reader settings, reader attributes set in the worker,
+    nova nodes, cinder nodes, method name, method arguments)
+    :return: (list of dictionaries, profiler stats or None)
+    """
+    settings, limits, nova_nodes, cinder_nodes, method, args = job
+    # pooled connections copied from the parent process are not ours to use
+    ssh_pool.POOL.forget()
+    # neither are the parent's timings
+    if profiler.ACTIVE:
+        profiler.ACTIVE.reset()
+    try:
+        reader = Reader(**settings)
+        for name, value in limits.items():
+            setattr(reader, name, value)
+        # the parent process records the results in the volume index
+        reader.volume_index = None
+        reader.nova_nodes = nova_nodes
+        reader.cinder_nodes = cinder_nodes
+        rows = getattr(reader, method)(*args)
+        return rows, profiler.ACTIVE.export() if profiler.ACTIVE else None
+    finally:
+        ssh_pool.POOL.close()
@@ -15,6 +15,20 @@
 DIRECTORY = '/tmp/'
 TEST_CLI_CONFIG = '/tmp/cli.conf'
 CLI_CONFIG = '/etc/cinderdiags/cli.conf'
+MAX_WORKERS = 10
+PROCESSES = 1
+SSH_CONNECT_TIMEOUT = 20
+SSH_CONNECT_DEADLINE = 120
+SSH_POOL_IDLE_TIMEOUT = 300
+SSH_TRANSPORT = 'paramiko'
+# channels open at the same time on one SSH connection, sshd allows 10 by
+# default (MaxSessions)
+SSH_MAX_CHANNELS = 8
+CACHE_DIRECTORY = '/var/tmp/cinderdiags/'
+OS_CACHE_TTL = 0
+CONF_CACHE_TTL = 0
+RESULT_CACHE_TTL = 86400
+WSAPI_MAX_PER_ARRAY = 2
 NOVA_PACKAGES = [
     ('sysfsutils',  '2.1'),
     ('sg3-utils || sg3_utils', '1.3'),
@@ -28,3 +42,16 @@ HPE3PAR_DRIVERS = [
     'hpe_3par_iscsi.HPE3PARISCSIDriver',
     'hpe_3par_fc.HPE3PARFCDriver'
 ]
+# how volume-paths-check finds the volume paths of a nova node
+PATH_DISCOVERY_MODES = ['cinder', 'sysfs']
+PATH_DISCOVERY = 'cinder'
+# seconds a Keystone token is kept in cache_dir, 0 disables, never past the
+# token's expiry less TOKEN_EXPIRY_MARGIN
+TOKEN_CACHE_TTL = 0
+TOKEN_EXPIRY_MARGIN = 300
+# request a Keystone token from the host running cinderdiags, off by
+# default since os_auth may only be reachable from the nodes
+KEYSTONE_TOKEN = False
+# seconds allowed for each request to Keystone
+KEYSTONE_TIMEOUT = 10
+VOLUME_SERVICE_TYPE = 'volumev3'
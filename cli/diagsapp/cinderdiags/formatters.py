@@ -0,0 +1,63 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Output formatters for the cinderdiags list commands.
+
+The jsonl formatter writes one JSON object per row as soon as the row is
+produced, so commands using it can hand rows over while nodes are still being
+checked instead of after the slowest node is done.
+"""
+
+import json
+
+from cliff.formatters import base
+
+STREAMING_FORMATTERS = ('jsonl',)
+
+
+def is_streaming(parsed_args):
+    """Whether the chosen output format writes rows as they are produced
+
+    :param parsed_args: arguments of a cliff Lister command
+    """
+    return getattr(parsed_args, 'formatter', None) in STREAMING_FORMATTERS
+
+
+def non_empty(rows, error):
+    """Pass rows through, raising error after the last one if there were none
+
+    :param rows: iterable of rows
+    :param error: exception to raise
+    """
+    found = False
+    for row in rows:
+        found = True
+        yield row
+    if not found:
+        raise error
+
+
+class JSONLinesFormatter(base.ListFormatter):
+
+    def add_argument_group(self, parser):
+        pass
+
+    def emit_list(self, column_names, data, stdout, parsed_args):
+        """Write each row as a JSON object on its own line
+        """
+        for row in data:
+            json.dump(dict(zip(column_names, row)), stdout, sort_keys=True)
+            stdout.write('\n')
+            stdout.flush()
@@ -0,0 +1,89 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import logging
+
+from cinderdiags import conf_reader
+from cinderdiags import lun_stats
+from cliff.lister import Lister
+
+
+class HostPaths(Lister):
+    """list the volume paths of a nova node, from the volume index of the
+    last volume-paths-check runs
+
+    output data:
+        Node                nova node the path was found on
+        Host IP             host_ip of the node in cli.conf
+        Protocol            ISCSI or FIBRE_CHANNEL
+        Path                volume path
+        Attached Volume     attached volume name (if found)
+        Multipath           multipath map of the path (-discovery sysfs only)
+        Updated             time the node was last checked
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(HostPaths, self).get_parser(prog_name)
+        parser.formatter_class = argparse.RawTextHelpFormatter
+        parser.add_argument('host',
+                            metavar='HOST',
+                            help='node name in cli.conf, or its host_ip')
+
+        parser.add_argument('-protocol',
+                            dest='protocol',
+                            choices=[protocol for protocol, marker
+                                     in lun_stats.PROTOCOLS],
+                            help='only list paths of this protocol')
+
+        parser.add_argument('-test',
+                            dest='test',
+                            action='store_true',
+                            help=argparse.SUPPRESS)
+
+        parser.add_argument('-conf-file',
+                            dest='conf',
+                            help='location of cli.conf (defaults to '
+                                 '/etc/cinderdiags/cli.conf)')
+
+        parser.add_argument('-conf-data',
+                            dest='data',
+                            help='json structure contain cli.conf data')
+
+        return parser
+
+    def take_action(self, parsed_args):
+        reader = conf_reader.Reader(parsed_args.test,
+                                    parsed_args.conf,
+                                    parsed_args.data)
+        result = reader.volume_index.host(parsed_args.host,
+                                          parsed_args.protocol)
+        if len(result) < 1:
+            raise ValueError("No paths of %s in the volume index, run "
+                             "volume-paths-check first" % parsed_args.host)
+
+        columns = ('Node', 'Host IP', 'Protocol', 'Path', 'Attached Volume',
+                   'Multipath', 'Updated')
+        data = ((path['node'],
+                 path['host_ip'],
+                 path['protocol'],
+                 path['path'],
+                 path['vol_name'],
+                 path['multipath'],
+                 path['updated'])
+                for path in result)
+
+        return (columns, data)
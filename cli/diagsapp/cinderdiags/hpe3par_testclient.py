@@ -17,12 +17,17 @@ This fakes 3PAR REST API Client behavior to allow for testing of the Cinder
 Diagnostics tool without access to a 3PAR array
 """
 
+import collections
+import threading
+import time
+
 from hpe3parclient import exceptions
 
 
 class HPE3ParClient(object):
 
     PORT_MODE_TARGET = 2
+    PORT_PROTO_FC = 1
     PORT_PROTO_ISCSI = 2
     PORT_STATE_READY = 4
 
@@ -30,8 +35,17 @@ class HPE3ParClient(object):
     USERNAME = 'testuser'
     PASSWORD = 'testpass'
     CPG = 'testCPG'
+    SERIAL_NUMBER = '1234567'
+
+    # seconds every request takes, set by benchmarks to act like a remote
+    # array
+    LATENCY = 0
+    # requests made per (api_url, method), counted across all clients
+    calls = collections.Counter()
+    calls_lock = threading.Lock()
 
     def __init__(self, api_url):
+        self.api_url = api_url
         if api_url == self.API_URL:
             pass
         else:
@@ -39,21 +53,43 @@ class HPE3ParClient(object):
                                             '3PAR WS')
 
     def login(self, username, password):
+        self.request('login')
         if username == self.USERNAME and password == self.PASSWORD:
             pass
         else:
             raise exceptions.HTTPUnauthorized('invalid username or password')
 
     def logout(self):
+        self.request('logout')
         pass
 
     def getCPG(self, name):
+        self.request('getCPG')
         if name == self.CPG:
             pass
         else:
             raise exceptions.HTTPNotFound('Invalid input received: CPG')
 
+    def getCPGs(self):
+        self.request('getCPGs')
+        return {'total': 1, 'members': [{'name': self.CPG}]}
+
+    def getStorageSystemInfo(self):
+        self.request('getStorageSystemInfo')
+        return {'name': 'testArray',
+                'systemVersion': '3.2.2.MU4',
+                'model': 'HP_3PAR 8200',
+                'serialNumber': self.SERIAL_NUMBER,
+                'IPv4Addr': '1.1.1.10',
+                'licenseInfo': {'licenses': [{'name': 'Remote Copy'}]}
+                }
+
+    def getWsApiVersion(self):
+        self.request('getWsApiVersion')
+        return {'major': 1, 'minor': 5, 'revision': 0, 'build': 30201200}
+
     def getPorts(self):
+        self.request('getPorts')
         first = {'mode': self.PORT_MODE_TARGET,
                  'linkState': self.PORT_STATE_READY,
                  'protocol': self.PORT_PROTO_ISCSI,
@@ -64,5 +100,23 @@ class HPE3ParClient(object):
                   'protocol': self.PORT_PROTO_ISCSI,
                   'IPAddr': '2.2.2.2'
                   }
-        ports = {'members': [first, second]}
+        fc = {'mode': self.PORT_MODE_TARGET,
+              'linkState': self.PORT_STATE_READY,
+              'protocol': self.PORT_PROTO_FC,
+              'portWWN': '20210002AC000001'
+              }
+        ports = {'members': [first, second, fc]}
         return ports
+
+    def request(self, method):
+        """Count a request and wait as long as the array would take
+        """
+        with self.calls_lock:
+            self.calls[(self.api_url, method)] += 1
+        if self.LATENCY:
+            time.sleep(self.LATENCY)
+
+    @classmethod
+    def reset_calls(cls):
+        with cls.calls_lock:
+            cls.calls.clear()
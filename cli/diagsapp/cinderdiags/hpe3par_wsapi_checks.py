@@ -20,10 +20,20 @@ Requires python-3parclient: sudo pip install python-3parclient
 Assumes the volume_driver is correctly set
 """
 
+import collections
+import hashlib
+import json
 import logging
+import six
+import sys
+import threading
+import time
+
 from six.moves import configparser
+from cinderdiags import cinder_conf
 from cinderdiags import constant
 from cinderdiags import hpe3par_testclient as testclient
+from cinderdiags import profiler
 
 logger = logging.getLogger(__name__)
 
@@ -35,25 +45,202 @@ except ImportError:
         'python-3parclient package not found (pip install python-3parclient)')
 
 
+class SessionCache(object):
+
+    def __init__(self):
+        """Logged in WS API clients shared by every backend section that
+        uses the same array and credentials, so each array sees one login and
+        one logout per run instead of one per section and replication target,
+        together with the semaphores capping the work against each array
+        """
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.data = {}
+        self.limits = {}
+
+    def limit(self, url, size):
+        """Semaphore capping the work running at the same time against an
+        array, shared by every checker using this cache
+
+        :param url: WS API url of the array
+        :param size: number of holders allowed at the same time
+        :return: threading.BoundedSemaphore
+        """
+        with self.lock:
+            if (url, size) not in self.limits:
+                self.limits[(url, size)] = threading.BoundedSemaphore(size)
+            return self.limits[(url, size)]
+
+    def open(self, url, username, password, connect, login):
+        """Gets the client of an array, connecting and logging in on first use
+
+        :param url: WS API url of the array
+        :param username: WS API user
+        :param password: WS API password
+        :param connect: callable returning a new client, None if url is invalid
+        :param login: callable taking a client, True if login succeeded
+        :return: (client, logged_in) - client is None if url is invalid
+        """
+        # sessions are told apart by a digest of the password, the password
+        # itself is not kept
+        digest = hashlib.sha256(
+            str(password or '').encode('utf-8')).hexdigest()
+        key = (url, username, digest)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = {'lock': threading.Lock()}
+                self.sessions[key] = session
+
+        with session['lock']:
+            if 'client' not in session:
+                client = connect()
+                logged_in = False
+                if client:
+                    try:
+                        logged_in = bool(login(client))
+                    except Exception as e:
+                        logger.warning("%s -- Unable to log in to %s" %
+                                       (e, url))
+                # stored once complete, so that every later caller gets the
+                # same (client, logged_in) and a failed login is not retried
+                session['client'] = client
+                session['logged_in'] = logged_in
+            return session['client'], session['logged_in']
+
+    def cached(self, client, name, fetch):
+        """Fetches array data once per session and reuses it afterwards
+
+        :param client: logged in client of the array
+        :param name: name of the data, e.g. 'cpgs'
+        :param fetch: callable taking the client, returns the data
+        :return: the data
+        """
+        with self.lock:
+            entry = self.data.get(client)
+            if entry is None:
+                entry = {'lock': threading.Lock(), 'values': {}}
+                self.data[client] = entry
+
+        with entry['lock']:
+            if name not in entry['values']:
+                entry['values'][name] = fetch(client)
+            return entry['values'][name]
+
+    def logout_all(self):
+        """Log out of every array session opened through this cache
+        """
+        with self.lock:
+            clients = [session['client'] for session in
+                       self.sessions.values() if session.get('logged_in')]
+            self.sessions = {}
+            self.data = {}
+        for client in clients:
+            try:
+                client.logout()
+            except Exception as e:
+                logger.info("Failed to log out of WS API session --- %s" % e)
+
+
+class Workers(object):
+
+    def __init__(self, size):
+        """Spare threads shared by every map() of a run, so that sections
+        checked inside node threads and replication targets checked inside
+        section threads do not multiply the number of threads
+
+        :param size: number of threads that may work besides the callers
+        """
+        self.lock = threading.Lock()
+        self.free = max(0, size)
+
+    def map(self, func, items):
+        """Run func(item) for each item on the calling thread, helped by as
+        many spare threads as are free.  Never waits for a spare thread, so
+        nested calls can not deadlock.
+
+        :return: list of results, in the same order as items
+        """
+        items = list(items)
+        results = [None] * len(items)
+        failures = []
+        pending = collections.deque(enumerate(items))
+
+        def work():
+            while True:
+                try:
+                    index, item = pending.popleft()
+                except IndexError:
+                    return
+                try:
+                    results[index] = func(item)
+                except Exception:
+                    failures.append(sys.exc_info())
+
+        with self.lock:
+            spare = min(self.free, len(items) - 1) if items else 0
+            self.free -= spare
+        threads = [threading.Thread(target=work) for i in range(spare)]
+        try:
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            work()
+        finally:
+            for thread in threads:
+                thread.join()
+            with self.lock:
+                self.free += spare
+        if failures:
+            six.reraise(*failures[0])
+        return results
+
+
 class WSChecker(object):
 
     def __init__(self, client, conf, node, test=False,
                  include_system_info=False,
-                 include_replication_checks=False):
+                 include_replication_checks=False,
+                 max_workers=1,
+                 max_per_array=constant.WSAPI_MAX_PER_ARRAY,
+                 sessions=None,
+                 results=None,
+                 workers=None):
         """Tests web service api configurations in the cinder.conf file
 
-        :param conf: location of cinder.conf
+        :param conf: parsed cinder.conf (CinderConf) or location of a local
+        copy
         :param node: cinder node the cinder.conf was copied from
         :param test: use testing client
+        :param max_workers: number of backend sections checked at the same
+        time
+        :param max_per_array: number of backend sections that may use the
+        same array at the same time
+        :param sessions: SessionCache shared with other checkers, the caller
+        logs out with sessions.logout_all() when done
+        :param results: cache.FileCache of earlier section results, sections
+        whose config and array are unchanged are served from it
+        :param workers: Workers shared with other checkers, by default
+        max_workers - 1 spare threads of this checker's own
         """
+        if isinstance(conf, six.string_types):
+            conf = cinder_conf.CinderConf.from_file(conf)
         self.conf = conf
         self.ssh_client = client
         self.node = node
         self.is_test = test
         self.include_system_info = include_system_info
         self.include_replication_checks = include_replication_checks
-        self.parser = configparser.ConfigParser()
-        self.parser.read(self.conf)
+        self.max_workers = max(1, max_workers)
+        self.max_per_array = max(1, max_per_array)
+        # sessions opened by a checker of its own are logged out by
+        # check_all() or close()
+        self.owns_sessions = sessions is None
+        self.sessions = sessions if sessions is not None else SessionCache()
+        self.results = results
+        self.workers = workers if workers is not None else \
+            Workers(self.max_workers - 1)
+        self.parser = conf
         self.hpe3pars = []
         for section in self.parser.sections():
             if self.parser.has_option(section, 'volume_driver') \
@@ -66,11 +253,47 @@ class WSChecker(object):
 
         :return: a list of dictionaries
         """
-        all_tests = []
-        for section_name in self.hpe3pars:
-            all_tests.append(self.check_section(section_name))
-        return all_tests
+        try:
+            return self.map_concurrent(self.try_check_section, self.hpe3pars)
+        finally:
+            if self.owns_sessions:
+                self.close()
+
+    def close(self):
+        """Log out of the array sessions opened by this checker
+        """
+        if self.owns_sessions:
+            self.sessions.logout_all()
 
+    def map_concurrent(self, func, items):
+        """Run func(item) for each item, with the spare threads of workers
+
+        :return: list of results, in the same order as items
+        """
+        def run(item):
+            # spare threads do the work of this checker's node
+            with profiler.on_node(self.node):
+                return func(item)
+        return self.workers.map(run, items)
+
+    def try_check_section(self, section_name):
+        """Runs check_section, turning an unexpected error into a failed
+        result for the section instead of losing the other sections
+
+        :return: a dictionary, None if the section is not a 3PAR backend
+        """
+        try:
+            return self.check_section(section_name)
+        except Exception as e:
+            logger.warning("%s -- Unable to check node '%s' backend section "
+                           "'%s'" % (e, self.node, section_name))
+            tests = self.new_results(section_name)
+            for check in tests:
+                if tests[check] == "unknown":
+                    tests[check] = "fail"
+            return tests
+
+    @profiler.phase('section')
     def check_section(self, section_name):
         logger.info("hpe3par_wsapi_checks - check_section()")
         """Runs all WS configuration tests for a section
@@ -78,6 +301,73 @@ class WSChecker(object):
         :param section_name: from cinder.conf as [SECTION_NAME]
         :return: a dictionary - each property is pass/fail/unknown
         """
+        if self.results is None or section_name not in self.hpe3pars:
+            return self.run_section_checks(section_name)
+
+        key = self.result_key(section_name)
+        if key:
+            tests = self.results.get(key)
+            if tests:
+                logger.info("Using stored result for node '%s' backend "
+                            "section '%s'" % (self.node, section_name))
+                return tests
+        tests = self.run_section_checks(section_name)
+        if key:
+            self.results.set(key, tests)
+        return tests
+
+    def result_key(self, section_name):
+        """Key of a stored section result: the node, the section, a hash of
+        the section's options and the serial numbers of its array and, when
+        replication is checked, of its replication targets
+
+        :return: string, None if one of the arrays can not be reached
+        """
+        serials = [self.array_serial(section_name)]
+        if self.include_replication_checks:
+            for device in self.get_replication_device_items(section_name):
+                api_url = device.get('hpe3par_api_url')
+                if not api_url:
+                    continue
+                credentials = {
+                    'uname': device.get('hpe3par_username'),
+                    'pwd': device.get('hpe3par_password'),
+                }
+                serials.append(self.array_serial(section_name, api_url,
+                                                 credentials))
+        if not all(serials):
+            return None
+
+        config = json.dumps([sorted(self.parser.items(section_name)),
+                             self.parser.get_all(section_name,
+                                                 'replication_device'),
+                             self.include_system_info,
+                             self.include_replication_checks])
+        digest = hashlib.sha256(config.encode('utf-8')).hexdigest()
+        return "%s:%s:%s:%s" % (self.node, section_name, digest,
+                                ','.join(serials))
+
+    def array_serial(self, section_name, url=None, credentials=None):
+        """Serial number of the array of a backend section or of one of its
+        replication targets
+
+        :param url: WS API url, defaults to the section's hpe3par_api_url
+        :param credentials: dictionary with 'uname' and 'pwd', defaults to the
+        section's hpe3par_username and hpe3par_password
+        :return: string, None if the array can not be reached
+        """
+        with self.array_limit(section_name, url):
+            client, logged_in = self.get_session(section_name, url,
+                                                 credentials)
+            if not logged_in:
+                return None
+            return self.get_array_info(client).get('serialNumber')
+
+    def new_results(self, section_name):
+        """Results of a section before any check has run
+
+        :return: a dictionary - each check is unknown
+        """
         tests = {
             "name": section_name,
             "url": "unknown",
@@ -94,6 +384,10 @@ class WSChecker(object):
         if self.include_replication_checks:
             tests["replication_info"] = "unknown"
             tests["replication_config_items"] = "unknown"
+        return tests
+
+    def run_section_checks(self, section_name):
+        tests = self.new_results(section_name)
 
         if section_name in self.hpe3pars:
             logger.info(
@@ -107,39 +401,90 @@ class WSChecker(object):
                 replication_config_items = \
                     self.get_replication_device_items(section_name)
                 if replication_config_items:
+                    results = self.verify_replication_devices(
+                        section_name,
+                        replication_config_items)
                     tests["replication_results"] = \
-                        self.verify_replication_device_info(
-                            section_name,
-                            replication_config_items)
+                        self.format_replication_results(results)
+                    tests["replication_times"] = dict(
+                        (result['backend_id'], result['seconds'])
+                        for result in results)
 
             tests["driver"] = self.has_driver(section_name)
-            client = self.get_client(section_name, self.is_test)
-            if client:
-                logger.info("client: '%s'" % (client))
-                tests["url"] = "pass"
-                if self.cred_is_valid(section_name, client):
-                    if self.include_system_info:
-                        tests["system_info"] = self.get_system_info(
-                            section_name,
-                            client)
-                    tests["credentials"] = "pass"
-                    tests["cpg"] = self.cpg_is_valid(section_name, client)
-                    if 'iscsi' in self.parser.get(section_name,
-                                                  'volume_driver'):
-                        tests["iscsi"] = self.iscsi_is_valid(section_name,
-                                                             client)
-                    client.logout()
+            with self.array_limit(section_name):
+                client, logged_in = self.get_session(section_name)
+                if client:
+                    logger.info("client: '%s'" % (client))
+                    tests["url"] = "pass"
+                    if logged_in:
+                        if self.include_system_info:
+                            tests["system_info"] = self.get_system_info(
+                                section_name,
+                                client)
+                        tests["credentials"] = "pass"
+                        tests["cpg"] = self.cpg_is_valid(section_name,
+                                                         client)
+                        if 'iscsi' in self.parser.get(section_name,
+                                                      'volume_driver'):
+                            tests["iscsi"] = self.iscsi_is_valid(
+                                section_name,
+                                client)
+                    else:
+                        tests["credentials"] = "fail"
                 else:
-                    tests["credentials"] = "fail"
-            else:
-                tests["url"] = "fail"
+                    tests["url"] = "fail"
             if 'hpe_3par_fc' in self.parser.get(section_name, 'volume_driver'):
                 tests["iscsi"] = "N/A"
             return tests
         else:
             return None
 
+    def array_limit(self, section_name, url=None):
+        """Semaphore to hold while using the array of a backend section
+
+        :param url: WS API url of the array, defaults to the section's
+        hpe3par_api_url
+        """
+        if not url:
+            try:
+                url = self.parser.get(section_name, 'hpe3par_api_url')
+            except configparser.NoOptionError:
+                url = None
+        return self.sessions.limit(url, self.max_per_array)
+
+    def get_session(self, section_name, url=None, credentials=None):
+        """Gets the shared, logged in client for the array of a backend section
+
+        :param url: WS API url, defaults to the section's hpe3par_api_url
+        :param credentials: dictionary with 'uname' and 'pwd', defaults to the
+        section's hpe3par_username and hpe3par_password
+        :return: (client, logged_in) - client is None if url is invalid
+        """
+        if not url:
+            try:
+                url = self.parser.get(section_name, 'hpe3par_api_url')
+            except configparser.NoOptionError:
+                logger.info("No hpe3par_api_url provided for node '%s' "
+                            "backend section '%s'" % (self.node,
+                                                      section_name))
+                return None, False
+        if not credentials:
+            credentials = {}
+            for key, option in (('uname', 'hpe3par_username'),
+                                ('pwd', 'hpe3par_password')):
+                if self.parser.has_option(section_name, option):
+                    credentials[key] = self.parser.get(section_name, option)
+
+        return self.sessions.open(
+            url,
+            credentials.get('uname'),
+            credentials.get('pwd'),
+            lambda: self.get_client(section_name, self.is_test, url),
+            lambda client: self.cred_is_valid(section_name, client,
+                                              credentials))
+
 # Config testing methods check if option values are valid
+    @profiler.phase('wsapi_connect')
     def get_client(self, section_name, test, url=None):
         logger.info("hpe3par_wsapi_checks - get_client()")
         """Tries to create a client and verifies the api url
@@ -167,21 +512,25 @@ class WSChecker(object):
                         "section '%s'" % (self.node, section_name))
             return None
 
+    @profiler.phase('wsapi_login')
     def cred_is_valid(self, section_name, client, credentials=None):
         logger.info("hpe3par_wsapi_checks - cred_is_valid()")
         """Tries to login to the client to verify credentials
 
         :return: True if credentials are valid, False if invalid/missing
         """
-        if not credentials:
-            uname = self.parser.get(section_name, 'hpe3par_username')
-            pwd = self.parser.get(section_name, 'hpe3par_password')
-        else:
-            uname = credentials['uname']
-            pwd = credentials['pwd']
-
-        logger.info("Use credentials %s -- %s: " % (uname, pwd))
         try:
+            if not credentials:
+                uname = self.parser.get(section_name, 'hpe3par_username')
+                pwd = self.parser.get(section_name, 'hpe3par_password')
+            else:
+                uname = credentials.get('uname')
+                pwd = credentials.get('pwd')
+                if uname is None or pwd is None:
+                    raise configparser.NoOptionError('hpe3par_username',
+                                                     section_name)
+
+            logger.info("Use credentials %s -- %s: " % (uname, pwd))
             client.login(uname, pwd)
             return True
         except (hpe_exceptions.HTTPForbidden,
@@ -212,12 +561,19 @@ class WSChecker(object):
 
             logger.info("Checking hpe3par_cpg option for node '%s' backend "
                         "section '%s'" % (self.node, section_name))
+            cpg_names = self.get_cpg_names(client)
             for cpg in cpg_list:
-                try:
-                    logger.info("request client.getCPG(): '%s' " %
-                                (cpg))
-                    client.getCPG(cpg)
-                except hpe_exceptions.HTTPNotFound:
+                if cpg_names is not None:
+                    found = cpg in cpg_names
+                else:
+                    try:
+                        logger.info("request client.getCPG(): '%s' " %
+                                    (cpg))
+                        client.getCPG(cpg)
+                        found = True
+                    except hpe_exceptions.HTTPNotFound:
+                        found = False
+                if not found:
                     logger.info("Node '%s' backend section '%s' hpe3par_cpg "
                                 "contains an invalid CPG name: '%s'" %
                                 (self.node, section_name, cpg))
@@ -229,26 +585,36 @@ class WSChecker(object):
             result = "fail"
         return result
 
+    def get_cpg_names(self, client):
+        """Lists the CPGs of an array once per session
+
+        :return: set of CPG names, None if the array can not list them
+        """
+        @profiler.phase('wsapi_getCPGs')
+        def fetch(client):
+            logger.info("request client.getCPGs()")
+            try:
+                return set(cpg['name'] for cpg in
+                           client.getCPGs().get('members', []))
+            except hpe_exceptions.ClientException as e:
+                logger.info("Could not list CPGs, checking them one at a "
+                            "time --- %s" % e)
+                return None
+        return self.sessions.cached(client, 'cpgs', fetch)
+
     def iscsi_is_valid(self, section_name, client):
         logger.info("hpe3par_wsapi_checks - iscsi_is_valid()")
         """Gets the iSCSI target ports from the client, checks the iSCSI IPs.
 
         :return: string
         """
-        valid_ips = []
         result = "pass"
 
         ip_list = self.get_iscsi_ips(section_name)
         if ip_list:
             logger.info("Checking iSCSI IP addresses for node '%s' backend "
                         "section '%s'" % (self.node, section_name))
-            for port in client.getPorts()['members']:
-                if (port['mode'] == client.PORT_MODE_TARGET and
-                        port['linkState'] == client.PORT_STATE_READY and
-                        port['protocol'] == client.PORT_PROTO_ISCSI):
-                    valid_ips.append(port['IPAddr'])
-                    logger.info(
-                        "Checking iscsi IP port: '%s'" % (port['IPAddr']))
+            valid_ips = self.get_port_index(client)['iscsi_ips']
             for ip_addr in ip_list:
                 ip = ip_addr.split(':')
                 logger.info("ip: '%s'" % (ip))
@@ -267,6 +633,39 @@ class WSChecker(object):
 
         return result
 
+    def get_array_info(self, client):
+        """Gets the storage system info of an array once per session
+
+        :return: dictionary
+        """
+        @profiler.phase('wsapi_getStorageSystemInfo')
+        def fetch(client):
+            logger.info("request client.getStorageSystemInfo()")
+            return client.getStorageSystemInfo()
+        return self.sessions.cached(client, 'system_info', fetch)
+
+    def get_port_index(self, client):
+        """Indexes the ready target ports of an array once per session
+
+        :return: dictionary with a set of iSCSI IPs as 'iscsi_ips' and a set
+        of FC WWNs as 'fc_wwns'
+        """
+        @profiler.phase('wsapi_getPorts')
+        def fetch(client):
+            logger.info("request client.getPorts()")
+            index = {'iscsi_ips': set(), 'fc_wwns': set()}
+            for port in client.getPorts().get('members', []):
+                if (port.get('mode') != client.PORT_MODE_TARGET or
+                        port.get('linkState') != client.PORT_STATE_READY):
+                    continue
+                if port.get('protocol') == client.PORT_PROTO_ISCSI:
+                    index['iscsi_ips'].add(port['IPAddr'])
+                elif port.get('protocol') == client.PORT_PROTO_FC:
+                    index['fc_wwns'].add(port['portWWN'])
+            logger.info("Target ports: '%s'" % (index))
+            return index
+        return self.sessions.cached(client, 'ports', fetch)
+
     def get_iscsi_ips(self, section_name):
         ip_list = []
         try:
@@ -300,6 +699,7 @@ class WSChecker(object):
 
         return ip_list
 
+    @profiler.phase('driver_check')
     def has_driver(self, section_name):
         logger.info("hpe3par_wsapi_checks - has_driver()")
         """Checks that the volume_driver is installed
@@ -380,15 +780,15 @@ class WSChecker(object):
 
         format_str = ""
 
-        entries = self.get_replication_device_items(section_name)
-        for entry in entries:
-            logger.info("REPLICATION config entry: '%s'" % (entry))
+        devices = self.get_replication_device_items(section_name)
+        for device in devices:
+            logger.info("REPLICATION config entry: '%s'" % (device))
             if format_str:
                 format_str += ";"
             format_str += ("replication_device==")
-            items = entry.split("::")
-            for item in items:
-                format_str += (item.replace("==", "=") + ";")
+            for option in options:
+                if option in device:
+                    format_str += option + "=" + device[option] + ";"
 
         if format_str:
             format_str += ";"
@@ -399,89 +799,9 @@ class WSChecker(object):
         logger.info("get cinder.conf replication_device items")
         """Get all replication device items listed in config.conf for this section
 
-        :return: string
+        :return: list of dictionaries, one per replication_device entry
         """
-
-        rep_entries = []
-
-        try:
-            # can have multiple "replication_device" entries, so we need
-            # to do our own parsing
-            f = open(self.conf)
-            in_correct_section = False
-            in_replication_entry = False
-            replication_lines = []
-            replication_line = ''
-            for line in f:
-                line = line.strip()
-                if "[" + section_name + "]" in line:
-                    in_correct_section = True
-                elif "[" in line and "]" in line:
-                    in_correct_section = False
-
-                if in_correct_section:
-                    str_line = line.strip()
-                    if str_line.startswith('replication_device'):
-                        replication_line = line
-                        if line.endswith(","):
-                            in_replication_entry = True
-                        else:
-                            replication_lines.append(replication_line)
-                    elif in_replication_entry:
-                        replication_line += line
-                        if not line.endswith(","):
-                            in_replication_entry = False
-                            replication_lines.append(replication_line)
-                            logger.info("line3 = '%s'" % (replication_line))
-            f.close()
-
-            # pull out options from each "replication_device" entries
-            for replicaton_line in replication_lines:
-                option, value = replicaton_line.split("=", 1)
-                logger.info("rep item[%s] = '%s'" % (option, value))
-                value = value.strip()
-                entries = value.split(",")
-                rep_entry = {}
-                for entry in entries:
-                    if ":" in entry:
-                        suboption, subvalue = entry.split(":", 1)
-                        rep_entry[suboption] = subvalue
-                        logger.info("rep item[%s] = '%s'" % (suboption, subvalue))
-                rep_entries.append(rep_entry)
-
-        except Exception as ex:
-            logger.info("ERROR replication_device error = '%s'" % (ex))
-            return None
-
-        results = []
-        for rep_entry in rep_entries:
-            result = ""
-            if 'backend_id' in rep_entry:
-                result += "backend_id==" + rep_entry['backend_id']
-            if 'replication_mode' in rep_entry:
-                if result:
-                    result += "::"
-                result += "replication_mode==" + rep_entry['replication_mode']
-            if 'cpg_map' in rep_entry:
-                if result:
-                    result += "::"
-                result += "cpg_map==" + rep_entry['cpg_map']
-            if 'hpe3par_api_url' in rep_entry:
-                if result:
-                    result += "::"
-                result += "hpe3par_api_url==" + rep_entry['hpe3par_api_url']
-            if 'hpe3par_username' in rep_entry:
-                if result:
-                    result += "::"
-                result += "hpe3par_username==" + rep_entry['hpe3par_username']
-            if 'hpe3par_password' in rep_entry:
-                if result:
-                    result += "::"
-                result += "hpe3par_password==" + rep_entry['hpe3par_password']
-            logger.info("replication entry: %s" % (result))
-            results.append(result)
-
-        return results
+        return self.parser.replication_devices(section_name)
 
     def get_system_info(self, section_name, client):
         logger.info("hpe3par_wsapi_checks - get_system_info()")
@@ -492,7 +812,7 @@ class WSChecker(object):
         result = "unknown"
 
         try:
-            info = client.getStorageSystemInfo()
+            info = self.get_array_info(client)
             result = "name:" + info['name'] + ";;"
             result += "os_version:" + info['systemVersion'] + ";;"
             result += "model:" + info['model'] + ";;"
@@ -538,43 +858,60 @@ class WSChecker(object):
 
         :return: string
         """
-        result_str = ""
+        return self.format_replication_results(
+            self.verify_replication_devices(section_name,
+                                            replication_config_items))
 
-        for config_items in replication_config_items:
-            result = {
-                # "overall": "pass",
-                "backend_id": "Unknown",
-                "wsapi": "fail",
-                "credentials": "fail",
-                "source_cpgs": "fail",
-                "destination_cpgs": "fail",
-                "replication_mode": "fail",
-            }
-            items = config_items.split("::")
-
-            id = self.find_replication_option(items, "backend_id")
-            if id:
-                result['backend_id'] = id
-
-            replication_mode = self.find_replication_option(items,
-                                                            "replication_mode")
-            if replication_mode == 'periodic' or replication_mode == "sync":
-                result['replication_mode'] = "pass"
-
-            api_url = self.find_replication_option(items, "hpe3par_api_url")
-            if api_url:
-                client = self.get_client(section_name, False, api_url)
+    def verify_replication_devices(self, section_name, devices):
+        """Verify the replication devices of a section, up to max_workers
+        targets at a time
+
+        :param devices: list of replication_device dictionaries
+        :return: list of result dictionaries, in the same order as devices
+        """
+        return self.map_concurrent(
+            lambda device: self.verify_replication_device(section_name,
+                                                          device),
+            devices)
+
+    @profiler.phase('replication_target')
+    def verify_replication_device(self, section_name, device):
+        """Verify a single replication_device entry against its array
+
+        :param device: replication_device dictionary
+        :return: dictionary - each property is pass/fail, plus the seconds
+        spent checking the target
+        """
+        start = time.time()
+        result = {
+            # "overall": "pass",
+            "backend_id": "Unknown",
+            "wsapi": "fail",
+            "credentials": "fail",
+            "source_cpgs": "fail",
+            "destination_cpgs": "fail",
+            "replication_mode": "fail",
+        }
+        if device.get('backend_id'):
+            result['backend_id'] = device['backend_id']
+
+        replication_mode = device.get('replication_mode')
+        if replication_mode == 'periodic' or replication_mode == "sync":
+            result['replication_mode'] = "pass"
+
+        api_url = device.get('hpe3par_api_url')
+        if api_url:
+            with self.array_limit(section_name, api_url):
+                credentials = {
+                    'uname': device.get('hpe3par_username'),
+                    'pwd': device.get('hpe3par_password'),
+                }
+                client, logged_in = self.get_session(section_name,
+                                                     api_url,
+                                                     credentials)
                 if client:
                     result['wsapi'] = "pass"
-                    credentials = {
-                        'uname': self.find_replication_option(
-                            items,
-                            "hpe3par_username"),
-                        'pwd': self.find_replication_option(
-                            items,
-                            "hpe3par_password"),
-                    }
-                    if self.cred_is_valid(section_name, client, credentials):
+                    if logged_in:
                         result["credentials"] = "pass"
 
                         # for cpgs, they are provide in a format that is:
@@ -583,19 +920,31 @@ class WSChecker(object):
                         # listed hpe3par_cpg
                         # verify toCPGs by checking if they exist on
                         # replication device
-                        from_cpg_list = self.get_replication_cpgs(items)
-                        result['source_cpgs'] = \
-                            self.verify_replication_source_cpgs(section_name,
-                                                                from_cpg_list)
-
+                        from_cpg_list = self.get_replication_cpgs(device)
                         to_cpg_list = self.get_replication_cpgs(
-                            items,
+                            device,
                             on_replication_device=True)
-                        result['desctination_cpgs'] = \
-                            self.cpg_is_valid(section_name,
-                                              client,
-                                              to_cpg_list)
+                        if from_cpg_list:
+                            result['source_cpgs'] = \
+                                self.verify_replication_source_cpgs(
+                                    section_name,
+                                    from_cpg_list)
+                        if to_cpg_list:
+                            result['destination_cpgs'] = \
+                                self.cpg_is_valid(section_name,
+                                                  client,
+                                                  to_cpg_list)
+
+        result['seconds'] = time.time() - start
+        logger.info("Replication target '%s' of node '%s' backend section "
+                    "'%s' checked in %.3f seconds" %
+                    (result['backend_id'], self.node, section_name,
+                     result['seconds']))
+        return result
 
+    def format_replication_results(self, results):
+        result_str = ""
+        for result in results:
             result_str += \
                 "Backend ID:" + result['backend_id'] + ";;" + \
                 " WS API:" + result['wsapi'] + ";;" + \
@@ -607,20 +956,15 @@ class WSChecker(object):
         logger.info("Replication Verification Result: '%s'" % (result_str))
         return result_str
 
-    def find_replication_option(self, items, option):
-        for item in items:
-            entry = item.split("==")
-            if entry[0] == option:
-                return entry[1]
-
-        return None
-
-    def get_replication_cpgs(self, items, on_replication_device=False):
+    def get_replication_cpgs(self, device, on_replication_device=False):
         cpg_list = []
-        cpg_map = self.find_replication_option(items, "cpg_map")
-        cpg_pairs = cpg_map.split(" ")
+        cpg_map = device.get('cpg_map', '')
+        cpg_pairs = cpg_map.split()
         for cpg_pair in cpg_pairs:
             cpgs = cpg_pair.split(":")
+            if len(cpgs) != 2:
+                logger.info("Invalid cpg_map entry: '%s'" % (cpg_pair))
+                continue
             if on_replication_device:
                 # cpgs on replication device are listed second
                 cpg_list.append(cpgs[1])
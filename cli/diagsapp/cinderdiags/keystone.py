@@ -0,0 +1,151 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Builds the OpenStack environment for the cinder CLI calls made on the nodes.
+
+With keystone_token enabled in cli.conf and keystoneauth1 installed, a
+Keystone token is requested once per run from the -os-vars credentials and
+handed to every remote cinder call as OS_TOKEN/OS_URL, so the nodes do not
+authenticate again for each call.  The token is requested from the host
+running cinderdiags, within keystone_timeout seconds.  It can also be kept in
+cache_dir until shortly before it expires (see token_cache_ttl in cli.conf).
+Otherwise, or if no token can be had, the credentials themselves are exported
+as before.
+
+Optional: sudo pip install keystoneauth1
+"""
+
+import calendar
+import hashlib
+import json
+import logging
+import time
+
+from cinderdiags import constant
+from six.moves import shlex_quote
+
+logger = logging.getLogger(__name__)
+
+try:
+    from keystoneauth1.identity import generic
+    from keystoneauth1 import session
+except ImportError:
+    generic = None
+
+
+# -os-vars the cinder CLI can not do without
+REQUIRED_VARS = ['os_username', 'os_password', 'os_tenant', 'os_auth']
+
+
+def available():
+    return generic is not None
+
+
+def cache_key(os_vars):
+    """Cache key of a set of credentials, the password only as a digest
+    """
+    return hashlib.sha256(json.dumps(
+        [os_vars.get('os_auth'), os_vars.get('os_username'),
+         os_vars.get('os_tenant'), os_vars.get('os_password')],
+        sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_token(os_vars, token_cache=None,
+              timeout=constant.KEYSTONE_TIMEOUT):
+    """Get a Keystone token and the volume endpoint for the credentials
+
+    :param os_vars: dictionary of os_username, os_password, os_tenant and
+    os_auth, with optional os_user_domain, os_project_domain, os_region and
+    os_volume_service
+    :param token_cache: optional cache.FileCache of tokens
+    :param timeout: seconds allowed for each request to Keystone
+    :return: dictionary with 'token', 'url' and 'expires', None if no token
+    could be had
+    """
+    key = cache_key(os_vars)
+    if token_cache is not None:
+        cached = token_cache.get(key)
+        if cached and cached['expires'] - time.time() > \
+                constant.TOKEN_EXPIRY_MARGIN:
+            logger.info("Reusing cached Keystone token for %s" %
+                        os_vars.get('os_username'))
+            return cached
+
+    if not available():
+        logger.error('keystoneauth1 package not found (pip install '
+                     'keystoneauth1), each cinder call authenticates on its '
+                     'own')
+        return None
+    try:
+        auth = generic.Password(
+            auth_url=os_vars['os_auth'],
+            username=os_vars['os_username'],
+            password=os_vars['os_password'],
+            project_name=os_vars['os_tenant'],
+            user_domain_name=os_vars.get('os_user_domain', 'Default'),
+            project_domain_name=os_vars.get('os_project_domain', 'Default'))
+        keystone = session.Session(auth=auth, timeout=timeout)
+        access = auth.get_access(keystone)
+        url = keystone.get_endpoint(
+            service_type=os_vars.get('os_volume_service',
+                                     constant.VOLUME_SERVICE_TYPE),
+            region_name=os_vars.get('os_region'),
+            interface='public')
+        token = {'token': access.auth_token,
+                 'url': url,
+                 'expires': calendar.timegm(access.expires.utctimetuple())}
+    except Exception as e:
+        logger.warning("%s -- Unable to get a Keystone token from %s" %
+                       (e, os_vars.get('os_auth')))
+        return None
+
+    if token_cache is not None:
+        token_cache.set(key, token)
+    return token
+
+
+def os_env(os_vars, token_cache=None, use_token=False,
+           timeout=constant.KEYSTONE_TIMEOUT):
+    """Shell exports that set up the cinder CLI on a node
+
+    :param os_vars: dictionary from -os-vars, None to rely on the
+    environment of the node
+    :param token_cache: optional cache.FileCache of tokens
+    :param use_token: export a Keystone token requested from this host
+    instead of the credentials
+    :param timeout: seconds allowed for each request to Keystone
+    :return: string of export commands, empty if there are no os_vars
+    """
+    if not os_vars:
+        return ''
+    if not use_token:
+        return password_env(os_vars)
+    token = get_token(os_vars, token_cache, timeout)
+    if token and token['url']:
+        return "export OS_TOKEN=%s; export OS_URL=%s;" % (
+            shlex_quote(token['token']), shlex_quote(token['url']))
+    return password_env(os_vars)
+
+
+def password_env(os_vars):
+    """Shell exports of the -os-vars credentials
+    """
+    return "export OS_USERNAME=%s; " \
+           "export OS_PASSWORD=%s; " \
+           "export OS_TENANT_NAME=%s; " \
+           "export OS_AUTH_URL=%s;" % (shlex_quote(os_vars['os_username']),
+                                       shlex_quote(os_vars['os_password']),
+                                       shlex_quote(os_vars['os_tenant']),
+                                       shlex_quote(os_vars['os_auth']))
@@ -14,90 +14,178 @@
 
 import json
 import logging
+import posixpath
 
 from cinderdiags import constant
+from cinderdiags import keystone
+from six.moves import shlex_quote
 
 logger = logging.getLogger(__name__)
 
-
-def get_all_paths(client, node, json_os_vars):
+# protocols listed by cinder get-all-volume-paths, and the text that marks a
+# path of the protocol
+PROTOCOLS = [
+    ('ISCSI', '-iscsi-'),
+    ('FIBRE_CHANNEL', '-fc-'),
+]
+
+# by-path links and the block devices they point to, e.g.
+# "/dev/disk/by-path/ip-...-iscsi-...-lun-1 ../../sdb"
+BY_PATH_QUERY = "find /dev/disk/by-path -maxdepth 1 -type l " \
+                "-printf '%p %l\\n' 2>/dev/null"
+# devices held by a multipath map, e.g. "/sys/block/sdb/holders dm-0"
+HOLDERS_QUERY = "find /sys/block/*/holders -mindepth 1 -maxdepth 1 " \
+                "-printf '%h %f\\n' 2>/dev/null"
+# multipath map names, e.g. "/sys/block/dm-0/dm/name:mpatha"
+MULTIPATH_QUERY = "grep -H . /sys/block/dm-*/dm/name 2>/dev/null"
+
+
+def get_all_paths(client, node, json_os_vars, os_env=None):
     """Check for packages installed via apt-get (Debian Linux)
 
     :param client: ssh client
     :param node: node being checked
     :param os_vars: OpenStack env variables required to run Cinder commands
+    :param os_env: exports set up by keystone.os_env, defaults to exporting
+    the os_vars credentials
     :return: dictionary list
     """
 
     paths = []
     try:
-        os_vars = json.loads(json_os_vars)
-        logger.info("Requesting all volume paths using "
-                    "OpenStack vars %s" % (os_vars))
-
-        export_cmd = "export OS_USERNAME=%s; " \
-                     "export OS_PASSWORD=%s; " \
-                     "export OS_TENANT_NAME=%s; " \
-                     "export OS_AUTH_URL=%s;" % (os_vars['os_username'],
-                                                 os_vars['os_password'],
-                                                 os_vars['os_tenant'],
-                                                 os_vars['os_auth'])
-
-        logger.info("export_cmd %s" % (export_cmd))
-        resp = client.execute(
-            export_cmd +
-            " sudo cinder get-all-volume-paths --protocol 'ISCSI'")
-        iscsi_paths = resp.strip().split()
-        resp = client.execute(
-            export_cmd +
-            " sudo cinder get-all-volume-paths --protocol 'FIBRE_CHANNEL'")
-        fc_paths = resp.strip().split()
-
-        for iscsi_path in iscsi_paths:
-            if "-iscsi-" in iscsi_path:
-                path_entry = {}
-                path_entry['path'] = iscsi_path
-                path_entry['vol_name'] = None
-                paths.append(path_entry)
-        for fc_path in fc_paths:
-            if "-fc-" in fc_path:
+        if os_env is None:
+            os_env = keystone.password_env(json.loads(json_os_vars))
+        logger.info("Requesting all volume paths on node %s" % node)
+
+        # both protocols are listed in one round trip
+        results = client.execute_many(
+            [os_env +
+             " sudo cinder get-all-volume-paths --protocol '%s'" % protocol
+             for protocol, marker in PROTOCOLS])
+
+        for (protocol, marker), result in zip(PROTOCOLS, results):
+            for found_path in result['stdout'].strip().split():
+                if marker in found_path:
+                    path_entry = {}
+                    path_entry['path'] = found_path
+                    path_entry['vol_name'] = None
+                    path_entry['protocol'] = protocol
+                    paths.append(path_entry)
+
+        logger.info("PATHS [%s]: %s" % (len(paths), paths))
+    except Exception as e:
+        logger.warning("%s -- Unable to get volume paths on "
+                       "node %s" % (e, node))
+        pass
+    return paths
+
+
+def discover_paths(client, node):
+    """List volume paths from /dev/disk/by-path and sysfs, without the
+    cinder CLI
+
+    :param client: ssh client
+    :param node: node being checked
+    :return: dictionary list
+    """
+
+    paths = []
+    try:
+        logger.info("Discovering volume paths on node %s from sysfs" % node)
+        responses = dict((result['command'], result['stdout'])
+                         for result in client.execute_many(
+                             [BY_PATH_QUERY, HOLDERS_QUERY,
+                              MULTIPATH_QUERY]))
+        maps = {}
+        for line in responses[MULTIPATH_QUERY].splitlines():
+            name_file, sep, name = line.partition(':')
+            if sep:
+                maps[name_file.split('/')[3]] = name.strip()
+        holders = {}
+        for line in responses[HOLDERS_QUERY].splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                holders[parts[0].split('/')[3]] = parts[1]
+
+        links = sorted(line.split(None, 1)
+                       for line in responses[BY_PATH_QUERY].splitlines()
+                       if len(line.split(None, 1)) == 2)
+        for protocol, marker in PROTOCOLS:
+            for found_path, target in links:
+                # partitions of a volume are not paths of their own
+                if marker not in found_path or '-part' in found_path:
+                    continue
+                device = posixpath.basename(target.strip())
                 path_entry = {}
-                path_entry['path'] = fc_path
+                path_entry['path'] = found_path
                 path_entry['vol_name'] = None
+                path_entry['protocol'] = protocol
+                path_entry['device'] = device
+                path_entry['multipath'] = maps.get(holders.get(device))
                 paths.append(path_entry)
 
         logger.info("PATHS [%s]: %s" % (len(paths), paths))
     except Exception as e:
-        logger.warning("%s -- Unable to get volume paths on "
+        logger.warning("%s -- Unable to discover volume paths on "
                        "node %s" % (e, node))
         pass
     return paths
 
 
-def get_paths_for_volume(client, node, volume):
+def get_paths_for_volume(client, node, volume, os_env=''):
     """Check for packages installed via apt-get (Debian Linux)
 
     :param client: ssh client
     :param node: node being checked
     :param volume: name or ID of volume
+    :param os_env: exports set up by keystone.os_env
     :return: dictionary list
     """
 
-    paths = []
+    return get_paths_for_volumes(client, node, [volume],
+                                 os_env).get(volume, [])
+
+
+def get_paths_for_volumes(client, node, volumes, os_env=''):
+    """Get the paths of several volumes in one round trip
+
+    :param client: ssh client
+    :param node: node being checked
+    :param volumes: list of volume names or IDs
+    :param os_env: exports set up by keystone.os_env, empty to use the
+    environment of the node
+    :return: dictionary of volume to list of paths
+    """
+
+    paths = {}
+    if not volumes:
+        return paths
     try:
         logger.info("Requesting volume paths on node %s for "
-                    "volume %s" % (node, volume))
-        export_cmd = "export OS_USERNAME=admin; " \
-                     "export OS_PASSWORD=hpinvent; " \
-                     "export OS_TENANT_NAME=admin; " \
-                     "export OS_AUTH_URL=http://localhost:35357;"
-        resp = client.execute(export_cmd +
-                              " sudo cinder get-volume-paths " + volume)
-        paths = resp.strip().split()
+                    "volumes %s" % (node, volumes))
+        results = client.execute_many(
+            [os_env + " sudo cinder get-volume-paths " +
+             shlex_quote(volume) for volume in volumes])
+        for volume, result in zip(volumes, results):
+            if result['exit_code']:
+                logger.warning("Unable to get volume paths for volume %s "
+                               "on node %s: %s" % (volume, node,
+                                                   result['stderr'].strip()))
+                paths[volume] = []
+                continue
+            paths[volume] = result['stdout'].strip().split()
 
         logger.info("PATHS [%s]: %s" % (len(paths), paths))
     except Exception as e:
-        logger.warning("%s -- Unable to get volume paths for volume %s "
-                       "on node %s" % (e, volume, node))
+        logger.warning("%s -- Unable to get volume paths for volumes %s "
+                       "on node %s" % (e, volumes, node))
         pass
     return paths
+
+
+def index_paths(paths):
+    """Index path entries from get_all_paths by device path
+
+    :return: dictionary of path to path entry
+    """
+    return dict((entry['path'], entry) for entry in paths)
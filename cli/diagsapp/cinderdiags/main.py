@@ -16,6 +16,8 @@ import sys
 from cliff.app import App
 from cliff.commandmanager import CommandManager
 
+from cinderdiags import ssh_pool
+
 
 class CinderDiags(App):
     App.DEFAULT_VERBOSE_LEVEL = 0
@@ -42,7 +44,10 @@ class CinderDiags(App):
 
 def main(argv=sys.argv[1:]):
     myapp = CinderDiags()
-    return myapp.run(argv)
+    try:
+        return myapp.run(argv)
+    finally:
+        ssh_pool.POOL.close()
 
 
 if __name__ == '__main__':
@@ -16,6 +16,8 @@ import argparse
 import logging
 
 from cinderdiags import conf_reader
+from cinderdiags import formatters
+from cinderdiags import profiler
 from cliff.lister import Lister
 
 log = logging.getLogger(__name__)
@@ -70,17 +72,54 @@ class CheckOptions(Lister):
                             dest='replication',
                             action='store_true',
                             help=argparse.SUPPRESS)
+        parser.add_argument('-parallel',
+                            dest='parallel',
+                            type=int,
+                            metavar='N',
+                            help='number of nodes to check at the same time '
+                                 '(defaults to max_workers in cli.conf)')
+        parser.add_argument('-processes',
+                            dest='processes',
+                            type=int,
+                            metavar='N',
+                            help='number of worker processes to spread the '
+                                 'nodes across (defaults to processes in '
+                                 'cli.conf)')
+        parser.add_argument('-profile',
+                            dest='profile',
+                            action='store_true',
+                            help='time each phase of the check per node, '
+                                 'add a Profile column and write a timing '
+                                 'table to stderr')
+        parser.add_argument('-incremental',
+                            dest='incremental',
+                            action='store_true',
+                            help='reuse results of earlier runs for backend '
+                                 'sections whose options and array have not '
+                                 'changed (see result_cache_ttl in cli.conf)')
         return parser
 
     def take_action(self, parsed_args):
+        if parsed_args.profile:
+            profiler.start()
         reader = conf_reader.Reader(parsed_args.test,
                                     parsed_args.conf,
                                     parsed_args.data,
                                     parsed_args.info,
-                                    parsed_args.replication)
-        result = reader.options_check(parsed_args.name)
-        if len(result) < 1:
-            raise ValueError("%s not found" % parsed_args.name)
+                                    parsed_args.replication,
+                                    parsed_args.parallel,
+                                    parsed_args.processes)
+        if formatters.is_streaming(parsed_args):
+            result = formatters.non_empty(
+                reader.iter_options_check(parsed_args.name,
+                                          parsed_args.incremental,
+                                          ordered=False),
+                ValueError("%s not found" % parsed_args.name))
+        else:
+            result = reader.options_check(parsed_args.name,
+                                          parsed_args.incremental)
+            if len(result) < 1:
+                raise ValueError("%s not found" % parsed_args.name)
 
         columns = ()
         columns_base = (
@@ -99,31 +138,33 @@ class CheckOptions(Lister):
         if parsed_args.info:
             columns += ('System Info', 'Conf Items')
 
-        data = []
-
-        for arr in result:
-            entry = ()
-            entry_base = (
-                arr['node'],
-                arr['name'],
-                arr['url'],
-                arr['credentials'],
-                arr['cpg'],
-                arr['iscsi'],
-                arr['driver'],
-            )
-            entry = entry_base
-
-            if parsed_args.replication:
-                if 'replication_results' in arr:
-                    rep_results = arr['replication_results']
-                    entry += (rep_results,)
-                else:
-                    entry += ("N/A",)
-
-            if parsed_args.info:
-                entry += (arr['system_info'], arr['conf_items'])
-
-            data.append(entry)
+        data = (self.get_entry(arr, parsed_args) for arr in result)
 
+        if parsed_args.profile:
+            return profiler.report(columns, data)
         return (columns, data)
+
+    def get_entry(self, arr, parsed_args):
+        entry = ()
+        entry_base = (
+            arr['node'],
+            arr['name'],
+            arr['url'],
+            arr['credentials'],
+            arr['cpg'],
+            arr['iscsi'],
+            arr['driver'],
+        )
+        entry = entry_base
+
+        if parsed_args.replication:
+            if 'replication_results' in arr:
+                rep_results = arr['replication_results']
+                entry += (rep_results,)
+            else:
+                entry += ("N/A",)
+
+        if parsed_args.info:
+            entry += (arr['system_info'], arr['conf_items'])
+
+        return entry
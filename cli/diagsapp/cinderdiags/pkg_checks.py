@@ -12,20 +12,41 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import json
 import logging
 import re
 from cinderdiags import constant
+from cinderdiags import profiler
 
 
 logger = logging.getLogger(__name__)
 
+DPKG_QUERY = "dpkg-query -W -f='${Status}${Version}' "
+YUM_QUERY = "yum list installed "
+ZYPPER_QUERY = "zypper info "
+PIP_QUERY = "pip list | grep "
 
-def check_all(client, node, service):
+RELEASE_QUERY = 'cat /etc/*release | grep ^ID_LIKE'
+MACHINE_ID_QUERY = 'cat /etc/machine-id 2>/dev/null || ' \
+                   'cat /var/lib/dbus/machine-id'
+DPKG_INVENTORY = "dpkg-query -W -f='${Package} ${Status} ${Version}\\n'"
+RPM_INVENTORY = "rpm -qa --qf '%{NAME} %{VERSION}\\n'"
+PIP_INVENTORY = "pip list --format=json 2>/dev/null || pip list"
+
+DPKG_INVENTORY_LINE = re.compile('^(\\S+) install ok installed (\\S+)$')
+RPM_INVENTORY_LINE = re.compile('^(\\S+) (\\S+)$')
+PIP_INVENTORY_LINE = re.compile('^([\\w\\.\\-]+)\\s+\\(?(\\d[^\\s,\\)]*)')
+INVENTORY_VERSION = re.compile('^(?:\\d+:)?\\D*([\\d\\.]*\\d)')
+
+
+@profiler.phase('package_check')
+def check_all(client, node, service, os_cache=None):
     """Check for default packages on cinder or nova node
 
     :param client: ssh client
     :param node: node being checked
-    :param pkg_info: tuple of ('package name', 'minimum version')
+    :param service: cinder or nova
+    :param os_cache: optional cache.FileCache of detected OS flavors
     :return: list of dictionaries
     """
     defaults = {
@@ -33,46 +54,220 @@ def check_all(client, node, service):
         'nova': constant.NOVA_PACKAGES,
     }
 
-    checked = []
-    checker = get_check_type(client, node)
-    if checker is not None:
-        for pkg in defaults[service]:
-            check = checker(client, node, pkg)
-            if check['installed'] == 'unknown':
-                check = pip_check(client, node, pkg)
-            checked.append(check)
-    else:
-        checked.append({
+    checked = check_packages(client, node, defaults[service], os_cache)
+    if checked is None:
+        checked = [{
             'node': node,
             'name': 'ERROR',
             'installed': 'ERROR',
             'version': 'ERROR',
-        })
+        }]
     return checked
 
 
-def check_one(client, node, pkg_info):
+def check_one(client, node, pkg_info, os_cache=None):
     """Check for a single package on a single node
 
     :param client: ssh client
     :param node: node being checked
     :param pkg_info: tuple of ('package name', 'minimum version')
+    :param os_cache: optional cache.FileCache of detected OS flavors
     :return: dictionary
     """
+    return check_list(client, node, [pkg_info], os_cache)[0]
 
-    checker = get_check_type(client, node)
-    if checker is not None:
-        check = checker(client, node, pkg_info)
-        if check['installed'] == 'unknown':
-            check = pip_check(client, node, pkg_info)
-    else:
-        check = {
+
+@profiler.phase('package_check')
+def check_list(client, node, packages, os_cache=None):
+    """Check for a list of packages on a single node
+
+    :param client: ssh client
+    :param node: node being checked
+    :param packages: list of ('package name', 'minimum version') tuples
+    :param os_cache: optional cache.FileCache of detected OS flavors
+    :return: list of dictionaries
+    """
+    checked = check_packages(client, node, packages, os_cache)
+    if checked is None:
+        checked = [{
             'node': node,
             'name': pkg_info[0],
             'installed': 'ERROR',
             'version': 'ERROR',
-        }
-    return check
+        } for pkg_info in packages]
+    return checked
+
+
+def check_packages(client, node, packages, os_cache=None):
+    """Check for packages using the node's installed package inventory
+
+    The inventory is read in one round trip and every package is looked up
+    in it.  If the inventory can't be read, the packages are queried one by
+    one instead.
+
+    :param client: ssh client
+    :param node: node being checked
+    :param packages: list of ('package name', 'minimum version') tuples
+    :param os_cache: optional cache.FileCache of detected OS flavors
+    :return: list of dictionaries, None if the OS flavor is unknown
+    """
+    inventory = get_inventory(client, node, os_cache)
+    checker = inventory['checker']
+    if checker is None:
+        return None
+
+    if inventory['system'] and inventory['pip'] is not None:
+        return [inventory_check(inventory, node, pkg_info)
+                for pkg_info in packages]
+
+    logger.info("No package inventory for node %s, checking packages one "
+                "at a time" % node)
+    client = prefetch(client, checker, packages)
+    checked = []
+    for pkg_info in packages:
+        check = checker(client, node, pkg_info)
+        if check['installed'] == 'unknown':
+            check = pip_check(client, node, pkg_info)
+        checked.append(check)
+    return checked
+
+
+@profiler.phase('package_inventory')
+def get_inventory(client, node, os_cache=None):
+    """Read the OS flavor and the installed packages of a node
+
+    The OS flavor is detected once per client.  With an os_cache, flavors
+    detected by earlier runs are reused as long as the node's machine-id
+    has not changed, so detection is skipped completely.
+
+    :param client: ssh client
+    :param node: node being checked
+    :param os_cache: optional cache.FileCache of detected OS flavors
+    :return: dictionary with the check type for the OS flavor, and indexes
+    of the 'system' and 'pip' packages (None if they could not be read)
+    """
+    flavor = client.facts.get('os_flavor')
+    cached = None
+    if flavor is None and os_cache is not None:
+        cached = os_cache.get(client.host_name)
+        if cached:
+            flavor = cached['os_flavor']
+
+    commands = [MACHINE_ID_QUERY, PIP_INVENTORY]
+    commands += inventory_commands(flavor)
+    responses = run_commands(client, commands)
+
+    machine_id = responses[MACHINE_ID_QUERY].strip()
+    if cached and cached['machine_id'] != machine_id:
+        logger.info("Machine id of node %s changed, detecting operating "
+                    "system again" % node)
+        flavor = None
+        responses.update(run_commands(client, inventory_commands(flavor)))
+
+    if flavor is None:
+        flavor = detect_os_flavor(responses[RELEASE_QUERY], node)
+        if flavor is not None and os_cache is not None:
+            os_cache.set(client.host_name, {'machine_id': machine_id,
+                                            'os_flavor': flavor})
+    if flavor is not None:
+        client.facts['os_flavor'] = flavor
+
+    checker = CHECK_TYPES.get(flavor)
+    inventory = {
+        'checker': checker,
+        'system': None,
+        'pip': parse_pip_inventory(responses[PIP_INVENTORY]),
+    }
+    if checker is dpkg_check:
+        inventory['system'] = parse_inventory(responses[DPKG_INVENTORY],
+                                              DPKG_INVENTORY_LINE)
+    elif checker is not None:
+        inventory['system'] = parse_inventory(responses[RPM_INVENTORY],
+                                              RPM_INVENTORY_LINE)
+    return inventory
+
+
+def inventory_commands(flavor):
+    """Commands that list the system packages for an OS flavor
+
+    :param flavor: OS flavor, None to detect it and list both kinds
+    :return: list of commands
+    """
+    if flavor is None:
+        return [RELEASE_QUERY, DPKG_INVENTORY, RPM_INVENTORY]
+    elif flavor == 'debian':
+        return [DPKG_INVENTORY]
+    return [RPM_INVENTORY]
+
+
+def run_commands(client, commands):
+    """Run commands in one round trip
+
+    :return: dictionary of command to stdout
+    """
+    return dict((result['command'], result['stdout'] or '')
+                for result in client.execute_many(commands))
+
+
+def parse_inventory(response, pattern):
+    """Index 'name version' package lines by normalized package name
+
+    :return: dictionary, None if no package lines were found
+    """
+    index = {}
+    for line in response.splitlines():
+        match = pattern.match(line.strip())
+        if match:
+            index[normalize_name(match.group(1))] = match.group(2)
+    return index or None
+
+
+def parse_pip_inventory(response):
+    """Index pip packages listed in JSON, columns or legacy format
+
+    :return: dictionary, None if the listing was not recognized
+    """
+    try:
+        return dict((normalize_name(pkg['name']), pkg['version'])
+                    for pkg in json.loads(response))
+    except (ValueError, TypeError, KeyError):
+        return parse_inventory(response, PIP_INVENTORY_LINE)
+
+
+def normalize_name(name):
+    return name.lower().replace('_', '-')
+
+
+def inventory_check(inventory, node, pkg_info):
+    """Look a package up in a node's package inventory
+
+    :param inventory: dictionary returned by get_inventory
+    :param node: node being checked
+    :param pkg_info: (name, version)
+    :return: dictionary
+    """
+    pkg = {
+        'node': node,
+        'name': pkg_info[0],
+        'installed': 'fail',
+        'version': 'N/A',
+    }
+
+    names = [x.strip() for x in pkg_info[0].split('||')]
+    for index in (inventory['system'], inventory['pip']):
+        for name in names:
+            version = index.get(normalize_name(name))
+            if version is None:
+                continue
+            pkg['installed'] = 'pass'
+            pkg['name'] = name
+            if pkg_info[1]:
+                pkg['name'] += ' (>=' + pkg_info[1] + ')'
+                pkg['version'] = version_check(version,
+                                               INVENTORY_VERSION,
+                                               pkg_info[1])
+            return pkg
+    return pkg
 
 
 def dpkg_check(client, node, pkg_info):
@@ -95,8 +290,7 @@ def dpkg_check(client, node, pkg_info):
         for name in names:
             logger.info("Checking for software package '%s' on node %s using "
                         "dpkg-query" % (name, node))
-            response = client.execute("dpkg-query -W -f='${Status}"
-                                      "${Version}' " + name)
+            response = client.execute(DPKG_QUERY + name)
             if 'install ok installed' in response:
                 pkg['installed'] = 'pass'
                 pkg['name'] = name + ' (>=' + pkg_info[1] + ')'
@@ -137,8 +331,7 @@ def yum_check(client, node, pkg_info):
         for name in names:
             logger.info("Checking for software package '%s' on node %s using "
                         "yum" % (name, node))
-            response = client.execute("yum list installed " +
-                                      name)
+            response = client.execute(YUM_QUERY + name)
             if 'Available Packages' in response:
                 pkg['installed'] = 'fail'
                 pkg['name'] = name + ' (>=' + pkg_info[1] + ')'
@@ -183,8 +376,7 @@ def zypper_check(client, node, pkg_info):
         for name in names:
             logger.info("Checking for software package '%s' on node %s using "
                         "zypper" % (name, node))
-            response = client.execute("zypper info " +
-                                      name)
+            response = client.execute(ZYPPER_QUERY + name)
             if 'Installed: No' in response:
                 pkg['installed'] = 'fail'
                 pkg['name'] = name
@@ -228,7 +420,7 @@ def pip_check(client, node, pkg_info):
         for name in names:
             logger.info("Checking for software package '%s' on node %s using "
                         "pip" % (name, node))
-            response = client.execute("pip list | grep " + name)
+            response = client.execute(PIP_QUERY + name)
             if response and re.match(name, response):
                 pkg['installed'] = 'pass'
                 pkg['name'] = name + ' (>=' + pkg_info[1] + ')'
@@ -249,6 +441,51 @@ def pip_check(client, node, pkg_info):
     return pkg
 
 
+class PrefetchedClient(object):
+    """Answers execute() from the results of a single batched execute_many
+
+    Commands that were not prefetched are passed through to the ssh client.
+    """
+
+    def __init__(self, client, commands):
+        self.client = client
+        self.responses = {}
+        for result in client.execute_many(commands):
+            self.responses[result['command']] = \
+                (result['stdout'] or '') + result['stderr']
+
+    def execute(self, command):
+        if command in self.responses:
+            return self.responses[command]
+        return self.client.execute(command)
+
+
+def prefetch(client, checker, packages):
+    """Run every query the checks for packages need in one round trip
+
+    :param client: ssh client
+    :param checker: check function of the node's OS flavor, from
+    get_inventory
+    :param packages: list of ('package name', 'minimum version') tuples
+    :return: client that answers those queries without another round trip
+    """
+    queries = {
+        dpkg_check: DPKG_QUERY,
+        yum_check: YUM_QUERY,
+        zypper_check: ZYPPER_QUERY,
+    }
+    commands = []
+    for pkg_info in packages:
+        for name in [x.strip() for x in pkg_info[0].split('||')]:
+            commands.append(queries[checker] + name)
+            commands.append(PIP_QUERY + name)
+    try:
+        return PrefetchedClient(client, commands)
+    except Exception as e:
+        logger.warning("%s -- Unable to prefetch package queries" % e)
+        return client
+
+
 def version_check(response, pattern, min_v):
     version = pattern.search(response)
     if version is None:
@@ -259,24 +496,25 @@ def version_check(response, pattern, min_v):
         return 'fail (' + version.group(1) + ')'
 
 
-def get_check_type(client, node):
-    """Checks the Linux OS flavor and returns the correct check type
+CHECK_TYPES = {
+    "debian": dpkg_check,
+    "fedora": yum_check,
+    "suse": zypper_check,
+}
 
-    :param client: ssh client
+
+def detect_os_flavor(response, node):
+    """Returns the OS flavor for the output of RELEASE_QUERY
+
+    :param response: ID_LIKE line(s) of /etc/*release
     :param node: node being checked
-    :return: function that expects parameters (client, node, pkg_info)
+    :return: a key of CHECK_TYPES, None if the flavor is unknown
     """
-    os_names = {
-        "debian": dpkg_check,
-        "fedora": yum_check,
-        "suse": zypper_check,
-    }
-    check_type = None
-    response = client.execute('cat /etc/*release | grep ^ID_LIKE')
-    for os, check in list(os_names.items()):
+    flavor = None
+    for os in CHECK_TYPES:
         if re.compile(os).search(response):
             logger.info("Detected %s operating system on node %s" % (os, node))
-            check_type = check
-    if check_type is None:
+            flavor = os
+    if flavor is None:
         logger.error("Unable to determine operating system on %s" % node)
-    return check_type
+    return flavor
@@ -0,0 +1,171 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Records how long each phase of a check takes, and how often it runs, per
+node.  Recording is off unless a command is run with -profile, in which case
+timed() blocks around SSH, package and WS API work add up their durations.
+"""
+
+import collections
+import contextlib
+import functools
+import sys
+import threading
+import time
+
+# the Profiler of the running command, None when profiling is off
+ACTIVE = None
+# node being checked by the current thread
+current = threading.local()
+
+
+class Profiler(object):
+
+    def __init__(self):
+        """Call counts and total seconds per (node, phase)
+        """
+        self.lock = threading.Lock()
+        self.stats = collections.OrderedDict()
+
+    def record(self, node, phase, seconds, calls=1):
+        with self.lock:
+            stat = self.stats.setdefault((node, phase), [0, 0.0])
+            stat[0] += calls
+            stat[1] += seconds
+
+    def merge(self, stats):
+        """Add stats from export(), e.g. from a fleet worker process
+        """
+        for node, phase, calls, seconds in stats:
+            self.record(node, phase, seconds, calls)
+
+    def export(self):
+        """
+        :return: list of (node, phase, calls, seconds)
+        """
+        with self.lock:
+            return [(node, phase, stat[0], stat[1])
+                    for (node, phase), stat in self.stats.items()]
+
+    def reset(self):
+        with self.lock:
+            self.stats = collections.OrderedDict()
+
+    def node_times(self, node):
+        """Seconds spent per phase for a node
+
+        :return: dictionary of phase to seconds
+        """
+        return dict((phase, round(seconds, 3))
+                    for stat_node, phase, calls, seconds in self.export()
+                    if stat_node == node)
+
+    def format_table(self):
+        """Timing table of every node and phase, slowest phases first
+        """
+        rows = sorted(self.export(), key=lambda row: (row[0], -row[3]))
+        header = ('Node', 'Phase', 'Calls', 'Seconds')
+        lines = [(node, phase, str(calls), '%.3f' % seconds)
+                 for node, phase, calls, seconds in rows]
+        widths = [max([len(header[i])] + [len(line[i]) for line in lines])
+                  for i in range(len(header))]
+        layout = '  '.join('%%-%ds' % width for width in widths)
+        table = [layout % header, layout % tuple('-' * w for w in widths)]
+        table += [layout % line for line in lines]
+        return '\n'.join(table) + '\n'
+
+
+def start():
+    """Turn recording on for the rest of the process
+
+    :return: the active Profiler
+    """
+    global ACTIVE
+    if ACTIVE is None:
+        ACTIVE = Profiler()
+    return ACTIVE
+
+
+def stop():
+    global ACTIVE
+    ACTIVE = None
+
+
+@contextlib.contextmanager
+def on_node(node):
+    """Attribute work done by this thread to node
+    """
+    previous = getattr(current, 'node', None)
+    current.node = node
+    try:
+        yield
+    finally:
+        current.node = previous
+
+
+@contextlib.contextmanager
+def timed(phase, node=None):
+    """Time the enclosed block as a call of phase for node
+
+    :param node: defaults to the node set with on_node() for this thread
+    """
+    profile = ACTIVE
+    if profile is None:
+        yield
+        return
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        profile.record(node or getattr(current, 'node', None) or 'unknown',
+                       phase, time.time() - start_time)
+
+
+def phase(name):
+    """Decorator timing every call of a function as phase name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report(columns, rows, add_column=True, stream=None):
+    """Finish a profiled command: add each node's phase times to its row as
+    a Profile column and write the timing table after the last row
+
+    :param columns: column names of the command
+    :param rows: iterable of row tuples, starting with the node name
+    :param add_column: False to only write the table
+    :param stream: where the table is written, defaults to stderr
+    :return: (columns, rows)
+    """
+    profile = ACTIVE or start()
+    if add_column:
+        columns = tuple(columns) + ('Profile',)
+
+    def profiled():
+        try:
+            for row in rows:
+                if add_column:
+                    row = tuple(row) + (profile.node_times(row[0]),)
+                yield row
+            (stream or sys.stderr).write(profile.format_table())
+        finally:
+            stop()
+    return columns, profiled()
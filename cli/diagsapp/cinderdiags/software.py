@@ -16,6 +16,8 @@ import argparse
 import logging
 
 from cinderdiags import conf_reader
+from cinderdiags import formatters
+from cinderdiags import profiler
 from cliff.lister import Lister
 
 
@@ -69,6 +71,26 @@ class CheckSoftware(Lister):
                             dest='data',
                             help='json structure contain cli.conf data')
 
+        parser.add_argument('-parallel',
+                            dest='parallel',
+                            type=int,
+                            metavar='N',
+                            help='number of nodes to check at the same time '
+                                 '(defaults to max_workers in cli.conf)')
+        parser.add_argument('-processes',
+                            dest='processes',
+                            type=int,
+                            metavar='N',
+                            help='number of worker processes to spread the '
+                                 'nodes across (defaults to processes in '
+                                 'cli.conf)')
+        parser.add_argument('-profile',
+                            dest='profile',
+                            action='store_true',
+                            help='time each phase of the check per node, '
+                                 'add a Profile column and write a timing '
+                                 'table to stderr')
+
         args, unknown = parser.parse_known_args()
         if args.name:
             parser.add_argument('--package-min-version',
@@ -77,22 +99,32 @@ class CheckSoftware(Lister):
         return parser
 
     def take_action(self, parsed_args):
+        if parsed_args.profile:
+            profiler.start()
         reader = conf_reader.Reader(parsed_args.test,
                                     parsed_args.conf,
-                                    parsed_args.data)
-        result = reader.software_check(parsed_args.name,
-                                       parsed_args.serv,
-                                       parsed_args.version,
-                                       parsed_args.packages)
+                                    parsed_args.data,
+                                    max_workers=parsed_args.parallel,
+                                    processes=parsed_args.processes)
+        if formatters.is_streaming(parsed_args):
+            result = reader.iter_software_check(parsed_args.name,
+                                                parsed_args.serv,
+                                                parsed_args.version,
+                                                parsed_args.packages,
+                                                ordered=False)
+        else:
+            result = reader.software_check(parsed_args.name,
+                                           parsed_args.serv,
+                                           parsed_args.version,
+                                           parsed_args.packages)
 
         columns = ('Node', 'Software', 'Installed', 'Version')
-        data = []
-        for pkg in result:
-            data.append((
-                pkg['node'],
-                pkg['name'],
-                pkg['installed'],
-                pkg['version']),
-            )
+        data = ((pkg['node'],
+                 pkg['name'],
+                 pkg['installed'],
+                 pkg['version'])
+                for pkg in result)
 
+        if parsed_args.profile:
+            return profiler.report(columns, data)
         return (columns, data)
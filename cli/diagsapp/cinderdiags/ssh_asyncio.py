@@ -0,0 +1,230 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+SSH transport built on asyncssh, selected with ssh_transport=asyncio in
+cli.conf.
+
+All connections of the process share one asyncio event loop running in a
+background thread instead of holding a paramiko thread each, so many more
+nodes can be connected at once.  Client offers the same methods as
+ssh_client.Client and blocks the calling thread until the loop is done, for
+at most the client's timeout.  A forked process starts a loop of its own,
+the loop thread of its parent does not run in it.
+
+Requires Python 3 and asyncssh: sudo pip install asyncssh
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+
+from cinderdiags import constant
+from cinderdiags import profiler
+
+logger = logging.getLogger(__name__)
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+loop = None
+loop_lock = threading.Lock()
+# process the loop was started in
+loop_pid = None
+
+
+def available():
+    return asyncssh is not None
+
+
+def get_loop():
+    """Event loop shared by every connection, started on first use
+    """
+    global loop, loop_pid
+    with loop_lock:
+        if loop is None or loop.is_closed() or loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            loop_pid = os.getpid()
+            thread = threading.Thread(target=loop.run_forever,
+                                      name='cinderdiags-ssh-loop')
+            thread.daemon = True
+            thread.start()
+        return loop
+
+
+def reset_loop():
+    """Forget the event loop of the parent process after a fork, its thread
+    is not running in the child
+    """
+    global loop, loop_lock, loop_pid
+    loop = None
+    loop_lock = threading.Lock()
+    loop_pid = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_loop)
+
+
+def run(coroutine, timeout=constant.SSH_CONNECT_TIMEOUT):
+    """Run a coroutine on the shared event loop and wait for its result
+
+    :param timeout: seconds to wait before the coroutine is cancelled
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+class Client(object):
+
+    def __init__(self, hostName, sshUserName, sshPassword, timeout=20):
+        """ Connect and perform action to remote machine using SSH
+
+        :param timeout: seconds to wait for the connection and each command
+        """
+        if asyncssh is None:
+            raise Exception("SSH Error: asyncssh package not found "
+                            "(pip install asyncssh)")
+        self.host_name = hostName
+        self.user_name = sshUserName
+        # facts about the node, remembered for as long as the client lives
+        self.facts = {}
+        self.timeout = timeout
+        self.closed = False
+        self.loop = get_loop()
+        try:
+            run(self.connect(sshPassword), timeout)
+        except asyncssh.PermissionDenied:
+            raise Exception("SSH Error: Invalid SSH credentials")
+        except (OSError, asyncssh.Error, asyncio.TimeoutError,
+                concurrent.futures.TimeoutError):
+            raise Exception("SSH Error - Unable to connect to host [%s]" %
+                            hostName)
+
+    @profiler.phase('ssh_get_file')
+    def get_file(self, fromLocation, toLocation):
+        """ perform copy action to remote machine using SSH
+        """
+        try:
+            run(self.sftp_get(fromLocation, toLocation), self.timeout)
+            return toLocation
+        except (OSError, asyncssh.Error, concurrent.futures.TimeoutError):
+            raise Exception("SSH Error: Unable to copy %s" % fromLocation)
+
+    @profiler.phase('ssh_read_file')
+    def read_file(self, fromLocation):
+        """ read a remote file into memory over the SSH connection
+
+        :return: contents of the file as text
+        """
+        try:
+            data = run(self.sftp_read(fromLocation), self.timeout)
+            return data.decode('utf-8', 'replace')
+        except (OSError, asyncssh.Error, concurrent.futures.TimeoutError):
+            raise Exception("SSH Error: Unable to read %s" % fromLocation)
+
+    def is_active(self):
+        """ check that the SSH connection is still open
+        """
+        is_closed = getattr(self.conn, 'is_closed', None)
+        if callable(is_closed) and is_closed():
+            return False
+        return not self.closed
+
+    def disconnect(self):
+        """ close the SSH connection
+        """
+        self.closed = True
+        try:
+            # asyncssh connections may only be used from the loop's thread
+            self.loop.call_soon_threadsafe(self.conn.close)
+            run(self.conn.wait_closed(), self.timeout)
+        except Exception as e:
+            logger.info("SSH connection to %s not closed cleanly: %s" %
+                        (self.host_name, e))
+
+    @profiler.phase('ssh_execute')
+    def execute(self, command):
+        try:
+            result = run(self.run_one(command), self.timeout)
+        except (OSError, asyncssh.Error, concurrent.futures.TimeoutError):
+            raise Exception("SSH Error: Unable to execute remote command "
+                            "(%s)" % command)
+        return (result.stdout or '') + (result.stderr or '')
+
+    @profiler.phase('ssh_execute_many')
+    def execute_many(self, commands, timeout=20):
+        """ run a list of commands at the same time, each on its own channel
+        of the connection
+
+        :param commands: list of command strings
+        :return: list of dictionaries with the command, stdout, stderr and
+        exit_code of each command, in the same order as commands
+        """
+        if not commands:
+            return []
+        try:
+            results = run(self.run_all(commands), timeout)
+        except (OSError, asyncssh.Error, concurrent.futures.TimeoutError):
+            raise Exception("SSH Error: Unable to execute remote "
+                            "commands (%s)" % '; '.join(commands))
+        return [{'command': command,
+                 'stdout': result.stdout or '',
+                 'stderr': result.stderr or '',
+                 'exit_code': result.exit_status}
+                for command, result in zip(commands, results)]
+
+    def get_host_name(self):
+        # not sure why, but sometimes this comes back with a "\n", so strip
+        host_name = self.execute('hostname').rstrip()
+        return host_name
+
+    async def connect(self, password):
+        # like the paramiko client, host keys are not verified and only the
+        # password is used to log in
+        self.conn = await asyncssh.connect(self.host_name,
+                                           username=self.user_name,
+                                           password=password,
+                                           known_hosts=None,
+                                           client_keys=None)
+        # channels open at the same time on this connection, shared by
+        # every thread using it; created here to belong to the loop
+        self.channels = asyncio.Semaphore(constant.SSH_MAX_CHANNELS)
+
+    async def run_one(self, command):
+        async with self.channels:
+            return await self.conn.run(command, check=False)
+
+    async def run_all(self, commands):
+        return await asyncio.gather(*[self.run_one(command)
+                                      for command in commands])
+
+    async def sftp_get(self, fromLocation, toLocation):
+        async with self.channels:
+            async with self.conn.start_sftp_client() as sftp:
+                await sftp.get(fromLocation, toLocation)
+
+    async def sftp_read(self, fromLocation):
+        async with self.channels:
+            async with self.conn.start_sftp_client() as sftp:
+                async with sftp.open(fromLocation, 'rb') as remote_file:
+                    return await remote_file.read()
@@ -12,18 +12,35 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import io
 import logging
 import paramiko
+import re
 import socket
+import threading
+import uuid
+
+from cinderdiags import constant
+from cinderdiags import profiler
 
 logger = logging.getLogger(__name__)
 
 
 class Client(object):
 
-    def __init__(self, hostName, sshUserName, sshPassword):
+    def __init__(self, hostName, sshUserName, sshPassword, timeout=20):
         """ Connect and perform action to remote machine using SSH
+
+        :param timeout: seconds to wait for the connection, SSH banner and
+        authentication each
         """
+        self.host_name = hostName
+        self.user_name = sshUserName
+        # facts about the node, remembered for as long as the client lives
+        self.facts = {}
+        # threads sharing the client wait for a free channel instead of
+        # going past the MaxSessions limit of sshd
+        self.channels = threading.BoundedSemaphore(constant.SSH_MAX_CHANNELS)
         try:
             # Connect to remote host
             self.client = paramiko.SSHClient()
@@ -33,7 +50,9 @@ class Client(object):
                                 username=sshUserName,
                                 password=sshPassword,
                                 look_for_keys=False,
-                                timeout=20)
+                                timeout=timeout,
+                                banner_timeout=timeout,
+                                auth_timeout=timeout)
 
         except socket.error:
             raise Exception("SSH Error - Unable to connect to host [%s]" %
@@ -46,6 +65,7 @@ class Client(object):
             logger.warning("SSH Error: %s" % (ex.message))
             raise Exception("SSH Error: Invalid SSH credentials")
 
+    @profiler.phase('ssh_get_file')
     def get_file(self, fromLocation, toLocation):
         """ perform copy action to remote machine using SSH
         """
@@ -53,34 +73,128 @@ class Client(object):
                 self.client.get_transport().is_authenticated():
             try:
                 # Setup sftp connection and transmit this script
-                sftp = self.client.open_sftp()
-                sftp.get(fromLocation, toLocation)
-                sftp.close()
+                with self.channels:
+                    sftp = self.client.open_sftp()
+                    sftp.get(fromLocation, toLocation)
+                    sftp.close()
                 return toLocation
 
             except (IOError, paramiko.ssh_exception.SSHException):
                 raise Exception("SSH Error: Unable to copy %s" % fromLocation)
 
+    @profiler.phase('ssh_read_file')
+    def read_file(self, fromLocation):
+        """ read a remote file into memory over the SSH connection
+
+        :return: contents of the file as text
+        """
+        if self.client.get_transport() and \
+                self.client.get_transport().is_authenticated():
+            try:
+                buf = io.BytesIO()
+                with self.channels:
+                    sftp = self.client.open_sftp()
+                    try:
+                        sftp.getfo(fromLocation, buf)
+                    finally:
+                        sftp.close()
+                return buf.getvalue().decode('utf-8', 'replace')
+
+            except (IOError, paramiko.ssh_exception.SSHException):
+                raise Exception("SSH Error: Unable to read %s" % fromLocation)
+
+    def is_active(self):
+        """ check that the SSH transport is still open and authenticated
+        """
+        transport = self.client.get_transport()
+        return bool(transport and transport.is_active() and
+                    transport.is_authenticated())
+
     def disconnect(self):
         """ perform copy action to remote machine using SSH
         """
         self.client.close()
 
+    @profiler.phase('ssh_execute')
     def execute(self, command):
         # Run the transmitted script remotely without args and show its output.
         # SSHClient.exec_command() returns the tuple (stdin, stdout, stderr)
         if self.client.get_transport() and \
                 self.client.get_transport().is_authenticated():
             try:
-                resp = self.client.exec_command(command, timeout=20)
-                stdout = resp[1].readlines()
-                stderr = resp[2].readlines()
+                with self.channels:
+                    resp = self.client.exec_command(command, timeout=20)
+                    stdout = resp[1].readlines()
+                    stderr = resp[2].readlines()
                 return ''.join(stdout) + ''.join(stderr)
 
             except (paramiko.ssh_exception.SSHException, socket.timeout):
                 raise Exception("SSH Error: Unable to execute remote command "
                                 "(%s)" % command)
 
+    @profiler.phase('ssh_execute_many')
+    def execute_many(self, commands, timeout=20):
+        """ run a list of commands over a single exec channel
+
+        The commands run one after the other in the same remote shell.  Each
+        command's output is framed by marker lines so that stdout, stderr and
+        the exit code of every command can be told apart.  If the markers do
+        not come back (e.g. the remote shell is not POSIX), every command is
+        run on its own with execute() instead.
+
+        :param commands: list of command strings
+        :return: list of dictionaries with the command, stdout, stderr and
+        exit_code of each command, in the same order as commands
+        """
+        if not commands:
+            return []
+        marker = 'CINDERDIAGS-%s' % uuid.uuid4().hex
+        script = []
+        for index, command in enumerate(commands):
+            script.append("printf '\\n%s %d\\n'; " % (marker, index) +
+                          "printf '\\n%s %d\\n' >&2" % (marker, index))
+            script.append("{ %s\n}" % command)
+            script.append("printf '\\n%s %d %%d\\n' $?; " % (marker, index) +
+                          "printf '\\n%s %d\\n' >&2" % (marker, index))
+        script = '\n'.join(script)
+
+        if self.client.get_transport() and \
+                self.client.get_transport().is_authenticated():
+            try:
+                with self.channels:
+                    resp = self.client.exec_command(script, timeout=timeout)
+                    stdout = ''.join(resp[1].readlines())
+                    stderr = ''.join(resp[2].readlines())
+            except (paramiko.ssh_exception.SSHException, socket.timeout):
+                raise Exception("SSH Error: Unable to execute remote "
+                                "commands (%s)" % '; '.join(commands))
+
+            marker = re.escape(marker)
+            out = re.compile('\n%s (\\d+)\n(.*?)\n%s \\1 (\\d+)\n' %
+                             (marker, marker), re.DOTALL)
+            err = re.compile('\n%s (\\d+)\n(.*?)\n%s \\1\n' %
+                             (marker, marker), re.DOTALL)
+            results = [{'command': command,
+                        'stdout': '',
+                        'stderr': '',
+                        'exit_code': None} for command in commands]
+            for match in out.finditer(stdout):
+                results[int(match.group(1))]['stdout'] = match.group(2)
+                results[int(match.group(1))]['exit_code'] = \
+                    int(match.group(3))
+            for match in err.finditer(stderr):
+                results[int(match.group(1))]['stderr'] = match.group(2)
+
+            if all(result['exit_code'] is not None for result in results):
+                return results
+
+        logger.info("Batched command output not recognized, running %s "
+                    "commands one at a time" % len(commands))
+        return [{'command': command,
+                 'stdout': self.execute(command),
+                 'stderr': '',
+                 'exit_code': None} for command in commands]
+
     def get_host_name(self):
         # not sure why, but sometimes this comes back with a "\n", so strip
         host_name = self.execute('hostname').rstrip()
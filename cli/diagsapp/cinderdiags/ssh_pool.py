@@ -0,0 +1,146 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Keeps SSH connections open between commands so that they can be reused
+instead of paying for key exchange and authentication again.
+
+Connections are pooled per (host_ip, ssh_user).  The pool lives as long as
+the cinderdiags process, so back-to-back commands run from the interactive
+shell (cinderdiags with no arguments) share live connections.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from cinderdiags import constant
+from cinderdiags import ssh_client
+
+logger = logging.getLogger(__name__)
+
+
+class Pool(object):
+
+    def __init__(self, idle_timeout=constant.SSH_POOL_IDLE_TIMEOUT,
+                 transport=constant.SSH_TRANSPORT):
+        """Pool of idle SSH client connections
+
+        :param idle_timeout: seconds an unused connection is kept open,
+        0 disables pooling
+        :param transport: 'paramiko' or 'asyncio', used for new connections
+        """
+        self.idle_timeout = idle_timeout
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, host_ip, ssh_user, ssh_password, timeout=20):
+        """Get a healthy pooled connection or open a new one
+
+        :return: ssh client
+        """
+        key = (host_ip, ssh_user)
+        digest = self.digest(ssh_password)
+        self.evict_idle()
+        while True:
+            with self.lock:
+                entries = self.idle.get(key, [])
+                if not entries:
+                    break
+                client, client_digest, released = entries.pop()
+            if client_digest == digest and client.is_active():
+                logger.info("Reusing SSH connection to %s@%s" %
+                            (ssh_user, host_ip))
+                return client
+            client.disconnect()
+
+        client = self.client_class()(host_ip, ssh_user, ssh_password,
+                                     timeout)
+        client.password_digest = digest
+        return client
+
+    def client_class(self):
+        """SSH client class of the configured transport
+        """
+        if self.transport == 'asyncio':
+            # imported here, the module needs Python 3
+            from cinderdiags import ssh_asyncio
+            if ssh_asyncio.available():
+                return ssh_asyncio.Client
+            logger.error('asyncssh package not found (pip install asyncssh), '
+                         'using paramiko for SSH connections')
+        elif self.transport != 'paramiko':
+            logger.error("Unknown ssh_transport '%s', using paramiko for SSH "
+                         "connections" % self.transport)
+        return ssh_client.Client
+
+    def release(self, client):
+        """Return a connection to the pool, or close it if pooling is off
+        """
+        digest = getattr(client, 'password_digest', None)
+        if self.idle_timeout <= 0 or digest is None:
+            client.disconnect()
+            return
+        key = (client.host_name, client.user_name)
+        with self.lock:
+            self.idle.setdefault(key, []).append((client, digest,
+                                                  time.time()))
+        self.evict_idle()
+
+    def evict_idle(self):
+        """Close connections that have been idle longer than idle_timeout
+        """
+        expired = []
+        now = time.time()
+        with self.lock:
+            for key in list(self.idle):
+                keep = []
+                for entry in self.idle[key]:
+                    if now - entry[2] > self.idle_timeout:
+                        expired.append(entry[0])
+                    else:
+                        keep.append(entry)
+                if keep:
+                    self.idle[key] = keep
+                else:
+                    del self.idle[key]
+        for client in expired:
+            logger.info("Closing idle SSH connection to %s@%s" %
+                        (client.user_name, client.host_name))
+            client.disconnect()
+
+    def close(self):
+        """Close every pooled connection
+        """
+        with self.lock:
+            entries = [entry for key in self.idle for entry in self.idle[key]]
+            self.idle = {}
+        for entry in entries:
+            entry[0].disconnect()
+
+    def forget(self):
+        """Drop every pooled connection without closing it, for a forked
+        process whose pooled connections belong to its parent
+        """
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    @staticmethod
+    def digest(ssh_password):
+        return hashlib.sha256(str(ssh_password).encode('utf-8')).hexdigest()
+
+
+POOL = Pool()
@@ -0,0 +1,121 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Index of the volume paths found by volume-paths-check across all Nova nodes.
+
+Every volume-paths-check run replaces the entries of the nodes it checked in
+a file in cache_dir.  volume-lookup and host-paths answer from that file
+instead of connecting to the nodes again.
+"""
+
+import logging
+import time
+
+from cinderdiags import cache
+
+logger = logging.getLogger(__name__)
+
+
+class VolumeIndex(object):
+
+    def __init__(self, directory=None):
+        """Volume paths of each node, indexed by volume, path, host and
+        protocol
+
+        :param directory: cache directory, defaults to constant.CACHE_DIRECTORY
+        """
+        self.store = cache.FileCache('volume_index', directory)
+        self.records = None
+        self.by_volume = {}
+        self.by_path = {}
+        self.by_host = {}
+        self.by_protocol = {}
+
+    def update(self, nodes):
+        """Replace the paths stored for nodes with one write
+
+        :param nodes: dictionary of node to dictionary with the node's
+        'host_ip' and its 'paths' as found by volume-paths-check
+        """
+        self.store.set_many(nodes)
+        self.records = None
+
+    def load(self):
+        """Read the stored paths and index them, once per VolumeIndex
+        """
+        if self.records is not None:
+            return
+        self.records = []
+        self.by_volume = {}
+        self.by_path = {}
+        self.by_host = {}
+        self.by_protocol = {}
+        for node, entry, stored in sorted(self.store.items()):
+            for path in entry['paths']:
+                record = {'node': node,
+                          'host_ip': entry.get('host_ip'),
+                          'path': path['path'],
+                          'vol_name': path.get('vol_name'),
+                          'protocol': path.get('protocol'),
+                          'device': path.get('device'),
+                          'multipath': path.get('multipath'),
+                          'updated': time.strftime('%Y-%m-%d %H:%M:%S',
+                                                   time.localtime(stored))}
+                self.records.append(record)
+                if record['vol_name']:
+                    self.by_volume.setdefault(record['vol_name'],
+                                              []).append(record)
+                self.by_path.setdefault(record['path'], []).append(record)
+                for host in set([node.lower(),
+                                 (record['host_ip'] or node).lower()]):
+                    self.by_host.setdefault(host, []).append(record)
+                self.by_protocol.setdefault(record['protocol'],
+                                            []).append(record)
+        logger.info("Loaded %s volume paths from %s" %
+                    (len(self.records), self.store.path))
+
+    def volume(self, volume):
+        """Paths of a volume, by the name or ID given to volume-paths-check
+
+        :return: list of dictionaries
+        """
+        self.load()
+        return list(self.by_volume.get(volume, []))
+
+    def path(self, path):
+        """Nodes a device path was found on
+
+        :return: list of dictionaries
+        """
+        self.load()
+        return list(self.by_path.get(path, []))
+
+    def host(self, host, protocol=None):
+        """Paths of a node, by node name or host IP
+
+        :param protocol: only paths of 'ISCSI' or 'FIBRE_CHANNEL'
+        :return: list of dictionaries
+        """
+        self.load()
+        return [record for record in self.by_host.get(host.lower(), [])
+                if protocol is None or record['protocol'] == protocol]
+
+    def protocol(self, protocol):
+        """Paths of a protocol on every node
+
+        :return: list of dictionaries
+        """
+        self.load()
+        return list(self.by_protocol.get(protocol, []))
@@ -0,0 +1,86 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import logging
+
+from cinderdiags import conf_reader
+from cliff.lister import Lister
+
+
+class LookupVolume(Lister):
+    """find where a volume is attached, from the volume index of the last
+    volume-paths-check runs
+
+    output data:
+        Volume          volume name or ID as given to -attached-volumes
+        Node            nova node the path was found on
+        Host IP         host_ip of the node in cli.conf
+        Protocol        ISCSI or FIBRE_CHANNEL
+        Path            volume path
+        Multipath       multipath map of the path (-discovery sysfs only)
+        Updated         time the node was last checked
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(LookupVolume, self).get_parser(prog_name)
+        parser.formatter_class = argparse.RawTextHelpFormatter
+        parser.add_argument('volume',
+                            metavar='VOLUME',
+                            help='volume name or ID, or a device path under '
+                                 '/dev')
+
+        parser.add_argument('-test',
+                            dest='test',
+                            action='store_true',
+                            help=argparse.SUPPRESS)
+
+        parser.add_argument('-conf-file',
+                            dest='conf',
+                            help='location of cli.conf (defaults to '
+                                 '/etc/cinderdiags/cli.conf)')
+
+        parser.add_argument('-conf-data',
+                            dest='data',
+                            help='json structure contain cli.conf data')
+
+        return parser
+
+    def take_action(self, parsed_args):
+        reader = conf_reader.Reader(parsed_args.test,
+                                    parsed_args.conf,
+                                    parsed_args.data)
+        if parsed_args.volume.startswith('/dev/'):
+            result = reader.volume_index.path(parsed_args.volume)
+        else:
+            result = reader.volume_index.volume(parsed_args.volume)
+        if len(result) < 1:
+            raise ValueError("%s not found in the volume index, run "
+                             "volume-paths-check -attached-volumes first" %
+                             parsed_args.volume)
+
+        columns = ('Volume', 'Node', 'Host IP', 'Protocol', 'Path',
+                   'Multipath', 'Updated')
+        data = ((path['vol_name'],
+                 path['node'],
+                 path['host_ip'],
+                 path['protocol'],
+                 path['path'],
+                 path['multipath'],
+                 path['updated'])
+                for path in result)
+
+        return (columns, data)
@@ -16,6 +16,9 @@ import argparse
 import logging
 
 from cinderdiags import conf_reader
+from cinderdiags import constant
+from cinderdiags import formatters
+from cinderdiags import profiler
 from cliff.lister import Lister
 
 
@@ -46,27 +49,69 @@ class CheckPaths(Lister):
                             dest='vars',
                             help='json structure containing OpenStack '
                                  'environment variables required to run '
-                                 'Cinder commands')
+                                 'Cinder commands\n'
+                                 '(os_username, os_password, os_tenant, '
+                                 'os_auth)')
 
         parser.add_argument('-attached-volumes',
                             dest='volumes',
                             help='json structure containing volume names that '
                                  'are attached to Nova instances')
 
+        parser.add_argument('-discovery',
+                            dest='discovery',
+                            default=constant.PATH_DISCOVERY,
+                            choices=constant.PATH_DISCOVERY_MODES,
+                            help='cinder: list paths with the cinder CLI '
+                                 '(default)\n'
+                                 'sysfs: read paths from /dev/disk/by-path '
+                                 'and sysfs,\nonly using the cinder CLI to '
+                                 'name attached volumes')
+
+        parser.add_argument('-parallel',
+                            dest='parallel',
+                            type=int,
+                            metavar='N',
+                            help='number of nodes to check at the same time '
+                                 '(defaults to max_workers in cli.conf)')
+        parser.add_argument('-processes',
+                            dest='processes',
+                            type=int,
+                            metavar='N',
+                            help='number of worker processes to spread the '
+                                 'nodes across (defaults to processes in '
+                                 'cli.conf)')
+        parser.add_argument('-profile',
+                            dest='profile',
+                            action='store_true',
+                            help='time each phase of the check per node and '
+                                 'write a timing table to stderr')
+
         return parser
 
     def take_action(self, parsed_args):
+        if parsed_args.profile:
+            profiler.start()
         reader = conf_reader.Reader(parsed_args.test,
-                                    json_data=parsed_args.data)
-        result = reader.volume_paths_check(parsed_args.vars,
-                                           parsed_args.volumes)
+                                    json_data=parsed_args.data,
+                                    max_workers=parsed_args.parallel,
+                                    processes=parsed_args.processes)
+        if formatters.is_streaming(parsed_args):
+            result = reader.iter_volume_paths_check(
+                parsed_args.vars,
+                parsed_args.volumes,
+                ordered=False,
+                discovery=parsed_args.discovery)
+        else:
+            result = reader.volume_paths_check(parsed_args.vars,
+                                               parsed_args.volumes,
+                                               parsed_args.discovery)
 
         columns = ('Path', 'Attached Volume')
-        data = []
-        for path in result:
-            data.append((
-                path['path'],
-                path['vol_name']),
-            )
+        data = ((path['path'],
+                 path['vol_name'])
+                for path in result)
 
+        if parsed_args.profile:
+            return profiler.report(columns, data, add_column=False)
         return (columns, data)
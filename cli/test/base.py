@@ -23,6 +23,7 @@ import re
 import os
 import json
 from six.moves import configparser
+import cinderdiags.hpe3par_wsapi_checks as wsapi_checks
 import cinderdiags.main as cli
 
 
@@ -63,11 +64,14 @@ class BaseCinderDiagnosticsCliToolTest(unittest.TestCase):
             self.assertEqual(installed, row['Installed'])
             self.assertEqual(min_version, row['Version'])
 
-    def _execute_cli_command(self, command_arvgs, isJson=False):
+    def _execute_cli_command(self, command_arvgs, isJson=False,
+                             isJsonLines=False):
         """
         :param command_arvgs:  This includes command arguments
         :param isJson:  If true then execute command to get JSON output from
         CLI and if false then default table output
+        :param isJsonLines:  If true then execute command to get one JSON
+        object per line from CLI
         :return: cli command exit value and command output
         """
         # To verify the CLI Table output we convert it into JSON using external
@@ -80,6 +84,9 @@ class BaseCinderDiagnosticsCliToolTest(unittest.TestCase):
             # Add command line arugment to get the Json output
             command_arvgs.append('-f')
             command_arvgs.append('json')
+        elif isJsonLines:
+            command_arvgs.append('-f')
+            command_arvgs.append('jsonl')
 
         try:
             # Execute the command
@@ -99,6 +106,9 @@ class BaseCinderDiagnosticsCliToolTest(unittest.TestCase):
 
             if isJson:
                 return cli_exit_value, json.loads(data)
+            elif isJsonLines:
+                return cli_exit_value, [json.loads(line) for line in
+                                        data.splitlines() if line]
             else:
                 return cli_exit_value, self.listing(data)
 
@@ -206,6 +216,14 @@ class BaseCinderDiagnosticsCliToolTest(unittest.TestCase):
 
         client_mock.get.side_effect = my_side_effect
 
+        def getfo_side_effect(*args, **kwargs):
+            if raiseException:
+                raise IOError()
+            with open(config_file, 'rb') as f:
+                args[1].write(f.read())
+
+        client_mock.getfo.side_effect = getfo_side_effect
+
     def _mock_exec_command(self, dict, config_file=None):
         """
         :param dict: This include key value pair for the command and response
@@ -218,7 +236,6 @@ class BaseCinderDiagnosticsCliToolTest(unittest.TestCase):
         s_mock = self._patch('time.sleep')
         c_mock.return_value = client_mock
         error_mock = mock.MagicMock()
-        stdout_mock = mock.MagicMock()
         stdin_mock = mock.MagicMock()
 
         if config_file is not None:
@@ -227,17 +244,20 @@ class BaseCinderDiagnosticsCliToolTest(unittest.TestCase):
         def my_side_effect(*args, **kwargs):
             is_command_found = False
             command = args[0]
+            # Nodes are checked concurrently, so every command gets its own
+            # stdout mock rather than sharing one readlines() return value
+            stdout_mock = mock.MagicMock()
 
             error_mock.return_value = ""
             for key in dict.keys():
                 if command != "" and key in command:
                     # Assgin return value to command
-                    client_mock.readlines.return_value = dict.get(key)
+                    stdout_mock.readlines.return_value = dict.get(key)
                     is_command_found = True
             if not is_command_found:
-                client_mock.readlines.return_value = 'command not found'
+                stdout_mock.readlines.return_value = 'command not found'
 
-            return [stdin_mock, client_mock, error_mock]
+            return [stdin_mock, stdout_mock, error_mock]
         client_mock.exec_command.side_effect = my_side_effect
 
     def _patch(self, target, **kwargs):
@@ -299,6 +319,60 @@ hp_3par_fc.HP3PARFCDriver',
 
         return section_name, dict
 
+    def _get_default_hpe3par_iscsi_cinder_conf_section(self):
+        """This is default HPE 3par ISCSI configuration section of cinder
+        config file, using the re-branded "HPE" driver and option names.
+
+        :return:
+        """
+
+        section_name = '3PAR-HPE-ISCSI'
+        dict = {
+            'volume_driver': 'cinder.volume.drivers.hpe.\
+hpe_3par_iscsi.HPE3PARISCSIDriver',
+            'volume_backend_name': '3PAR-HPE-ISCSI',
+            'hpe3par_api_url': 'http://test.ws.url:8080/api/v1',
+            'hpe3par_username': 'testuser',
+            'hpe3par_password': 'testpass',
+            'hpe3par_cpg': 'testCPG',
+            'hpe3par_iscsi_ips': '1.1.1.1:3260'}
+        return section_name, dict
+
+    def _create_hpe3par_iscsi_cinder_conf(self, count, changes=None):
+        """Writes the test cinder config file with count default HPE 3par
+        ISCSI sections, named 3PAR-HPE-ISCSI-0, 3PAR-HPE-ISCSI-1, ...
+
+        :param changes: dictionary of section name to the options that are
+        set differently in that section
+        :return: dictionary of section name to options
+        """
+
+        cinder_dict = {}
+        for i in range(count):
+            section_name, values = \
+                self._get_default_hpe3par_iscsi_cinder_conf_section()
+            cinder_dict['%s-%d' % (section_name, i)] = values
+        for section_name, values in (changes or {}).items():
+            cinder_dict[section_name].update(values)
+        self._create_config(self.cinder_config_file, cinder_dict)
+        return cinder_dict
+
+    def _get_wsapi_checker(self, ssh_client=None, **kwargs):
+        """WS API checker of the test cinder config file of
+        CINDER_TEST_NODE, using the testing 3PAR client
+
+        :param ssh_client: ssh client of the node, a MagicMock by default
+        :param kwargs: other WSChecker arguments, max_workers defaults to 3
+        :return: WSChecker
+        """
+
+        kwargs.setdefault('max_workers', 3)
+        return wsapi_checks.WSChecker(ssh_client or mock.MagicMock(),
+                                      self.cinder_config_file,
+                                      'CINDER_TEST_NODE',
+                                      True,
+                                      **kwargs)
+
     def _get_default_cli_conf_section(self, node_name):
         """This is the default configuration for test version of cli.conf.
 
@@ -0,0 +1,422 @@
+#  (c) Copyright 2015 Hewlett Packard Enterprise Development LP
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Offline benchmark of the cinderdiags commands against a simulated fleet.
+
+Every node of the fleet is a fake paramiko connection (patched in like the
+tests in base.py do) that waits a configurable time per connect and per
+request, and a share of the nodes refuse connections.  3PAR arrays are the
+hpe3par_testclient fake with its LATENCY set.  Each command is run end to end
+through cinderdiags.main for every fleet size, and the wall time, SSH calls
+per node and WS API calls per array are reported, e.g.:
+
+    cd cli/test
+    python benchmark.py
+    python benchmark.py -nodes 10 100 -latency 0.02 -failure-rate 0.05
+    python benchmark.py -commands software-check -json > results.json
+
+Calls are counted in this process, so fleet mode (processes > 1) is not
+benchmarked here.  The file is not named test_*, so test runs skip it.
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import six
+
+from base import BaseCinderDiagnosticsCliToolTest
+import cinderdiags.constant as constant
+import cinderdiags.hpe3par_testclient as testclient
+import cinderdiags.main as cli
+
+FLEET_SIZES = [10, 100, 1000]
+# volume-lookup and host-paths answer from the index volume-paths-check
+# writes, so they come after it
+COMMANDS = ['software-check', 'options-check', 'ssh-credentials-check',
+            'volume-paths-check', 'volume-lookup', 'host-paths']
+CINDER_CONF = '/etc/cinder/cinder.conf'
+
+BATCH_MARKER = re.compile('(CINDERDIAGS-[0-9a-f]+)')
+BATCH_COMMAND = re.compile('^\\{ (.*?)\n\\}$', re.M | re.S)
+
+
+class FakeFleet(object):
+
+    def __init__(self, hosts, latency, connect_latency, failure_rate,
+                 cinder_conf, volumes, seed=0):
+        """Simulated nodes answering the commands cinderdiags sends
+
+        :param hosts: list of host IPs in the fleet
+        :param latency: seconds each SSH request takes
+        :param connect_latency: seconds each SSH connection takes
+        :param failure_rate: share of hosts that refuse SSH connections
+        :param cinder_conf: contents of cinder.conf on every cinder node
+        :param volumes: number of attached volumes on every nova node
+        """
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.cinder_conf = cinder_conf.encode('utf-8')
+        self.checksum = hashlib.sha256(self.cinder_conf).hexdigest()
+        self.failing = set(random.Random(seed).sample(
+            hosts, int(round(len(hosts) * failure_rate))))
+        self.iscsi_paths = ['/dev/disk/by-path/ip-1.1.1.1:3260-iscsi-iqn.'
+                            '2000-05.com.3pardata:21210002ac000001-lun-%d' %
+                            lun for lun in range(volumes)]
+        self.fc_paths = ['/dev/disk/by-path/pci-0000:05:00.0-fc-'
+                         '0x20210002ac000001-lun-%d' % lun
+                         for lun in range(volumes, volumes * 2)]
+        # (host, 'connect' | 'exec' | 'sftp') -> count
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+
+    def client(self, *args, **kwargs):
+        return FakeSSHClient(self)
+
+    def count(self, host, kind):
+        with self.lock:
+            self.calls[(host, kind)] += 1
+
+    def calls_per_host(self):
+        """
+        :return: dictionary of host to number of SSH calls
+        """
+        per_host = collections.Counter()
+        for (host, kind), count in self.calls.items():
+            per_host[host] += count
+        return per_host
+
+    def respond(self, host, command):
+        """Output of a single command on host
+        """
+        if 'machine-id' in command:
+            return hashlib.md5(host.encode('utf-8')).hexdigest() + '\n'
+        if 'ID_LIKE' in command:
+            return 'ID_LIKE=debian\n'
+        if '${Package}' in command:
+            return ('sysfsutils install ok installed 2.2.0-1\n'
+                    'sg3-utils install ok installed 1.40-1\n'
+                    'python-3parclient install ok installed 4.2.0\n')
+        if 'pip list' in command:
+            return '[{"name": "python-3parclient", "version": "4.2.0"}]\n'
+        if command.startswith('sha256sum'):
+            return '%s  %s\n' % (self.checksum, CINDER_CONF)
+        if command == 'hostname':
+            return host + '\n'
+        if command.startswith('find /dev/disk/by-path'):
+            return ''.join('%s ../../sd%s\n' % (path, chr(ord('b') + i % 24))
+                           for i, path in enumerate(self.iscsi_paths +
+                                                    self.fc_paths))
+        if '/sys/block' in command:
+            return ''
+        if 'get-all-volume-paths' in command:
+            if 'ISCSI' in command:
+                return '\n'.join(self.iscsi_paths) + '\n'
+            return '\n'.join(self.fc_paths) + '\n'
+        if 'get-volume-paths' in command:
+            index = int(command.rsplit('-', 1)[1])
+            return (self.iscsi_paths + self.fc_paths)[index] + '\n'
+        return ''
+
+    def execute(self, host, command):
+        """Output of a command, or of a batch of commands sent by
+        ssh_client.Client.execute_many
+        """
+        marker = BATCH_MARKER.search(command)
+        if not marker:
+            return self.respond(host, command), ''
+        marker = marker.group(1)
+        stdout = []
+        stderr = []
+        for index, batched in enumerate(BATCH_COMMAND.findall(command)):
+            stdout.append('\n%s %d\n%s\n%s %d 0\n' %
+                          (marker, index,
+                           self.respond(host, batched).rstrip('\n'),
+                           marker, index))
+            stderr.append('\n%s %d\n\n%s %d\n' %
+                          (marker, index, marker, index))
+        return ''.join(stdout), ''.join(stderr)
+
+
+class FakeOutput(object):
+
+    def __init__(self, text):
+        self.text = text
+
+    def readlines(self):
+        return self.text.splitlines(True)
+
+
+class FakeSSHClient(object):
+    """Stands in for paramiko.SSHClient, its transport and its SFTP client
+    """
+
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.host = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, **kwargs):
+        self.fleet.count(hostname, 'connect')
+        time.sleep(self.fleet.connect_latency)
+        if hostname in self.fleet.failing:
+            raise socket.error('Connection refused')
+        self.host = hostname
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.host is not None
+
+    def is_authenticated(self):
+        return self.host is not None
+
+    def exec_command(self, command, timeout=None):
+        self.fleet.count(self.host, 'exec')
+        time.sleep(self.fleet.latency)
+        stdout, stderr = self.fleet.execute(self.host, command)
+        return None, FakeOutput(stdout), FakeOutput(stderr)
+
+    def open_sftp(self):
+        return self
+
+    def getfo(self, remotepath, fl):
+        self.fleet.count(self.host, 'sftp')
+        time.sleep(self.fleet.latency)
+        fl.write(self.fleet.cinder_conf)
+
+    def get(self, remotepath, localpath):
+        with open(localpath, 'wb') as f:
+            self.getfo(remotepath, f)
+
+    def close(self):
+        pass
+
+
+class FleetBenchmark(BaseCinderDiagnosticsCliToolTest):
+
+    def __init__(self, args):
+        """Runs every command against fleets of each size in args.nodes
+        """
+        super(FleetBenchmark, self).__init__('run_all')
+        self.args = args
+        self.mock_instances = []
+        self.workdir = None
+
+    def run_all(self):
+        """
+        :return: list of dictionaries, one per command and fleet size
+        """
+        results = []
+        self.workdir = tempfile.mkdtemp(prefix='cinderdiags-benchmark-')
+        test_cli_config = constant.TEST_CLI_CONFIG
+        cache_directory = constant.CACHE_DIRECTORY
+        latency = testclient.HPE3ParClient.LATENCY
+        try:
+            # the volume index written by volume-paths-check goes with the
+            # fleet
+            constant.CACHE_DIRECTORY = self.workdir
+            testclient.HPE3ParClient.LATENCY = self.args.wsapi_latency
+            for size in self.args.nodes:
+                for command in self.args.commands:
+                    results.append(self.run_command(command, size))
+        finally:
+            testclient.HPE3ParClient.LATENCY = latency
+            constant.TEST_CLI_CONFIG = test_cli_config
+            constant.CACHE_DIRECTORY = cache_directory
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return results
+
+    def create_fleet(self, size):
+        """Write cli.conf for a fleet of size nodes, half cinder and half
+        nova, and patch paramiko to reach them
+
+        :return: FakeFleet
+        """
+        cli_dict = {}
+        hosts = []
+        for i in range(size):
+            service = 'nova' if i % 2 else 'cinder'
+            section = self._get_default_cli_conf_section(service)
+            section['host_ip'] = '10.%d.%d.%d' % (i >> 16 & 255,
+                                                  i >> 8 & 255, i & 255)
+            section['conf_source'] = CINDER_CONF
+            cli_dict['NODE-%04d' % i] = section
+            hosts.append(section['host_ip'])
+        cli_conf = os.path.join(self.workdir, 'cli.conf')
+        self._create_config(cli_conf, cli_dict)
+        constant.TEST_CLI_CONFIG = cli_conf
+
+        section_name, section = \
+            self._get_default_hpe3par_iscsi_cinder_conf_section()
+        cinder_conf = os.path.join(self.workdir, 'cinder.conf')
+        self._create_config(cinder_conf, {section_name: section})
+        with open(cinder_conf) as f:
+            fleet = FakeFleet(hosts, self.args.latency,
+                              self.args.connect_latency,
+                              self.args.failure_rate, f.read(),
+                              self.args.volumes, self.args.seed)
+
+        self._patch('paramiko.SSHClient', side_effect=fleet.client)
+        self._patch('paramiko.AutoAddPolicy')
+        # the fleet is not reachable over HTTP, never ask Keystone for a
+        # token even with keystone_token enabled
+        self._patch('cinderdiags.keystone.get_token', return_value=None)
+        return fleet
+
+    def command_arguments(self, command):
+        argv = [command]
+        if command == 'volume-lookup':
+            argv.append('vol-0')
+        elif command == 'host-paths':
+            # first nova node
+            argv.append('NODE-0001')
+        if command == 'ssh-credentials-check':
+            argv += ['-conf-file', constant.TEST_CLI_CONFIG]
+        else:
+            argv.append('-test')
+        if command == 'volume-paths-check':
+            argv += ['-os-vars', json.dumps({'os_username': 'admin',
+                                             'os_password': 'admin',
+                                             'os_tenant': 'admin',
+                                             'os_auth': 'http://localhost'}),
+                     '-attached-volumes',
+                     json.dumps(['vol-%d' % i
+                                 for i in range(self.args.volumes)])]
+        if command == 'volume-paths-check':
+            argv += ['-discovery', self.args.discovery]
+        if self.args.parallel:
+            argv += ['-parallel', str(self.args.parallel)]
+        return argv + ['-f', 'json']
+
+    def run_command(self, command, size):
+        """Run one command end to end against a new fleet
+
+        :return: dictionary of measurements
+        """
+        fleet = self.create_fleet(size)
+        testclient.HPE3ParClient.reset_calls()
+        stdout = sys.stdout
+        sys.stdout = six.StringIO()
+        try:
+            start = time.time()
+            exit_value = cli.main(self.command_arguments(command))
+            seconds = time.time() - start
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            for instance in self.mock_instances:
+                instance.stop()
+            self.mock_instances = []
+
+        try:
+            rows = len(json.loads(output))
+        except ValueError:
+            rows = 0
+        ssh_calls = list(fleet.calls_per_host().values()) or [0]
+        wsapi_calls = collections.Counter()
+        for (api_url, method), count in testclient.HPE3ParClient.calls.items():
+            wsapi_calls[api_url] += count
+        return {'command': command,
+                'nodes': size,
+                'exit_value': exit_value,
+                'seconds': round(seconds, 3),
+                'rows': rows,
+                'ssh_calls_per_node': round(float(sum(ssh_calls)) /
+                                            len(ssh_calls), 2),
+                'ssh_calls_max': max(ssh_calls),
+                'wsapi_calls_per_array': dict(wsapi_calls)}
+
+
+def format_results(results):
+    header = ('Command', 'Nodes', 'Seconds', 'Rows', 'SSH/node', 'SSH max',
+              'WSAPI/array')
+    lines = [(result['command'], str(result['nodes']),
+              '%.3f' % result['seconds'], str(result['rows']),
+              '%.2f' % result['ssh_calls_per_node'],
+              str(result['ssh_calls_max']),
+              str(max(list(result['wsapi_calls_per_array'].values()) or
+                      [0])))
+             for result in results]
+    widths = [max([len(header[i])] + [len(line[i]) for line in lines])
+              for i in range(len(header))]
+    layout = '  '.join('%%-%ds' % width for width in widths)
+    table = [layout % header, layout % tuple('-' * w for w in widths)]
+    table += [layout % line for line in lines]
+    return '\n'.join(table) + '\n'
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='benchmark cinderdiags commands against a simulated '
+                    'fleet')
+    parser.add_argument('-nodes', type=int, nargs='+', default=FLEET_SIZES,
+                        help='fleet sizes to run (default: 10 100 1000)')
+    parser.add_argument('-commands', nargs='+', default=COMMANDS,
+                        choices=COMMANDS)
+    parser.add_argument('-latency', type=float, default=0.01,
+                        help='seconds each SSH request takes')
+    parser.add_argument('-connect-latency', dest='connect_latency',
+                        type=float, default=0.05,
+                        help='seconds each SSH connection takes')
+    parser.add_argument('-wsapi-latency', dest='wsapi_latency', type=float,
+                        default=0.05,
+                        help='seconds each 3PAR WS API request takes')
+    parser.add_argument('-failure-rate', dest='failure_rate', type=float,
+                        default=0.01,
+                        help='share of nodes refusing SSH connections')
+    parser.add_argument('-volumes', type=int, default=4,
+                        help='attached volumes per nova node')
+    parser.add_argument('-discovery', default=constant.PATH_DISCOVERY,
+                        choices=constant.PATH_DISCOVERY_MODES,
+                        help='passed on to volume-paths-check')
+    parser.add_argument('-parallel', type=int,
+                        help='passed on to the commands')
+    parser.add_argument('-seed', type=int, default=0,
+                        help='picks the failing nodes')
+    parser.add_argument('-json', action='store_true',
+                        help='print the results as JSON')
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    args = get_parser().parse_args(argv)
+    # the commands log every node at warning level
+    logging.getLogger('cinderdiags').setLevel(logging.ERROR)
+    results = FleetBenchmark(args).run_all()
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        sys.stdout.write(format_results(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
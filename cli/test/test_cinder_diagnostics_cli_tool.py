@@ -14,12 +14,39 @@
 
 from base import BaseCinderDiagnosticsCliToolTest
 from cinderdiags.ssh_client import Client
+import cinderdiags.cache as cache
+import cinderdiags.cinder_conf as cinder_conf
+import cinderdiags.conf_reader as conf_reader
+import cinderdiags.hpe3par_wsapi_checks as wsapi_checks
+import cinderdiags.keystone as keystone
+import cinderdiags.lun_stats as lun_stats
 import cinderdiags.pkg_checks as pkg_checks
+import cinderdiags.profiler as profiler
 import cinderdiags.constant as constant
+import cinderdiags.ssh_pool as ssh_pool
 import unittest
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import shutil
 import socket
+import subprocess
+import tempfile
+import threading
+import time
+import mock
 import paramiko
 
+try:
+    import asyncio
+    import cinderdiags.ssh_asyncio as ssh_asyncio
+except (ImportError, SyntaxError):
+    # the asyncio SSH transport needs Python 3
+    asyncio = None
+    ssh_asyncio = None
+
 
 class CinderDiagnostics3PARCliToolTest(BaseCinderDiagnosticsCliToolTest):
 
@@ -34,6 +61,14 @@ class CinderDiagnostics3PARCliToolTest(BaseCinderDiagnosticsCliToolTest):
 
         constant.TEST_CLI_CONFIG = 'cli.conf'
         constant.DIRECTORY = "./"
+        # results of earlier runs, e.g. the volume index, stay out of the
+        # real cache directory
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        cache_patch = mock.patch.object(constant, 'CACHE_DIRECTORY',
+                                        cache_dir)
+        cache_patch.start()
+        self.addCleanup(cache_patch.stop)
 
         # 3par FC section
         cli_dict = {}
@@ -50,6 +85,7 @@ class CinderDiagnostics3PARCliToolTest(BaseCinderDiagnosticsCliToolTest):
         # Remove all the packages
         for instance in self.mock_instances:
             instance.stop()
+        ssh_pool.POOL.close()
 
         self._remove_file(self.cinder_config_file)
 
@@ -1236,6 +1272,1445 @@ class CinderDiagnostics3PARCliToolTest(BaseCinderDiagnosticsCliToolTest):
             if client is not None:
                 client.disconnect()
 
+    def test_credentials_check_parallel_keeps_node_order(self):
+        """Test ssh-credentials-check lists nodes in cli.conf order when the
+        nodes are checked in parallel."""
+
+        cli_dict = {}
+        for i in range(6):
+            service = 'nova' if i % 2 else 'cinder'
+            cli_dict['NODE-%d' % i] = self._get_default_cli_conf_section(
+                service)
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        self._mock_ssh_connection()
+
+        command_arvgs = ['ssh-credentials-check',
+                         '-conf-file',
+                         constant.TEST_CLI_CONFIG,
+                         '-parallel',
+                         '4']
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual(['NODE-1', 'NODE-3', 'NODE-5',
+                          'NODE-0', 'NODE-2', 'NODE-4'],
+                         [row['Node'] for row in output])
+        for row in output:
+            self.assertEqual('pass', row['Connect'])
+
+    def test_max_workers_from_cli_conf(self):
+        """Test max_workers is read from the [DEFAULT] section of cli.conf
+        and can be overridden per command."""
+
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nmax_workers = 3\n')
+
+        self.assertEqual(3, conf_reader.Reader(True).max_workers)
+        self.assertEqual(5, conf_reader.Reader(True,
+                                               max_workers=5).max_workers)
+
+    def test_credentials_check_with_unreachable_node_deadline(self):
+        """Test ssh-credentials-check reports a node that does not connect
+        before the connect deadline as failed without waiting for it."""
+
+        cli_dict = {}
+        cli_dict['CINDER_TEST_NODE'] = self._get_default_cli_conf_section(
+            'cinder')
+        cli_dict['NOVA_TEST_NODE'] = self._get_default_cli_conf_section(
+            'nova')
+        cli_dict['NOVA_TEST_NODE']['host_ip'] = '192.168.10.6'
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nconnect_deadline = 0.5\n')
+
+        c_mock, aa_mock, client_mock = self._set_ssh_connection_mocks()
+        c_mock.return_value = client_mock
+        hang = threading.Event()
+
+        def connect(host, **kwargs):
+            if host == '192.168.10.6':
+                hang.wait(5)
+        client_mock.connect.side_effect = connect
+
+        start = time.time()
+        try:
+            result = conf_reader.Reader(True).credentials_check()
+        finally:
+            hang.set()
+
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual([{'node': 'NOVA_TEST_NODE', 'connect': 'fail'},
+                          {'node': 'CINDER_TEST_NODE', 'connect': 'pass'}],
+                         result)
+
+    def test_connect_deadline_stops_queued_connections(self):
+        """Test connections still queued when the connect deadline expires
+        are never opened, and one that completes late is closed again."""
+
+        cli_dict = {}
+        for i in range(3):
+            cli_dict['NOVA-%d' % i] = self._get_default_cli_conf_section(
+                'nova')
+            cli_dict['NOVA-%d' % i]['host_ip'] = '10.0.0.%d' % i
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nconnect_deadline = 0.2\n'
+                       'ssh_pool_idle_timeout = 0\n')
+
+        c_mock, aa_mock, client_mock = self._set_ssh_connection_mocks()
+        c_mock.return_value = client_mock
+        hang = threading.Event()
+        closed = threading.Event()
+        hosts = []
+
+        def connect(host, **kwargs):
+            hosts.append(host)
+            hang.wait(5)
+        client_mock.connect.side_effect = connect
+        client_mock.close.side_effect = lambda: closed.set()
+
+        reader = conf_reader.Reader(True, max_workers=1)
+        self.addCleanup(setattr, ssh_pool.POOL, 'idle_timeout',
+                        constant.SSH_POOL_IDLE_TIMEOUT)
+        try:
+            self.assertEqual({}, reader.get_clients(reader.nova_nodes))
+        finally:
+            hang.set()
+        # the connection in progress completes and is closed, and nothing
+        # queued behind it is started afterwards
+        self.assertTrue(closed.wait(5))
+        threading.Event().wait(0.2)
+
+        self.assertEqual(['10.0.0.0'], hosts)
+        self.assertEqual(1, client_mock.close.call_count)
+
+    def test_ssh_pool_reuses_connections_between_commands(self):
+        """Test SSH connections released by one command are reused by the
+        next one, and closed once they have been idle too long."""
+
+        c_mock, aa_mock, client_mock = self._set_ssh_connection_mocks()
+        c_mock.return_value = client_mock
+
+        conf_reader.Reader(True).credentials_check()
+        self.assertEqual(2, c_mock.call_count)
+        self.assertFalse(client_mock.close.called)
+
+        result = conf_reader.Reader(True).credentials_check()
+        self.assertEqual(2, c_mock.call_count)
+        for check in result:
+            self.assertEqual('pass', check['connect'])
+
+        ssh_pool.POOL.idle_timeout = 0
+        try:
+            ssh_pool.POOL.evict_idle()
+        finally:
+            ssh_pool.POOL.idle_timeout = constant.SSH_POOL_IDLE_TIMEOUT
+        self.assertEqual(2, client_mock.close.call_count)
+
+    def test_execute_many_with_mock(self):
+        """Test several commands run over one exec channel with separate
+        stdout, stderr and exit codes."""
+
+        c_mock, aa_mock, client_mock = self._set_ssh_connection_mocks()
+        c_mock.return_value = client_mock
+
+        def run_in_shell(script, **kwargs):
+            proc = subprocess.Popen(['sh', '-c', script],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    universal_newlines=True)
+            stdout, stderr = proc.communicate()
+            stdout_mock = mock.MagicMock()
+            stdout_mock.readlines.return_value = [stdout]
+            stderr_mock = mock.MagicMock()
+            stderr_mock.readlines.return_value = [stderr]
+            return [mock.MagicMock(), stdout_mock, stderr_mock]
+        client_mock.exec_command.side_effect = run_in_shell
+
+        client = Client('127.0.0.1', 'mock', 'mock')
+        results = client.execute_many(['echo hello',
+                                       "printf 'no newline'",
+                                       'echo oops >&2; false'])
+
+        self.assertEqual(1, client_mock.exec_command.call_count)
+        self.assertEqual(['hello\n', 'no newline', ''],
+                         [result['stdout'] for result in results])
+        self.assertEqual(['', '', 'oops\n'],
+                         [result['stderr'] for result in results])
+        self.assertEqual([0, 0, 1],
+                         [result['exit_code'] for result in results])
+
+    def test_execute_many_falls_back_to_single_commands(self):
+        """Test commands run one at a time when the batched output is not
+        recognized."""
+
+        self._mock_exec_command({'echo hello': 'hello',
+                                 'echo world': 'world'})
+
+        client = Client('127.0.0.1', 'mock', 'mock')
+        results = client.execute_many(['echo hello', 'echo world'])
+
+        self.assertEqual(['hello', 'world'],
+                         [result['stdout'] for result in results])
+
+    def test_software_check_packages_from_inventory(self):
+        """Test software-check looks a list of packages up in the node's
+        package inventory instead of querying each package."""
+
+        command_arvgs = [
+            'software-check',
+            '-software-pkgs',
+            '[{"sysfsutils": "2.1"}, {"sg3-utils || sg3_utils": "1.3"}, '
+            '{"python-3parclient": "4.2.0"}, {"multipath-tools": "0.5"}]',
+            '-service',
+            'nova',
+            '-test']
+        self._mock_exec_command(
+            {
+                'cat /etc/*release': 'ID_LIKE=debian',
+                '${Package}': "sysfsutils install ok installed 2.2.0-1\n"
+                              "sg3-utils install ok installed 1.36-1\n",
+                'pip list --format=json': '[{"name": "python-3parclient", '
+                                          '"version": "4.1.0"}]',
+            })
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual(
+            [['sysfsutils (>=2.1)', 'pass', 'pass (2.2.0)'],
+             ['sg3-utils (>=1.3)', 'pass', 'pass (1.36)'],
+             ['python-3parclient (>=4.2.0)', 'pass', 'fail (4.1.0)'],
+             ['multipath-tools', 'fail', 'N/A']],
+            [[row['Software'], row['Installed'], row['Version']]
+             for row in output])
+
+        client_mock = paramiko.SSHClient.return_value
+        for call in client_mock.exec_command.call_args_list:
+            self.assertFalse(call[0][0].startswith(pkg_checks.DPKG_QUERY))
+            self.assertFalse(call[0][0].startswith(pkg_checks.PIP_QUERY))
+
+    def test_software_check_os_flavor_cache(self):
+        """Test the node OS is detected once and reused by later runs from
+        the on-disk cache until the node's machine-id changes."""
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nos_cache_ttl = 3600\n'
+                       'cache_dir = %s\n' % cache_dir)
+        responses = {
+            'cat /etc/*release': 'ID_LIKE=debian',
+            'machine-id': 'a1b2c3',
+            '${Package}': "sysfsutils install ok installed 2.2.0-1\n",
+            'pip list --format=json': '[]',
+        }
+        command_arvgs = ['software-check', '-software', 'sysfsutils',
+                         '-service', 'nova', '-test']
+
+        def release_queries():
+            client_mock = paramiko.SSHClient.return_value
+            return [call for call in client_mock.exec_command.call_args_list
+                    if call[0][0] == pkg_checks.RELEASE_QUERY]
+
+        self._mock_exec_command(responses)
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual('pass', output[0]['Installed'])
+        self.assertEqual(1, len(release_queries()))
+
+        self._mock_exec_command(responses)
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+        self.assertEqual('pass', output[0]['Installed'])
+        self.assertEqual(0, len(release_queries()))
+
+        responses['machine-id'] = 'd4e5f6'
+        self._mock_exec_command(responses)
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+        self.assertEqual('pass', output[0]['Installed'])
+        self.assertEqual(1, len(release_queries()))
+
+    def test_cache_only_used_in_private_directory(self):
+        """Test cache files are written with mode 0600 to a directory
+        created with mode 0700, and a cache directory other users can write
+        to is neither read nor written."""
+
+        parent = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, parent)
+        directory = os.path.join(parent, 'cinderdiags')
+        entries = cache.FileCache('entries', directory)
+        entries.set('key', 'value')
+
+        self.assertEqual('value', entries.get('key'))
+        self.assertEqual(0o700, os.stat(directory).st_mode & 0o777)
+        self.assertEqual(0o600, os.stat(entries.path).st_mode & 0o777)
+        self.assertEqual(0o600,
+                         os.stat(entries.path + '.lock').st_mode & 0o777)
+        self.assertEqual([entries.path, entries.path + '.lock'],
+                         sorted(os.path.join(directory, name)
+                                for name in os.listdir(directory)))
+
+        os.chmod(directory, 0o777)
+        self.assertIsNone(entries.get('key'))
+        entries.set('key', 'planted')
+        os.chmod(directory, 0o700)
+        self.assertEqual('value', entries.get('key'))
+
+        link = os.path.join(parent, 'link')
+        os.symlink(directory, link)
+        self.assertIsNone(cache.FileCache('entries', link + '/').get('key'))
+
+    def test_wsapi_check_all_limits_concurrency_per_array(self):
+        """Test backend sections are checked concurrently, in order, without
+        more than max_per_array of them using the same array at once."""
+
+        # a password per section so each one logs in on its own
+        self._create_hpe3par_iscsi_cinder_conf(4, dict(
+            ('3PAR-HPE-ISCSI-%d' % i, {'hpe3par_password': 'pass-%d' % i})
+            for i in range(4)))
+
+        lock = threading.Lock()
+        usage = {'active': 0, 'peak': 0}
+        login = wsapi_checks.testclient.HPE3ParClient.login
+
+        def slow_login(client, username, password):
+            with lock:
+                usage['active'] += 1
+                usage['peak'] = max(usage['peak'], usage['active'])
+            threading.Event().wait(0.05)
+            with lock:
+                usage['active'] -= 1
+            return login(client, username, client.PASSWORD)
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.login',
+                    new=slow_login)
+
+        checker = self._get_wsapi_checker(max_workers=4, max_per_array=1)
+        result = checker.check_all()
+
+        self.assertEqual(1, usage['peak'])
+
+        # the limit belongs to the run, a later run gets its own
+        usage['peak'] = 0
+        self._get_wsapi_checker(max_workers=4, max_per_array=2).check_all()
+        self.assertEqual(2, usage['peak'])
+        self.assertEqual(['3PAR-HPE-ISCSI-%d' % i for i in range(4)],
+                         [check['name'] for check in result])
+        for check in result:
+            self.assertEqual('pass', check['url'])
+            self.assertEqual('pass', check['credentials'])
+            self.assertEqual('pass', check['cpg'])
+            self.assertEqual('pass', check['iscsi'])
+
+    def test_wsapi_section_error_fails_only_that_section(self):
+        """Test an SSH error while checking one backend section fails that
+        section and the node's other sections are still checked."""
+
+        self._create_hpe3par_iscsi_cinder_conf(3)
+
+        ssh_client = mock.MagicMock()
+        ssh_client.execute.side_effect = [
+            Exception('SSH Error: Unable to execute remote command'),
+            'cinder/volume/drivers/hpe/hpe_3par_iscsi',
+            'cinder/volume/drivers/hpe/hpe_3par_iscsi']
+        checker = self._get_wsapi_checker(ssh_client)
+        result = checker.check_all()
+
+        self.assertEqual(['3PAR-HPE-ISCSI-%d' % i for i in range(3)],
+                         [check['name'] for check in result])
+        self.assertEqual(['fail', 'pass', 'pass'],
+                         sorted(check['credentials'] for check in result))
+        failed = [check for check in result
+                  if check['credentials'] == 'fail'][0]
+        for check in ('url', 'cpg', 'iscsi', 'driver'):
+            self.assertEqual('fail', failed[check])
+
+    def test_nested_checks_share_spare_threads(self):
+        """Test nested maps share one budget of spare threads instead of
+        multiplying them, and still complete when no thread is spare."""
+
+        workers = wsapi_checks.Workers(2)
+        lock = threading.Lock()
+        usage = {'active': 0, 'peak': 0}
+
+        def target(item):
+            with lock:
+                usage['active'] += 1
+                usage['peak'] = max(usage['peak'], usage['active'])
+            threading.Event().wait(0.02)
+            with lock:
+                usage['active'] -= 1
+            return item
+
+        def section(item):
+            return workers.map(target, [(item, i) for i in range(3)])
+
+        result = workers.map(section, range(3))
+
+        self.assertEqual([[(item, i) for i in range(3)]
+                          for item in range(3)], result)
+        self.assertEqual(3, usage['peak'])
+        self.assertEqual(2, workers.free)
+        self.assertRaises(ZeroDivisionError, workers.map,
+                          lambda item: 1 / item, [1, 0, 2])
+        self.assertEqual(2, workers.free)
+
+    def test_ssh_channels_capped_per_connection(self):
+        """Test threads sharing an SSH connection never open more channels
+        at the same time than sshd allows."""
+
+        c_mock, aa_mock, client_mock = self._set_ssh_connection_mocks()
+        c_mock.return_value = client_mock
+        lock = threading.Lock()
+        usage = {'active': 0, 'peak': 0}
+
+        def exec_command(command, **kwargs):
+            with lock:
+                usage['active'] += 1
+                usage['peak'] = max(usage['peak'], usage['active'])
+            threading.Event().wait(0.02)
+            with lock:
+                usage['active'] -= 1
+            stdout_mock = mock.MagicMock()
+            stdout_mock.readlines.return_value = [command]
+            return [mock.MagicMock(), stdout_mock, mock.MagicMock()]
+        client_mock.exec_command.side_effect = exec_command
+
+        client = Client('127.0.0.1', 'mock', 'mock')
+        threads = [threading.Thread(target=client.execute,
+                                    args=('echo %d' % i,))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(20, client_mock.exec_command.call_count)
+        self.assertEqual(constant.SSH_MAX_CHANNELS, usage['peak'])
+
+    def test_wsapi_sessions_shared_between_sections(self):
+        """Test sections using the same array and user share one login and
+        one logout, while a section with another password is checked on its
+        own."""
+
+        self._create_hpe3par_iscsi_cinder_conf(
+            3, {'3PAR-HPE-ISCSI-2': {'hpe3par_password': 'wrongpass'}})
+
+        calls = {'login': 0, 'logout': 0}
+        login = wsapi_checks.testclient.HPE3ParClient.login
+
+        def counted_login(client, username, password):
+            calls['login'] += 1
+            return login(client, username, password)
+
+        def counted_logout(client):
+            calls['logout'] += 1
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.login',
+                    new=counted_login)
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.logout',
+                    new=counted_logout)
+
+        sessions = wsapi_checks.SessionCache()
+        checker = self._get_wsapi_checker(sessions=sessions)
+        result = checker.check_all()
+
+        self.assertEqual(['pass', 'pass', 'fail'],
+                         [check['credentials'] for check in result])
+        self.assertEqual(2, calls['login'])
+        self.assertEqual(0, calls['logout'])
+        sessions.logout_all()
+        self.assertEqual(1, calls['logout'])
+
+    def test_wsapi_login_error_fails_every_section_of_the_array(self):
+        """Test an unexpected error during the shared login fails the
+        credentials of every section using the array, with a single login
+        attempt and no logout."""
+
+        self._create_hpe3par_iscsi_cinder_conf(3)
+
+        login = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.login',
+            side_effect=Exception('503 Service Unavailable'))
+        logout = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.logout')
+
+        checker = self._get_wsapi_checker()
+        result = checker.check_all()
+
+        self.assertEqual([('pass', 'fail')] * 3,
+                         [(check['url'], check['credentials'])
+                          for check in result])
+        self.assertEqual(1, login.call_count)
+        self.assertFalse(logout.called)
+
+    def test_wsapi_cpgs_listed_once_per_array(self):
+        """Test CPG names of every section are checked against a single
+        getCPGs listing of the array."""
+
+        self._create_hpe3par_iscsi_cinder_conf(
+            3, {'3PAR-HPE-ISCSI-2': {'hpe3par_cpg': 'testCPG, badCPG'}})
+
+        client_class = wsapi_checks.testclient.HPE3ParClient
+        get_cpgs = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.getCPGs',
+            autospec=True, side_effect=client_class.getCPGs)
+        get_cpg = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.getCPG')
+
+        checker = self._get_wsapi_checker()
+        result = checker.check_all()
+
+        self.assertEqual(['pass', 'pass', 'fail'],
+                         [check['cpg'] for check in result])
+        self.assertEqual(1, get_cpgs.call_count)
+        self.assertFalse(get_cpg.called)
+
+    def test_wsapi_ports_indexed_once_per_array(self):
+        """Test iSCSI IPs of every section are checked against one port index
+        of the array."""
+
+        self._create_hpe3par_iscsi_cinder_conf(
+            3, {'3PAR-HPE-ISCSI-1': {'hpe3par_iscsi_ips':
+                                     '2.2.2.2, 1.1.1.1:3260'},
+                '3PAR-HPE-ISCSI-2': {'hpe3par_iscsi_ips': '3.3.3.3'}})
+
+        client_class = wsapi_checks.testclient.HPE3ParClient
+        get_ports = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.getPorts',
+            autospec=True, side_effect=client_class.getPorts)
+
+        checker = self._get_wsapi_checker()
+        result = checker.check_all()
+
+        self.assertEqual(['pass', 'pass', 'fail'],
+                         [check['iscsi'] for check in result])
+        self.assertEqual(1, get_ports.call_count)
+        client, logged_in = checker.get_session('3PAR-HPE-ISCSI-0')
+        self.assertEqual({'iscsi_ips': set(['1.1.1.1', '2.2.2.2']),
+                          'fc_wwns': set(['20210002AC000001'])},
+                         checker.get_port_index(client))
+
+    def test_options_check_reads_cinder_conf_in_memory(self):
+        """Test options-check parses cinder.conf read over SSH without a
+        local copy and keeps every replication_device entry."""
+
+        section_name, values = \
+            self._get_default_hpe3par_iscsi_cinder_conf_section()
+        self._create_config(self.cinder_config_file, {section_name: values})
+        with open(self.cinder_config_file, 'a') as conf:
+            conf.write('replication_device = backend_id:target-1,\n'
+                       'replication_mode:periodic,cpg_map:testCPG:testCPG,\n'
+                       'hpe3par_api_url:http://test.ws.url:8080/api/v1,\n'
+                       'hpe3par_username:testuser,'
+                       'hpe3par_password:testpass\n'
+                       'replication_device = backend_id:target-2,'
+                       'replication_mode:sync,cpg_map:testCPG:testCPG,'
+                       'hpe3par_api_url:http://test.ws.url:8080/api/v1,'
+                       'hpe3par_username:testuser,'
+                       'hpe3par_password:badpass\n')
+        self._mock_exec_command(
+            {'locate': 'cinder/volume/drivers/hpe/hpe_3par_iscsi'},
+            self.cinder_config_file)
+
+        reader = conf_reader.Reader(True, check_replication=True)
+        result = reader.options_check()
+
+        self.assertEqual(1, len(result))
+        self.assertEqual('pass', result[0]['credentials'])
+        self.assertEqual('pass', result[0]['driver'])
+        replication = result[0]['replication_results']
+        self.assertIn('Backend ID:target-1;; WS API:pass;; '
+                      'Credentials:pass;;', replication)
+        self.assertIn('Backend ID:target-2;; WS API:pass;; '
+                      'Credentials:fail;;', replication)
+        self.assertFalse(os.path.exists(constant.DIRECTORY +
+                                        'CINDER_TEST_NODE'))
+
+    def test_options_check_conf_cache_by_checksum(self):
+        """Test a cached cinder.conf is reused while its checksum on the
+        node is unchanged and read again once it changes."""
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nconf_cache_ttl = 3600\n'
+                       'cache_dir = %s\n' % cache_dir)
+        section_name, values = \
+            self._get_default_hpe3par_iscsi_cinder_conf_section()
+        self._create_config(self.cinder_config_file, {section_name: values})
+
+        def read_confs(checksum):
+            self._mock_exec_command(
+                {'sha256sum': '%s  /etc/cinder/cinder.conf\n' % checksum},
+                self.cinder_config_file)
+            reader = conf_reader.Reader(True)
+            clients = reader.get_clients(reader.cinder_nodes)
+            confs = reader.read_confs(clients)
+            reader.cleanup(clients)
+            ssh_pool.POOL.close()
+            client_mock = paramiko.SSHClient.return_value
+            return confs['CINDER_TEST_NODE'], client_mock.getfo.call_count
+
+        conf, reads = read_confs('a' * 64)
+        self.assertEqual(1, reads)
+        self.assertEqual('testCPG', conf.get(section_name, 'hpe3par_cpg'))
+
+        conf, reads = read_confs('a' * 64)
+        self.assertEqual(0, reads)
+        self.assertEqual('testCPG', conf.get(section_name, 'hpe3par_cpg'))
+        self.assertEqual([section_name], conf.sections())
+
+        conf, reads = read_confs('b' * 64)
+        self.assertEqual(1, reads)
+
+    def test_wsapi_incremental_check_reuses_unchanged_sections(self):
+        """Test stored section results are served until the section options
+        or the array serial number change."""
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        results = cache.FileCache('options_check', cache_dir, 3600)
+        section_name, values = \
+            self._get_default_hpe3par_iscsi_cinder_conf_section()
+        self._create_config(self.cinder_config_file, {section_name: values})
+
+        client_class = wsapi_checks.testclient.HPE3ParClient
+        get_cpgs = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.getCPGs',
+            autospec=True, side_effect=client_class.getCPGs)
+
+        def check():
+            return self._get_wsapi_checker(results=results).check_all()
+
+        first = check()
+        self.assertEqual(1, get_cpgs.call_count)
+        self.assertEqual('pass', first[0]['cpg'])
+
+        self.assertEqual(first, check())
+        self.assertEqual(1, get_cpgs.call_count)
+
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.'
+                    'SERIAL_NUMBER', new='7654321')
+        check()
+        self.assertEqual(2, get_cpgs.call_count)
+
+        values['hpe3par_cpg'] = 'badCPG'
+        self._create_config(self.cinder_config_file, {section_name: values})
+        self.assertEqual('fail', check()[0]['cpg'])
+        self.assertEqual(3, get_cpgs.call_count)
+
+    def test_options_check_incremental_writes_results_once(self):
+        """Test options-check -incremental writes the results of every
+        section with a single write of the cache file per run."""
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\ncache_dir = %s\n' % cache_dir)
+        self._create_hpe3par_iscsi_cinder_conf(3)
+        self._mock_exec_command(
+            {'locate': 'cinder/volume/drivers/hpe/hpe_3par_iscsi'},
+            self.cinder_config_file)
+        save = self._patch('cinderdiags.cache.FileCache.save',
+                           autospec=True, side_effect=cache.FileCache.save)
+
+        def results_written():
+            return len([call for call in save.call_args_list
+                        if call[0][0].path.endswith('options_check.json')])
+
+        first = conf_reader.Reader(True).options_check(incremental=True)
+        self.assertEqual(3, len(first))
+        self.assertEqual(1, results_written())
+        stored = cache.FileCache('options_check', cache_dir).items()
+        self.assertEqual(3, len(stored))
+
+        second = conf_reader.Reader(True).options_check(incremental=True)
+        self.assertEqual(first, second)
+        self.assertEqual(1, results_written())
+
+    def test_wsapi_incremental_check_keys_replication_targets(self):
+        """Test a stored section result is not served once the serial
+        number of one of its replication targets changes."""
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        results = cache.FileCache('options_check', cache_dir, 3600)
+        target_url = 'http://target.ws.url:8080/api/v1'
+        self._create_hpe3par_iscsi_cinder_conf(1, {'3PAR-HPE-ISCSI-0': {
+            'replication_device': 'backend_id:target-1,'
+                                  'replication_mode:periodic,'
+                                  'cpg_map:testCPG:testCPG,'
+                                  'hpe3par_api_url:%s,'
+                                  'hpe3par_username:testuser,'
+                                  'hpe3par_password:testpass' % target_url}})
+
+        client_class = wsapi_checks.testclient.HPE3ParClient
+        target_serial = ['1111111']
+        get_info = client_class.getStorageSystemInfo
+
+        def get_storage_system_info(client):
+            info = get_info(client)
+            if client.api_url == target_url:
+                info['serialNumber'] = target_serial[0]
+            return info
+        def init(client, api_url):
+            client.api_url = api_url
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.__init__',
+                    new=init)
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.'
+                    'getStorageSystemInfo', autospec=True,
+                    side_effect=get_storage_system_info)
+        get_cpgs = self._patch(
+            'cinderdiags.hpe3par_testclient.HPE3ParClient.getCPGs',
+            autospec=True, side_effect=client_class.getCPGs)
+
+        def check():
+            return self._get_wsapi_checker(
+                results=results, include_replication_checks=True).check_all()
+
+        first = check()
+        self.assertEqual('pass', first[0]['cpg'])
+        self.assertIn('Backend ID:target-1;; WS API:pass;;',
+                      first[0]['replication_results'])
+        calls = get_cpgs.call_count
+        self.assertEqual(first, check())
+        self.assertEqual(calls, get_cpgs.call_count)
+
+        target_serial[0] = '2222222'
+        check()
+        self.assertTrue(get_cpgs.call_count > calls)
+
+    def test_replication_devices_parsed_in_one_pass(self):
+        """Test multi-line replication_device entries are parsed into one
+        dictionary per entry and listed in the conf items."""
+
+        conf = cinder_conf.CinderConf(
+            '[3PAR-HPE-ISCSI]\n'
+            'volume_driver = cinder.volume.drivers.hpe.hpe_3par_iscsi.'
+            'HPE3PARISCSIDriver\n'
+            'replication_device = backend_id:target-1,\n'
+            '    replication_mode:periodic,\n'
+            '    cpg_map:CPG-A:CPG-B CPG-C:CPG-D,\n'
+            '    hpe3par_api_url:https://10.0.0.1:8080/api/v1\n'
+            'replication_device = backend_id:target-2, replication_mode:sync\n'
+            '[OTHER]\n'
+            'volume_backend_name = other\n')
+
+        self.assertEqual(
+            [{'backend_id': 'target-1',
+              'replication_mode': 'periodic',
+              'cpg_map': 'CPG-A:CPG-B CPG-C:CPG-D',
+              'hpe3par_api_url': 'https://10.0.0.1:8080/api/v1'},
+             {'backend_id': 'target-2',
+              'replication_mode': 'sync'}],
+            conf.replication_devices('3PAR-HPE-ISCSI'))
+        self.assertEqual([], conf.replication_devices('OTHER'))
+        self.assertEqual(
+            conf.replication_devices('3PAR-HPE-ISCSI'),
+            cinder_conf.CinderConf.from_dict(
+                conf.to_dict()).replication_devices('3PAR-HPE-ISCSI'))
+
+        checker = wsapi_checks.WSChecker(mock.MagicMock(), conf,
+                                         'CINDER_TEST_NODE', True)
+        self.assertEqual(
+            'replication_device==backend_id=target-1;'
+            'replication_mode=periodic;cpg_map=CPG-A:CPG-B CPG-C:CPG-D;'
+            'hpe3par_api_url=https://10.0.0.1:8080/api/v1;;'
+            'replication_device==backend_id=target-2;'
+            'replication_mode=sync;;',
+            checker.format_replication_config_item_list('3PAR-HPE-ISCSI'))
+        self.assertEqual(['CPG-B', 'CPG-D'], checker.get_replication_cpgs(
+            conf.replication_devices('3PAR-HPE-ISCSI')[0],
+            on_replication_device=True))
+
+    def test_replication_targets_checked_concurrently(self):
+        """Test the replication targets of a section are validated at the
+        same time, timed, and their sessions logged out afterwards."""
+
+        section_name, values = \
+            self._get_default_hpe3par_iscsi_cinder_conf_section()
+        conf_text = '[%s]\n' % section_name
+        for option, value in values.items():
+            conf_text += '%s = %s\n' % (option, value)
+        for i in range(3):
+            conf_text += ('replication_device = backend_id:target-%d,'
+                          'replication_mode:periodic,'
+                          'cpg_map:testCPG:testCPG,'
+                          'hpe3par_api_url:http://test.ws.url:8080/api/v1,'
+                          'hpe3par_username:user-%d,'
+                          'hpe3par_password:testpass\n' % (i, i))
+        conf = cinder_conf.CinderConf(conf_text)
+
+        lock = threading.Lock()
+        calls = {'active': 0, 'peak': 0, 'logout': 0}
+        login = wsapi_checks.testclient.HPE3ParClient.login
+
+        def slow_login(client, username, password):
+            with lock:
+                calls['active'] += 1
+                calls['peak'] = max(calls['peak'], calls['active'])
+            threading.Event().wait(0.1)
+            with lock:
+                calls['active'] -= 1
+            return login(client, client.USERNAME, password)
+
+        def counted_logout(client):
+            with lock:
+                calls['logout'] += 1
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.login',
+                    new=slow_login)
+        self._patch('cinderdiags.hpe3par_testclient.HPE3ParClient.logout',
+                    new=counted_logout)
+
+        checker = wsapi_checks.WSChecker(mock.MagicMock(), conf,
+                                         'CINDER_TEST_NODE', True,
+                                         include_replication_checks=True,
+                                         max_workers=3,
+                                         max_per_array=4)
+        result = checker.check_all()[0]
+
+        self.assertEqual(3, calls['peak'])
+        self.assertEqual(4, calls['logout'])
+        for i in range(3):
+            self.assertIn('Backend ID:target-%d;; WS API:pass;; '
+                          'Credentials:pass;; Source CPGs:pass;; '
+                          'Destination CPGs:pass;;' % i,
+                          result['replication_results'])
+        self.assertEqual(set(['target-0', 'target-1', 'target-2']),
+                         set(result['replication_times']))
+        for seconds in result['replication_times'].values():
+            self.assertTrue(seconds >= 0.1)
+
+    def test_iter_nodes_yields_nodes_as_they_complete(self):
+        """Test node results are handed over as each node completes when
+        streaming, and in node order otherwise."""
+
+        reader = conf_reader.Reader(True, max_workers=2)
+        slow_done = threading.Event()
+
+        def check(node):
+            if node == 'SLOW':
+                threading.Event().wait(0.5)
+                slow_done.set()
+            return node
+
+        results = reader.iter_nodes(check, ['SLOW', 'FAST'], ordered=False)
+        self.assertEqual('FAST', next(results))
+        self.assertFalse(slow_done.is_set())
+        self.assertEqual(['SLOW'], list(results))
+
+        self.assertEqual(['SLOW', 'FAST'],
+                         reader.map_nodes(check, ['SLOW', 'FAST']))
+
+    def test_software_check_json_lines_output(self):
+        """Test software-check writes one JSON object per row with the
+        jsonl output format."""
+
+        self._mock_exec_command({
+            'cat /etc/*release': 'ID_LIKE=debian',
+            '${Package}': "sysfsutils install ok installed 2.2.0-1\n",
+            'pip list --format=json': '[]',
+        })
+        command_arvgs = ['software-check', '-software', 'sysfsutils',
+                         '-test']
+        cli_exit_value, output = self._execute_cli_command(
+            command_arvgs, isJsonLines=True)
+
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual(set(['NOVA_TEST_NODE', 'CINDER_TEST_NODE']),
+                         set(row['Node'] for row in output))
+        for row in output:
+            self.assertEqual('sysfsutils', row['Software'])
+            self.assertEqual('pass', row['Installed'])
+
+    def test_credentials_check_stream_releases_clients_when_closed(self):
+        """Test the SSH connections of a streamed credentials check go back
+        to the pool when the consumer stops early."""
+
+        reader = conf_reader.Reader(True)
+        rows = reader.iter_credentials_check()
+        self.assertEqual('pass', next(rows)['connect'])
+        self.assertEqual({}, ssh_pool.POOL.idle)
+        rows.close()
+        self.assertEqual(len(reader.all_nodes()),
+                         sum(len(entries)
+                             for entries in ssh_pool.POOL.idle.values()))
+
+    def test_software_check_sharded_across_processes(self):
+        """Test nodes are split into contiguous shards checked by worker
+        processes and listed in cli.conf order."""
+
+        self.assertEqual([['A', 'B'], ['C', 'D'], ['E']],
+                         conf_reader.shard(['A', 'B', 'C', 'D', 'E'], 3))
+        self.assertEqual([['A'], [], []], conf_reader.shard(['A'], 3))
+
+        cli_dict = {}
+        for i in range(6):
+            service = 'nova' if i % 2 else 'cinder'
+            cli_dict['NODE-%d' % i] = self._get_default_cli_conf_section(
+                service)
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        self._mock_exec_command({
+            'cat /etc/*release': 'ID_LIKE=debian',
+            '${Package}': "sysfsutils install ok installed 2.2.0-1\n",
+            'pip list --format=json': '[]',
+        })
+        pool = self._patch('multiprocessing.Pool',
+                           wraps=multiprocessing.Pool)
+
+        command_arvgs = ['software-check', '-software', 'sysfsutils',
+                         '-test', '-processes', '2']
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+
+        self.assertEqual(0, cli_exit_value)
+        pool.assert_called_once_with(2)
+        self.assertEqual(['NODE-1', 'NODE-3', 'NODE-5',
+                          'NODE-0', 'NODE-2', 'NODE-4'],
+                         [row['Node'] for row in output])
+        for row in output:
+            self.assertEqual('pass', row['Installed'])
+
+    def test_shards_split_array_limit_and_share_cache(self):
+        """Test worker processes divide wsapi_max_per_array between them
+        and do not lose each other's cache entries."""
+
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nwsapi_max_per_array = 5\n')
+        reader = conf_reader.Reader(True, processes=2)
+        reader.nova_nodes = ['NODE-0', 'NODE-1']
+        pool = self._patch('multiprocessing.Pool')
+        pool.return_value.map.return_value = []
+        self.assertEqual([], list(reader.iter_shards('options_check', ())))
+        jobs = pool.return_value.map.call_args[0][1]
+        self.assertEqual([{'wsapi_max_per_array': 2}] * 2,
+                         [job[1] for job in jobs])
+
+        self._patch('cinderdiags.conf_reader.Reader.options_check',
+                    autospec=True,
+                    side_effect=lambda reader: [reader.wsapi_max_per_array])
+        self.assertEqual([2], conf_reader.run_shard(jobs[0])[0])
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        def store_values(worker):
+            store = cache.FileCache('shared', cache_dir)
+            for i in range(20):
+                store.set('%d-%d' % (worker, i), i)
+        workers = [multiprocessing.Process(target=store_values, args=(i,))
+                   for i in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(80, len(cache.FileCache('shared',
+                                                 cache_dir).items()))
+
+    @unittest.skipIf(ssh_asyncio is None, 'asyncio transport needs Python 3')
+    def test_asyncio_ssh_transport(self):
+        """Test ssh_transport=asyncio connects through asyncssh on the shared
+        event loop and falls back to paramiko without it."""
+
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nssh_transport = asyncio\n')
+
+        self._patch('cinderdiags.ssh_asyncio.asyncssh', new=None)
+        reader = conf_reader.Reader(True)
+        self.assertIs(Client, reader.pool.client_class())
+
+        asyncssh = mock.MagicMock()
+        asyncssh.Error = type('Error', (Exception,), {})
+        asyncssh.PermissionDenied = type('PermissionDenied',
+                                         (asyncssh.Error,), {})
+        conn = mock.MagicMock()
+        conn.is_closed.return_value = False
+        conn.wait_closed = mock.AsyncMock()
+        conn.run = mock.AsyncMock(
+            side_effect=lambda command, check=False: mock.Mock(
+                stdout='out %s\n' % command, stderr='', exit_status=0))
+        asyncssh.connect = mock.AsyncMock(return_value=conn)
+        self._patch('cinderdiags.ssh_asyncio.asyncssh', new=asyncssh)
+
+        self.assertEqual([{'node': 'NOVA_TEST_NODE', 'connect': 'pass'},
+                          {'node': 'CINDER_TEST_NODE', 'connect': 'pass'}],
+                         reader.credentials_check())
+        self.assertEqual(2, asyncssh.connect.call_count)
+
+        client = reader.get_client('CINDER_TEST_NODE')
+        self.assertIs(ssh_asyncio.Client, type(client))
+        self.assertEqual('out hostname', client.get_host_name())
+        self.assertEqual([{'command': 'a', 'stdout': 'out a\n',
+                           'stderr': '', 'exit_code': 0},
+                          {'command': 'b', 'stdout': 'out b\n',
+                           'stderr': '', 'exit_code': 0}],
+                         client.execute_many(['a', 'b']))
+        client.disconnect()
+        self.assertFalse(client.is_active())
+        conn.close.assert_called_with()
+
+        ssh_pool.POOL.close()
+        asyncssh.connect.side_effect = asyncssh.PermissionDenied()
+        self.assertIsNone(reader.get_client('NOVA_TEST_NODE'))
+
+    @unittest.skipIf(ssh_asyncio is None, 'asyncio transport needs Python 3')
+    def test_asyncio_channels_and_loop_per_connection(self):
+        """Test the asyncio transport caps the channels of a connection
+        across threads, closes it on the loop thread and runs coroutines in
+        a forked process."""
+
+        usage = {'active': 0, 'peak': 0}
+
+        def run(command, check=False):
+            # runs on the loop thread, the command completes 0.05s later
+            usage['active'] += 1
+            usage['peak'] = max(usage['peak'], usage['active'])
+            loop = asyncio.get_event_loop()
+            result = loop.create_future()
+
+            def done():
+                usage['active'] -= 1
+                result.set_result(mock.Mock(stdout=command, stderr='',
+                                            exit_status=0))
+            loop.call_later(0.05, done)
+            return result
+
+        closed_on = []
+        asyncssh = mock.MagicMock()
+        asyncssh.Error = type('Error', (Exception,), {})
+        conn = mock.MagicMock()
+        conn.run = run
+        conn.wait_closed = mock.AsyncMock()
+        conn.close.side_effect = \
+            lambda: closed_on.append(threading.current_thread().name)
+        asyncssh.connect = mock.AsyncMock(return_value=conn)
+        self._patch('cinderdiags.ssh_asyncio.asyncssh', new=asyncssh)
+
+        client = ssh_asyncio.Client('host', 'user', 'password')
+        commands = ['command-%d' % i for i in range(constant.SSH_MAX_CHANNELS)]
+        threads = [threading.Thread(target=client.execute_many,
+                                    args=(commands,))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(constant.SSH_MAX_CHANNELS, usage['peak'])
+
+        client.disconnect()
+        self.assertEqual(['cinderdiags-ssh-loop'], closed_on)
+
+        def run_in_child():
+            os._exit(0 if ssh_asyncio.run(asyncio.sleep(0, 'done'), 5) ==
+                     'done' else 1)
+        child = multiprocessing.Process(target=run_in_child)
+        child.start()
+        child.join(10)
+        self.assertEqual(0, child.exitcode)
+
+    def test_software_check_profile(self):
+        """Test software-check -profile adds each node's phase times as a
+        Profile column and writes the timing table to stderr."""
+
+        self._mock_exec_command({
+            'cat /etc/*release': 'ID_LIKE=debian',
+            '${Package}': "sysfsutils install ok installed 2.2.0-1\n",
+            'pip list --format=json': '[]',
+        })
+        command_arvgs = ['software-check', '-software', 'sysfsutils',
+                         '-test', '-profile']
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            cli_exit_value, output = self._execute_cli_command(command_arvgs,
+                                                               isJson=True)
+
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual(2, len(output))
+        for row in output:
+            self.assertIn('connect', row['Profile'])
+            self.assertIn('ssh_execute', row['Profile'])
+            self.assertIn('package_check', row['Profile'])
+        table = stderr.getvalue()
+        self.assertIn('Phase', table)
+        self.assertIn('CINDER_TEST_NODE', table)
+        self.assertIn('NOVA_TEST_NODE', table)
+        # recording stops with the command
+        self.assertIsNone(profiler.ACTIVE)
+
+        profile = profiler.Profiler()
+        profile.record('node', 'connect', 0.5)
+        profile.merge([('node', 'connect', 2, 1.0), ('other', 'x', 1, 0.1)])
+        self.assertEqual({'connect': 1.5}, profile.node_times('node'))
+        self.assertIn(('node', 'connect', 3, 1.5), profile.export())
+
+    def test_wsapi_requests_counted_per_array(self):
+        """Test the fake 3PAR client counts each array's requests, which
+        the benchmark reports as WS API calls per array."""
+
+        self._create_hpe3par_iscsi_cinder_conf(3)
+
+        client_class = wsapi_checks.testclient.HPE3ParClient
+        client_class.reset_calls()
+        self.addCleanup(client_class.reset_calls)
+        checker = self._get_wsapi_checker()
+        checker.check_all()
+
+        url = client_class.API_URL
+        self.assertEqual({(url, 'login'): 1,
+                          (url, 'getCPGs'): 1,
+                          (url, 'getPorts'): 1,
+                          (url, 'logout'): 1},
+                         dict(client_class.calls))
+
+    def test_volume_paths_resolved_in_one_batch(self):
+        """Test volume-paths-check lists the iSCSI and FC paths in one round
+        trip, resolves the paths of all attached volumes in another and joins
+        them by device path."""
+
+        iscsi = ['/dev/disk/by-path/ip-1.1.1.1:3260-iscsi-iqn-lun-%d' % lun
+                 for lun in range(3)]
+        fc = '/dev/disk/by-path/pci-0000:05:00.0-fc-0x2021-lun-3'
+        self._mock_exec_command({})
+        responses = {
+            "--protocol 'ISCSI'": '\n'.join(iscsi) + '\n',
+            "--protocol 'FIBRE_CHANNEL'": fc + '\n',
+            'get-volume-paths vol-a': iscsi[0] + '\n',
+            'get-volume-paths vol-b': iscsi[2],
+        }
+
+        def execute_many(client, commands, timeout=20):
+            return [{'command': command,
+                     'stdout': [responses[key] for key in responses
+                                if key in command][0],
+                     'stderr': '',
+                     'exit_code': 0} for command in commands]
+        batch = self._patch('cinderdiags.ssh_client.Client.execute_many',
+                            autospec=True, side_effect=execute_many)
+
+        command_arvgs = ['volume-paths-check', '-test',
+                         '-os-vars', json.dumps({'os_username': 'admin',
+                                                 'os_password': 'admin',
+                                                 'os_tenant': 'admin',
+                                                 'os_auth': 'http://auth'}),
+                         '-attached-volumes', json.dumps(['vol-a', 'vol-b'])]
+        cli_exit_value, output = self._execute_cli_command(command_arvgs,
+                                                           isJson=True)
+
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual([(iscsi[0], 'vol-a'), (iscsi[1], None),
+                          (iscsi[2], 'vol-b'), (fc, None)],
+                         [(row['Path'], row['Attached Volume'])
+                          for row in output])
+        # one round trip lists both protocols, one resolves both volumes
+        self.assertEqual(2, batch.call_count)
+        self.assertEqual([2, 2], [len(call[0][1])
+                                  for call in batch.call_args_list])
+
+    def test_volume_paths_listed_in_one_round_trip_per_node(self):
+        """Test the iSCSI and FC paths of a node using both transports are
+        listed with a single execute_many call and no execute call."""
+
+        iscsi = '/dev/disk/by-path/ip-1.1.1.1:3260-iscsi-iqn-lun-1'
+        fc = '/dev/disk/by-path/pci-0000:05:00.0-fc-0x2021-lun-2'
+        client = mock.MagicMock()
+        client.execute_many.side_effect = lambda commands: [
+            {'command': command,
+             'stdout': iscsi if "'ISCSI'" in command else fc,
+             'stderr': '',
+             'exit_code': 0} for command in commands]
+
+        paths = lun_stats.get_all_paths(
+            client, 'NOVA_TEST_NODE',
+            json.dumps({'os_username': 'admin', 'os_password': 'admin',
+                        'os_tenant': 'admin', 'os_auth': 'http://auth'}))
+
+        self.assertEqual([(iscsi, 'ISCSI'), (fc, 'FIBRE_CHANNEL')],
+                         [(path['path'], path['protocol'])
+                          for path in paths])
+        self.assertEqual(1, client.execute_many.call_count)
+        self.assertFalse(client.execute.called)
+
+    def test_volume_paths_discovered_from_sysfs(self):
+        """Test volume-paths-check -discovery sysfs reads the paths from
+        /dev/disk/by-path and sysfs in one round trip, and only asks the
+        cinder CLI for the attached volume names."""
+
+        iscsi = '/dev/disk/by-path/ip-1.1.1.1:3260-iscsi-iqn-lun-1'
+        fc = '/dev/disk/by-path/pci-0000:05:00.0-fc-0x2021-lun-2'
+        self._mock_exec_command({})
+        responses = {
+            lun_stats.BY_PATH_QUERY: '%s ../../sdb\n%s-part1 ../../sdb1\n'
+                                     '%s ../../sdc\n'
+                                     '/dev/disk/by-path/pci-0000:00:1f.2-ata-1'
+                                     ' ../../sda\n' % (iscsi, iscsi, fc),
+            lun_stats.HOLDERS_QUERY: '/sys/block/sdb/holders dm-0\n',
+            lun_stats.MULTIPATH_QUERY: '/sys/block/dm-0/dm/name:mpatha\n',
+            'get-volume-paths vol-a': fc + '\n',
+        }
+
+        def execute_many(client, commands, timeout=20):
+            return [{'command': command,
+                     'stdout': [responses[key] for key in responses
+                                if key in command][0],
+                     'stderr': '',
+                     'exit_code': 0} for command in commands]
+        batch = self._patch('cinderdiags.ssh_client.Client.execute_many',
+                            autospec=True, side_effect=execute_many)
+
+        reader = conf_reader.Reader(True)
+        paths = reader.volume_paths_check(None, json.dumps(['vol-a']),
+                                          'sysfs')
+
+        self.assertEqual([{'path': iscsi, 'vol_name': None,
+                           'protocol': 'ISCSI', 'device': 'sdb',
+                           'multipath': 'mpatha', 'node': 'NOVA_TEST_NODE'},
+                          {'path': fc, 'vol_name': 'vol-a',
+                           'protocol': 'FIBRE_CHANNEL', 'device': 'sdc',
+                           'multipath': None, 'node': 'NOVA_TEST_NODE'}],
+                         paths)
+        self.assertEqual(2, batch.call_count)
+        self.assertFalse(any('get-all-volume-paths' in command
+                             for call in batch.call_args_list
+                             for command in call[0][1]))
+
+    def test_volume_paths_use_one_keystone_token(self):
+        """Test volume-paths-check gets one Keystone token for the run when
+        keystone_token is enabled and every cinder call uses it instead of
+        the -os-vars password."""
+
+        cli_dict = {}
+        for i in range(3):
+            cli_dict['NOVA-%d' % i] = self._get_default_cli_conf_section(
+                'nova')
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        self._mock_exec_command({})
+        commands = []
+        lock = threading.Lock()
+
+        def execute_many(client, batch, timeout=20):
+            with lock:
+                commands.extend(batch)
+            return [{'command': command, 'stdout': '', 'stderr': '',
+                     'exit_code': 0} for command in batch]
+        self._patch('cinderdiags.ssh_client.Client.execute_many',
+                    autospec=True, side_effect=execute_many)
+        get_token = self._patch('cinderdiags.keystone.get_token',
+                                return_value={'token': 'gAAAA-token',
+                                              'url': 'http://cinder/v3',
+                                              'expires': time.time() + 3600})
+
+        os_vars = json.dumps({'os_username': 'demo',
+                              'os_password': 's3cret',
+                              'os_tenant': 'demo',
+                              'os_auth': 'http://auth'})
+
+        # by default the nodes authenticate with the credentials
+        reader = conf_reader.Reader(True)
+        reader.volume_paths_check(os_vars, json.dumps(['vol-a']))
+        self.assertFalse(get_token.called)
+        self.assertEqual(9, len(commands))
+        for command in commands:
+            self.assertIn('export OS_PASSWORD=s3cret;', command)
+
+        del commands[:]
+        with open(constant.TEST_CLI_CONFIG, 'a') as conf:
+            conf.write('\n[DEFAULT]\nkeystone_token = true\n')
+        reader = conf_reader.Reader(True)
+        reader.volume_paths_check(os_vars, json.dumps(['vol-a']))
+
+        self.assertEqual(1, get_token.call_count)
+        self.assertEqual(constant.KEYSTONE_TIMEOUT,
+                         get_token.call_args[0][2])
+        # two path listings and one volume lookup per node
+        self.assertEqual(9, len(commands))
+        for command in commands:
+            self.assertIn('export OS_TOKEN=gAAAA-token; '
+                          'export OS_URL=http://cinder/v3;', command)
+            self.assertNotIn('s3cret', command)
+            self.assertNotIn('hpinvent', command)
+
+    def test_keystone_token_cached_until_expiry(self):
+        """Test a cached Keystone token is reused until shortly before it
+        expires, and the password exports are used without a token."""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        token_cache = cache.FileCache('keystone_token', directory, 3600)
+        os_vars = {'os_username': 'demo', 'os_password': 'pa ss',
+                   'os_tenant': 'demo', 'os_auth': 'http://auth'}
+
+        generic = self._patch('cinderdiags.keystone.generic')
+        session = self._patch('cinderdiags.keystone.session')
+        access = generic.Password.return_value.get_access.return_value
+        access.auth_token = 'token-1'
+        access.expires = datetime.datetime.utcfromtimestamp(
+            time.time() + 3600)
+        session.Session.return_value.get_endpoint.return_value = 'http://v3'
+
+        self.assertEqual("export OS_TOKEN=token-1; export OS_URL=http://v3;",
+                         keystone.os_env(os_vars, token_cache, True))
+        session.Session.assert_called_once_with(
+            auth=generic.Password.return_value,
+            timeout=constant.KEYSTONE_TIMEOUT)
+        self.assertEqual('token-1',
+                         keystone.get_token(os_vars, token_cache)['token'])
+        self.assertEqual(1, generic.Password.call_count)
+
+        # a token about to expire is not reused
+        key = keystone.cache_key(os_vars)
+        token_cache.set(key, {'token': 'old', 'url': 'http://v3',
+                              'expires': time.time() + 10})
+        self.assertEqual('token-1',
+                         keystone.get_token(os_vars, token_cache)['token'])
+        self.assertEqual(2, generic.Password.call_count)
+
+        password_env = ("export OS_USERNAME=demo; "
+                        "export OS_PASSWORD='pa ss'; "
+                        "export OS_TENANT_NAME=demo; "
+                        "export OS_AUTH_URL=http://auth;")
+        self.assertEqual(password_env, keystone.os_env(os_vars, token_cache))
+        self.assertEqual(2, generic.Password.call_count)
+        generic.Password.side_effect = Exception('unreachable')
+        self.assertEqual(password_env, keystone.os_env(os_vars, None, True))
+        self.assertEqual('', keystone.os_env(None))
+
+    def test_volume_paths_check_with_incomplete_os_vars(self):
+        """Test -os-vars that are not an object or miss a credential are
+        reported and the nodes use their own environment instead."""
+
+        self._mock_exec_command({})
+        commands = []
+
+        def execute_many(client, batch, timeout=20):
+            commands.extend(batch)
+            return [{'command': command,
+                     'stdout': '/dev/disk/by-path/ip-iscsi-lun-1\n'
+                     if "'ISCSI'" in command else '',
+                     'stderr': '', 'exit_code': 0} for command in batch]
+        self._patch('cinderdiags.ssh_client.Client.execute_many',
+                    autospec=True, side_effect=execute_many)
+
+        for os_vars in ({'os_username': 'demo', 'os_password': 'demo',
+                         'os_auth': 'http://auth'},
+                        ['demo', 'demo', 'demo', 'http://auth'],
+                        'demo'):
+            del commands[:]
+            reader = conf_reader.Reader(True)
+            self.assertEqual('', reader.openstack_env(json.dumps(os_vars)))
+            paths = reader.volume_paths_check(json.dumps(os_vars))
+            self.assertEqual(['/dev/disk/by-path/ip-iscsi-lun-1'],
+                             [path['path'] for path in paths])
+            self.assertEqual(2, len(commands))
+            for command in commands:
+                self.assertNotIn('export', command)
+
+    def test_volume_index_lookup_commands(self):
+        """Test volume-paths-check records the paths of every nova node in
+        the volume index, and volume-lookup and host-paths answer from it
+        without connecting to the nodes."""
+
+        cli_dict = {}
+        for i in range(2):
+            cli_dict['NOVA-%d' % i] = self._get_default_cli_conf_section(
+                'nova')
+            cli_dict['NOVA-%d' % i]['host_ip'] = '10.0.0.%d' % i
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        self._mock_exec_command({})
+
+        def execute_many(client, commands, timeout=20):
+            lun = client.host_name[-1]
+            results = []
+            for command in commands:
+                if "--protocol 'ISCSI'" in command:
+                    stdout = '/dev/disk/by-path/ip-iscsi-lun-%s\n' % lun
+                elif 'FIBRE_CHANNEL' in command:
+                    stdout = '/dev/disk/by-path/pci-fc-lun-%s\n' % lun
+                elif command.endswith('vol-%s' % lun):
+                    stdout = '/dev/disk/by-path/ip-iscsi-lun-%s\n' % lun
+                else:
+                    stdout = ''
+                results.append({'command': command, 'stdout': stdout,
+                                'stderr': '', 'exit_code': 0})
+            return results
+        self._patch('cinderdiags.ssh_client.Client.execute_many',
+                    autospec=True, side_effect=execute_many)
+
+        command_arvgs = ['volume-paths-check', '-test',
+                         '-attached-volumes', json.dumps(['vol-0', 'vol-1'])]
+        cli_exit_value, output = self._execute_cli_command(command_arvgs,
+                                                           isJson=True)
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual(4, len(output))
+
+        connect = self._patch('paramiko.SSHClient')
+        command_arvgs = ['volume-lookup', 'vol-1', '-test']
+        cli_exit_value, output = self._execute_cli_command(command_arvgs,
+                                                           isJson=True)
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual([('vol-1', 'NOVA-1', '10.0.0.1', 'ISCSI',
+                           '/dev/disk/by-path/ip-iscsi-lun-1')],
+                         [(row['Volume'], row['Node'], row['Host IP'],
+                           row['Protocol'], row['Path']) for row in output])
+
+        command_arvgs = ['host-paths', '10.0.0.0', '-test']
+        cli_exit_value, output = self._execute_cli_command(command_arvgs,
+                                                           isJson=True)
+        self.assertEqual(0, cli_exit_value)
+        self.assertEqual([('ISCSI', 'vol-0'), ('FIBRE_CHANNEL', None)],
+                         [(row['Protocol'], row['Attached Volume'])
+                          for row in output])
+
+        command_arvgs = ['host-paths', 'NOVA-0', '-protocol',
+                         'FIBRE_CHANNEL', '-test']
+        cli_exit_value, output = self._execute_cli_command(command_arvgs,
+                                                           isJson=True)
+        self.assertEqual(['/dev/disk/by-path/pci-fc-lun-0'],
+                         [row['Path'] for row in output])
+        self.assertFalse(connect.called)
+
+        command_arvgs = ['volume-lookup', 'vol-9', '-test']
+        cli_exit_value, output = self._execute_cli_command(command_arvgs)
+        self.assertEqual(1, cli_exit_value)
+
+    def test_volume_index_keeps_nodes_that_fail_to_connect(self):
+        """Test volume-paths-check only replaces the index entries of the
+        nodes it could check, and keeps those of a node it could not
+        connect to."""
+
+        cli_dict = {}
+        for i in range(2):
+            cli_dict['NOVA-%d' % i] = self._get_default_cli_conf_section(
+                'nova')
+            cli_dict['NOVA-%d' % i]['host_ip'] = '10.0.0.%d' % i
+        self._create_config(constant.TEST_CLI_CONFIG, cli_dict)
+        self._mock_exec_command({})
+        client_mock = paramiko.SSHClient.return_value
+        sweep = {'number': 1}
+
+        def execute_many(client, commands, timeout=20):
+            stdout = '/dev/disk/by-path/ip-iscsi-lun-%s-%d\n' % (
+                client.host_name[-1], sweep['number'])
+            return [{'command': command,
+                     'stdout': stdout if "'ISCSI'" in command else '',
+                     'stderr': '', 'exit_code': 0} for command in commands]
+        self._patch('cinderdiags.ssh_client.Client.execute_many',
+                    autospec=True, side_effect=execute_many)
+
+        self.assertEqual(2, len(conf_reader.Reader(True).volume_paths_check(
+            None)))
+        ssh_pool.POOL.close()
+
+        def connect(host, **kwargs):
+            if host == '10.0.0.1':
+                raise socket.timeout('timed out')
+        client_mock.connect.side_effect = connect
+        sweep['number'] = 2
+        self.assertEqual(['/dev/disk/by-path/ip-iscsi-lun-0-2'],
+                         [path['path'] for path in conf_reader.Reader(
+                             True).volume_paths_check(None)])
+
+        index = conf_reader.Reader(True).volume_index
+        self.assertEqual(['/dev/disk/by-path/ip-iscsi-lun-0-2'],
+                         [record['path'] for record in index.host('NOVA-0')])
+        self.assertEqual(['/dev/disk/by-path/ip-iscsi-lun-1-1'],
+                         [record['path'] for record in index.host('NOVA-1')])
+
 
 suite = unittest.TestLoader().loadTestsFromTestCase(
     CinderDiagnostics3PARCliToolTest)